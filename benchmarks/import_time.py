@@ -0,0 +1,97 @@
+"""Import-time regression check for the CLI and the light modules.
+
+Each module is imported in a fresh interpreter with `-X importtime`; the check
+fails if its cumulative import time goes over the budget or if it pulls in a
+heavy dependency that should only be loaded on use:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget-ms 150 --repeats 5
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+SOURCE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "src", "podcaster"
+)
+
+# modules that must stay cheap to import, with the heavy packages they must not load
+CHECKS: Dict[str, Tuple[str, ...]] = {
+    "main": (
+        "moviepy",
+        "numpy",
+        "PIL",
+        "langchain_openai",
+        "elevenlabs.client",
+        "pydantic_settings",
+    ),
+    "core.metrics": ("moviepy", "numpy", "pydantic_settings"),
+    "core.ffmpeg": ("moviepy",),
+    "core.video": ("moviepy",),
+    "core.render": ("moviepy",),
+    "core.karaoke": ("moviepy",),
+    "providers.openai": ("langchain_openai", "langchain_core"),
+    "providers.elevenlabs": ("elevenlabs.client",),
+}
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)")
+
+
+def measure(module: str) -> Tuple[float, List[str]]:
+    """Import a module in a fresh interpreter.
+    Args:
+        module (str): Dotted module name, relative to src/podcaster.
+    Returns:
+        Tuple[float, List[str]]: Cumulative import time in ms and all imported modules.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SOURCE_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative_us = 0
+    imported = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            imported.append(match.group(3))
+            if match.group(3) == module:
+                cumulative_us = int(match.group(2))
+    return cumulative_us / 1000, imported
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="Budget of main")
+    parser.add_argument("--repeats", type=int, default=3, help="Best of N imports")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module, forbidden in CHECKS.items():
+        best = float("inf")
+        for _ in range(args.repeats):
+            ms, imported = measure(module)
+            best = min(best, ms)
+        loaded = sorted(
+            name
+            for name in forbidden
+            if any(m == name or m.startswith(name + ".") for m in imported)
+        )
+        over = module == "main" and best > args.budget_ms
+        status = "FAIL" if loaded or over else "ok"
+        failed |= status == "FAIL"
+        details = f" loads {', '.join(loaded)}" if loaded else ""
+        if over:
+            details += f" over budget of {args.budget_ms:.0f} ms"
+        print(f"{status:4} {module:24} {best:8.1f} ms{details}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
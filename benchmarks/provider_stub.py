@@ -0,0 +1,165 @@
+"""Throughput of the TTS client against a local, rate-limited HTTP stub.
+
+The stub answers the ElevenLabs `with-timestamps` endpoint after a fixed
+latency and returns 429 with `Retry-After` above a request rate, like the real
+provider. Concurrent requests are sent once with a fresh client per request
+and the SDK's own retries (how clients used to be built), and once through
+`SpeechSynthesizer` with the shared provider session and its limiter:
+
+    python benchmarks/provider_stub.py
+    python benchmarks/provider_stub.py --requests 200 --limit 30 --threads 16
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from synthetic import synthetic_alignment
+
+SILENT_FRAME = base64.b64encode(b"\xff\xfb\x90\x00" + bytes(413)).decode("ascii")
+
+
+class StubServer(ThreadingHTTPServer):
+    """TTS stub allowing `limit` requests per second over a sliding window."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, limit: int, latency: float):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.limit = limit
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.accepted: deque = deque()
+        self.stats = {"ok": 0, "throttled": 0, "connections": 0}
+
+    def admit(self) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            while self.accepted and self.accepted[0] <= now - 1.0:
+                self.accepted.popleft()
+            if len(self.accepted) >= self.limit:
+                self.stats["throttled"] += 1
+                return False
+            self.accepted.append(now)
+            self.stats["ok"] += 1
+            return True
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.stats["connections"] += 1
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if not self.server.admit():
+            self._send(429, {"detail": "too many requests"}, {"Retry-After": "1"})
+            return
+        time.sleep(self.server.latency)
+        alignment = synthetic_alignment(len(body["text"])).model_dump()
+        self._send(
+            200,
+            {
+                "audio_base64": SILENT_FRAME,
+                "alignment": alignment,
+                "normalized_alignment": alignment,
+            },
+        )
+
+    def _send(self, status: int, payload: dict, headers: dict | None = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def run(name: str, server: StubServer, convert, requests: int, threads: int) -> dict:
+    time.sleep(1.0)  # let the previous case leave the stub's window
+    server.stats.update(ok=0, throttled=0, connections=0)
+    texts = [f"Request number {i} of the benchmark." for i in range(requests)]
+    failures = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for future in [pool.submit(convert, text) for text in texts]:
+            try:
+                future.result()
+            except Exception:
+                failures += 1
+    seconds = time.perf_counter() - start
+    result = {
+        "case": name,
+        "seconds": round(seconds, 3),
+        "requests_per_second": round((requests - failures) / seconds, 2),
+        "failures": failures,
+        "throttled": server.stats["throttled"],
+        "connections": server.stats["connections"],
+    }
+    print(json.dumps(result))
+    return result
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=120)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--limit", type=int, default=20, help="Stub requests/s")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub seconds")
+    args = parser.parse_args(argv)
+
+    server = StubServer(args.limit, args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    os.environ.update(
+        ELEVENLABS_API_KEY="stub",
+        ELEVENLABS_MODEL_ID="stub",
+        ELEVENLABS_MALE_VOICE_ID="male",
+        ELEVENLABS_FEMALE_VOICE_ID="female",
+        ELEVENLABS_SPEED="1.0",
+        ELEVENLABS_BASE_URL=base_url,
+        # a little under the stub's limit
+        ELEVENLABS_REQUESTS_PER_MINUTE=str(args.limit * 60 * 0.95),
+        ELEVENLABS_MAX_CONNECTIONS=str(args.threads),
+    )
+    from elevenlabs import ElevenLabs
+
+    from providers.elevenlabs import SpeechSynthesizer
+
+    def fresh_client(text: str):
+        client = ElevenLabs(api_key="stub", base_url=base_url)
+        return client.text_to_speech.convert_with_timestamps(
+            voice_id="female", text=text, model_id="stub"
+        )
+
+    synthesizer = SpeechSynthesizer(use_cache=False)
+
+    run("fresh_client", server, fresh_client, args.requests, args.threads)
+
+    def shared_session(text: str):
+        return synthesizer._convert(text, synthesizer.female_voice_id)
+
+    run("shared_session", server, shared_session, args.requests, args.threads)
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
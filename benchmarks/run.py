@@ -0,0 +1,500 @@
+"""Offline benchmarks of the alignment -> segment -> render -> encode hot paths.
+
+Every case runs in a fresh process, so its peak RSS is its own. Results are
+written as JSON so that runs of different versions can be compared:
+
+    python benchmarks/run.py --output bench_results.json
+    python benchmarks/run.py --quick --only alignment_to_words
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List
+
+from synthetic import (
+    FakeSpeechSynthesizer,
+    FakeStoryTeller,
+    make_background,
+    make_silence,
+    synthetic_alignment,
+)
+
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+
+def _best_of(repeats: int, func: Callable[[], object]) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_alignment_to_words(n_chars: int, repeats: int, **_) -> Dict:
+    from core.karaoke import alignment_to_words
+
+    al = synthetic_alignment(n_chars)
+    args = (
+        al.characters,
+        al.character_start_times_seconds,
+        al.character_end_times_seconds,
+    )
+    words = alignment_to_words(*args)
+    seconds = _best_of(repeats, lambda: alignment_to_words(*args))
+    return {"seconds": seconds, "words_per_s": len(words) / seconds}
+
+
+def bench_words_to_segments(n_chars: int, repeats: int, **_) -> Dict:
+    from core.karaoke import alignment_to_words, words_to_segments
+
+    al = synthetic_alignment(n_chars)
+    words = alignment_to_words(
+        al.characters, al.character_start_times_seconds, al.character_end_times_seconds
+    )
+    seconds = _best_of(repeats, lambda: words_to_segments(words))
+    return {"seconds": seconds, "words_per_s": len(words) / seconds}
+
+
+def bench_segments_to_two_lines(n_chars: int, repeats: int, **_) -> Dict:
+    from core.karaoke import alignment_to_words, segments_to_two_lines
+    from core.karaoke import words_to_segments
+
+    al = synthetic_alignment(n_chars)
+    words = alignment_to_words(
+        al.characters, al.character_start_times_seconds, al.character_end_times_seconds
+    )
+    segments = words_to_segments(words)
+    seconds = _best_of(repeats, lambda: segments_to_two_lines(segments, 20))
+    return {"seconds": seconds, "words_per_s": len(words) / seconds}
+
+
+def bench_alignment_to_two_lines(n_chars: int, repeats: int, **_) -> Dict:
+    from core.karaoke import alignment_to_two_lines
+
+    al = synthetic_alignment(n_chars)
+    two_lines = alignment_to_two_lines(al, 60, 2.8, 20)
+    n_words = sum(len(seg.words) for seg in two_lines)
+    seconds = _best_of(repeats, lambda: alignment_to_two_lines(al, 60, 2.8, 20))
+    return {"seconds": seconds, "words_per_s": n_words / seconds}
+
+
+def bench_render_two_line_image(n_chars: int, width: int, **_) -> Dict:
+    from core import karaoke
+    from core.karaoke import ImageCache, alignment_to_two_lines
+
+    two_lines = alignment_to_two_lines(synthetic_alignment(n_chars))
+    calls = [
+        (tuple(w.text for w in seg.words), seg.cut_index, hi)
+        for seg in two_lines
+        for hi in range(len(seg.words))
+    ]
+    font_size = max(18, int(width * 16 / 9 * 0.06))
+    cache = ImageCache()
+
+    def render_all():
+        for words, cut_index, hi in calls:
+            karaoke.render_two_line_image(
+                words, cut_index, hi, width, FONT_PATH, font_size, cache
+            )
+
+    # cold: nothing cached, neither fonts, layouts, glyphs nor images
+    karaoke.load_font.cache_clear()
+    karaoke.layout_two_lines.cache_clear()
+    karaoke.render_word.cache_clear()
+    cold = _best_of(1, render_all)
+    warm = _best_of(1, render_all)
+    return {
+        "images": len(calls),
+        "cold_seconds": cold,
+        "warm_seconds": warm,
+        "cold_images_per_s": len(calls) / cold,
+        "warm_images_per_s": len(calls) / warm,
+        "cache_hits": cache.stats.hits,
+        "cache_misses": cache.stats.misses,
+    }
+
+
+def bench_burn_karaoke_moviepy(
+    duration: float, width: int, height: int, fps: int, work_dir: str, **_
+) -> Dict:
+    from core.karaoke import burn_karaoke_moviepy
+
+    background = make_background(
+        os.path.join(work_dir, "background.mp4"), duration, width, height, fps
+    )
+    alignment = synthetic_alignment(int(duration * 15))
+    output = os.path.join(work_dir, "burned.mp4")
+    seconds = _best_of(
+        1, lambda: burn_karaoke_moviepy(background, alignment, output, FONT_PATH)
+    )
+    frames = int(duration * fps)
+    return {"seconds": seconds, "frames": frames, "frames_per_s": frames / seconds}
+
+
+def bench_background_library(
+    duration: float, width: int, height: int, fps: int, work_dir: str, **_
+) -> Dict:
+    from core.backgrounds import BackgroundLibrary, TranscodeProfile
+    from core.backgrounds import fit_asset_to_audio
+    from core.ffmpeg import run_ffmpeg
+    from core.video import fit_video_to_audio
+
+    # a source at twice the target size, as stock footage usually is
+    source = make_background(
+        os.path.join(work_dir, "source.mp4"), duration, 2 * width, 2 * height, fps
+    )
+    audio = make_silence(os.path.join(work_dir, "speech.mp3"), duration * 0.8)
+    library = BackgroundLibrary(
+        os.path.join(work_dir, "library"),
+        TranscodeProfile(width=width, height=height, fps=fps, preset="veryfast"),
+    )
+    transcode = _best_of(1, lambda: library.add(source))
+    asset = library.get(source)
+
+    def job(fit) -> None:
+        # the fit and the decode the render does on its output
+        output = os.path.join(work_dir, "fitted.mp4")
+        fit(output)
+        run_ffmpeg(["-i", output, "-f", "null", "-"])
+
+    raw = _best_of(1, lambda: job(lambda out: fit_video_to_audio(source, audio, out)))
+    indexed = _best_of(
+        1,
+        lambda: job(
+            lambda out: fit_asset_to_audio(
+                asset, audio, out, start=asset.random_start("bench")
+            )
+        ),
+    )
+    return {
+        "transcode_seconds": transcode,
+        "raw_job_seconds": raw,
+        "library_job_seconds": indexed,
+        "speedup": raw / indexed,
+    }
+
+
+def bench_formats(
+    duration: float, width: int, height: int, fps: int, work_dir: str, **_
+) -> Dict:
+    from core.formats import OutputProfile, render_karaoke_formats
+    from core.render import render_karaoke_video
+
+    background = make_background(
+        os.path.join(work_dir, "background.mp4"), duration, width, height, fps
+    )
+    audio = make_silence(os.path.join(work_dir, "speech.mp3"), duration)
+    alignment = synthetic_alignment(int(duration * 15))
+    profiles = [
+        OutputProfile(width, height),
+        OutputProfile(height, width, fit="pad", y_pos_ratio=0.8),
+        OutputProfile(width, width, fps=24, font_size_ratio=0.05),
+    ]
+    outputs = {
+        os.path.join(work_dir, f"format_{i}.mp4"): p for i, p in enumerate(profiles)
+    }
+    single = _best_of(
+        1,
+        lambda: render_karaoke_video(
+            background,
+            audio,
+            alignment,
+            os.path.join(work_dir, "single.mp4"),
+            FONT_PATH,
+        ),
+    )
+    multi = _best_of(
+        1,
+        lambda: render_karaoke_formats(
+            background, audio, alignment, outputs, FONT_PATH
+        ),
+    )
+    return {
+        "formats": len(profiles),
+        "single_seconds": single,
+        "multi_seconds": multi,
+        "cost_in_single_renders": multi / single,
+    }
+
+
+def bench_draft(
+    duration: float, width: int, height: int, fps: int, work_dir: str, **_
+) -> Dict:
+    from core.draft import render_contact_sheet, render_karaoke_draft
+    from core.render import render_karaoke_video
+
+    background = make_background(
+        os.path.join(work_dir, "background.mp4"), duration, width, height, fps
+    )
+    audio = make_silence(os.path.join(work_dir, "speech.mp3"), duration)
+    alignment = synthetic_alignment(int(duration * 15))
+    args = (background, audio, alignment)
+
+    final = _best_of(
+        1,
+        lambda: render_karaoke_video(
+            *args, os.path.join(work_dir, "final.mp4"), FONT_PATH
+        ),
+    )
+    draft = _best_of(
+        1,
+        lambda: render_karaoke_draft(
+            *args, os.path.join(work_dir, "draft.mp4"), FONT_PATH
+        ),
+    )
+    sheet = _best_of(
+        1,
+        lambda: render_contact_sheet(
+            *args, os.path.join(work_dir, "sheet.png"), FONT_PATH
+        ),
+    )
+    return {
+        "final_seconds": final,
+        "draft_seconds": draft,
+        "sheet_seconds": sheet,
+        "draft_speedup": final / draft,
+        "sheet_speedup": final / sheet,
+    }
+
+
+def bench_pipe(
+    duration: float, width: int, height: int, fps: int, work_dir: str, **_
+) -> Dict:
+    from core.render import render_karaoke_video
+
+    background = make_background(
+        os.path.join(work_dir, "background.mp4"), duration, width, height, fps
+    )
+    audio = make_silence(os.path.join(work_dir, "speech.mp3"), duration)
+    alignment = synthetic_alignment(int(duration * 15))
+
+    def render(backend: str) -> float:
+        return _best_of(
+            1,
+            lambda: render_karaoke_video(
+                background,
+                audio,
+                alignment,
+                os.path.join(work_dir, f"{backend}.mp4"),
+                FONT_PATH,
+                backend=backend,
+            ),
+        )
+
+    moviepy = render("moviepy")
+    pipe = render("pipe")
+    frames = int(duration * fps)
+    return {
+        "frames": frames,
+        "moviepy_frames_per_s": frames / moviepy,
+        "pipe_frames_per_s": frames / pipe,
+        "speedup": moviepy / pipe,
+    }
+
+
+def bench_overlay(
+    duration: float, width: int, height: int, fps: int, work_dir: str, **_
+) -> Dict:
+    from core.overlay import render_caption_overlay, render_caption_track
+    from core.render import render_karaoke_video
+
+    # the track is rendered without a background, then composited onto one
+    background = make_background(
+        os.path.join(work_dir, "background.mp4"), duration, width, height, fps
+    )
+    audio = make_silence(os.path.join(work_dir, "speech.mp3"), duration)
+    alignment = synthetic_alignment(int(duration * 15))
+    track_path = os.path.join(work_dir, "captions.npz")
+
+    def full(backend: str) -> float:
+        return _best_of(
+            1,
+            lambda: render_karaoke_video(
+                background,
+                audio,
+                alignment,
+                os.path.join(work_dir, f"{backend}.mp4"),
+                FONT_PATH,
+                backend=backend,
+            ),
+        )
+
+    moviepy = full("moviepy")
+    pipe = full("pipe")
+    track = _best_of(
+        1,
+        lambda: render_caption_track(
+            alignment, track_path, width, height, FONT_PATH, fps=fps
+        ),
+    )
+    swap = _best_of(
+        1,
+        lambda: render_caption_overlay(
+            background, audio, track_path, os.path.join(work_dir, "swap.mp4")
+        ),
+    )
+    return {
+        "moviepy_render_seconds": moviepy,
+        "pipe_render_seconds": pipe,
+        "track_seconds": track,
+        "track_kb": os.path.getsize(track_path) / 1024,
+        "swap_seconds": swap,
+        "swap_speedup": moviepy / swap,
+    }
+
+
+def bench_pipeline(
+    duration: float, width: int, height: int, fps: int, work_dir: str, **_
+) -> Dict:
+    from graphs.graph import ArtifactStore
+    from main import StageLimits, run_job
+    from models.schemas import JobSchema
+
+    background = make_background(
+        os.path.join(work_dir, "background.mp4"), duration, width, height, fps
+    )
+    alignment = synthetic_alignment(int(duration * 15))
+    audio = make_silence(os.path.join(work_dir, "speech.mp3"), duration)
+    job = JobSchema(topic="benchmark", background_path=background, id="bench")
+
+    async def run():
+        limits = StageLimits(llm=asyncio.Semaphore(1), tts=asyncio.Semaphore(1))
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            await run_job(
+                job,
+                FakeStoryTeller(alignment),
+                FakeSpeechSynthesizer(alignment, audio),
+                limits,
+                pool,
+                work_dir,
+                FONT_PATH,
+                store=ArtifactStore(os.path.join(work_dir, "artifacts")),
+            )
+
+    seconds = _best_of(1, lambda: asyncio.run(run()))
+    frames = int(duration * fps)
+    return {"seconds": seconds, "frames": frames, "frames_per_s": frames / seconds}
+
+
+BENCHMARKS = {
+    "alignment_to_words": bench_alignment_to_words,
+    "words_to_segments": bench_words_to_segments,
+    "segments_to_two_lines": bench_segments_to_two_lines,
+    "alignment_to_two_lines": bench_alignment_to_two_lines,
+    "render_two_line_image": bench_render_two_line_image,
+    "burn_karaoke_moviepy": bench_burn_karaoke_moviepy,
+    "background_library": bench_background_library,
+    "formats": bench_formats,
+    "draft": bench_draft,
+    "pipe": bench_pipe,
+    "overlay": bench_overlay,
+    "pipeline": bench_pipeline,
+}
+
+
+def _run_case(name: str, params: Dict) -> Dict:
+    """Run one case in the current (fresh) process and add its peak memory."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        metrics = BENCHMARKS[name](work_dir=work_dir, **params)
+    # ru_maxrss is in KiB on Linux
+    metrics["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    metrics["peak_rss_children_mb"] = (
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    )
+    return metrics
+
+
+def build_cases(quick: bool) -> List[Dict]:
+    sizes = [1_000, 10_000] if quick else [1_000, 10_000, 100_000]
+    repeats = 3 if quick else 5
+    video = dict(duration=5.0 if quick else 20.0, width=720, height=1280, fps=30)
+
+    cases = []
+    for name in (
+        "alignment_to_words",
+        "words_to_segments",
+        "segments_to_two_lines",
+        "alignment_to_two_lines",
+    ):
+        for n_chars in sizes:
+            cases.append(
+                {"name": name, "params": {"n_chars": n_chars, "repeats": repeats}}
+            )
+    cases.append(
+        {
+            "name": "render_two_line_image",
+            "params": {"n_chars": 2_000, "width": video["width"]},
+        }
+    )
+    cases.append({"name": "burn_karaoke_moviepy", "params": video})
+    cases.append({"name": "background_library", "params": video})
+    cases.append({"name": "formats", "params": video})
+    cases.append({"name": "draft", "params": video})
+    cases.append({"name": "pipe", "params": video})
+    cases.append({"name": "overlay", "params": video})
+    cases.append({"name": "pipeline", "params": video})
+    return cases
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--quick", action="store_true", help="Smaller inputs")
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS))
+    args = parser.parse_args(argv)
+
+    cases = [
+        case
+        for case in build_cases(args.quick)
+        if not args.only or case["name"] in args.only
+    ]
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            metrics = pool.submit(_run_case, case["name"], case["params"]).result()
+        results.append({**case, "metrics": metrics})
+        print(json.dumps(results[-1]), file=sys.stderr)
+
+    report = {
+        "revision": _git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "quick": args.quick,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
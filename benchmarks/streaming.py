@@ -0,0 +1,173 @@
+"""Latency of a story and its speech, generated one after the other or streamed.
+
+A fake chat model writes a fixed story answer token by token at a fixed rate
+and a fake TTS client answers each request after a latency growing with its
+text, returning silence with an alignment of that text. The story and speech
+are produced once sequentially (`generate_answer`, then `generate_speech`) and
+once with `stream_story_speech`, which speaks sentences while the story is
+written:
+
+    python benchmarks/streaming.py
+    python benchmarks/streaming.py --chars 4000 --token-seconds 0.01
+"""
+
+import argparse
+import base64
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from synthetic import alignment_text, synthetic_alignment
+
+# one MPEG-1 Layer III frame of silence, 128 kbit/s at 44.1 kHz
+SILENT_FRAME = b"\xff\xfb\x90\x00" + bytes(413)
+FRAME_SECONDS = 1152 / 44100
+
+
+class FakeTextToSpeech:
+    """Stands in for `ElevenLabs.text_to_speech`."""
+
+    def __init__(self, base_latency: float, chars_per_second: float):
+        self.base_latency = base_latency
+        self.chars_per_second = chars_per_second
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.done_at: list[float] = []  # perf_counter of every answer
+
+    def convert_with_timestamps(self, text: str, **_):
+        from elevenlabs import AudioWithTimestampsResponse
+
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.base_latency + len(text) / self.chars_per_second)
+        with self.lock:
+            self.done_at.append(time.perf_counter())
+        step = 1 / 15  # seconds per character
+        alignment = {
+            "characters": list(text),
+            "character_start_times_seconds": [i * step for i in range(len(text))],
+            "character_end_times_seconds": [(i + 1) * step for i in range(len(text))],
+        }
+        frames = int(len(text) * step / FRAME_SECONDS) + 1
+        return AudioWithTimestampsResponse(
+            audio_base64=base64.b64encode(SILENT_FRAME * frames).decode("ascii"),
+            alignment=alignment,
+            normalized_alignment=alignment,
+        )
+
+
+class FakeClient:
+    def __init__(self, text_to_speech: FakeTextToSpeech):
+        self.text_to_speech = text_to_speech
+
+
+def slow_chat_model(answer: str, token_seconds: float):
+    """Fake chat model answering `answer` at `token_seconds` per token, where
+    words and whitespace are tokens."""
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+    tokens = [token for token in re.split(r"(\s)", answer) if token]
+
+    class SlowChatModel(BaseChatModel):
+        @property
+        def _llm_type(self) -> str:
+            return "slow-fake"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            time.sleep(len(tokens) * token_seconds)
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(answer))])
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            for token in tokens:
+                time.sleep(token_seconds)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    return SlowChatModel()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chars", type=int, default=2500, help="Story length")
+    parser.add_argument("--token-seconds", type=float, default=0.015)
+    parser.add_argument("--tts-latency", type=float, default=0.4, help="Seconds")
+    parser.add_argument("--tts-chars-per-second", type=float, default=500.0)
+    args = parser.parse_args(argv)
+
+    os.environ.update(
+        OPENAI_API_KEY="fake",
+        OPENAI_MODEL="fake",
+        ELEVENLABS_API_KEY="fake",
+        ELEVENLABS_MODEL_ID="fake",
+        ELEVENLABS_MALE_VOICE_ID="male",
+        ELEVENLABS_FEMALE_VOICE_ID="female",
+        ELEVENLABS_SPEED="1.0",
+    )
+    from models.schemas import StorySchema
+    from providers.elevenlabs import SpeechSynthesizer
+    from providers.openai import StoryTeller
+    from providers.streaming import stream_story_speech
+
+    content = alignment_text(synthetic_alignment(args.chars)).capitalize()
+    answer = json.dumps(
+        {
+            "title": "A synthetic story",
+            "description": "Written for the benchmark",
+            "sex": "male",
+            "keywords": ["benchmark"],
+            "content": content,
+        }
+    )
+    tts = FakeTextToSpeech(args.tts_latency, args.tts_chars_per_second)
+    story_teller = StoryTeller(
+        StorySchema, model=slow_chat_model(answer, args.token_seconds), use_cache=False
+    )
+    speech_synthesizer = SpeechSynthesizer(use_cache=False, client=FakeClient(tts))
+
+    start = time.perf_counter()
+    story = story_teller.generate_answer("prompt")
+    story_seconds = time.perf_counter() - start
+    sequential = speech_synthesizer.generate_speech(story)
+    sequential_seconds = time.perf_counter() - start
+    sequential_first_audio = min(tts.done_at) - start
+
+    calls = tts.calls
+    start = time.perf_counter()
+    streamed_story, streamed = stream_story_speech(
+        story_teller, speech_synthesizer, "prompt"
+    )
+    streamed_seconds = time.perf_counter() - start
+    streamed_calls = tts.calls - calls
+    streamed_first_audio = min(tts.done_at[calls:]) - start
+
+    # the speech stage answers from the streamed speech, without new requests
+    again = speech_synthesizer.generate_speech(streamed_story)
+    assert tts.calls - calls == streamed_calls
+    assert again is streamed
+    assert streamed_story == story
+    assert "".join(streamed.alignment.characters) == story.content
+    assert "".join(sequential.alignment.characters) == story.content
+
+    print(
+        json.dumps(
+            {
+                "chars": len(content),
+                "story_seconds": round(story_seconds, 3),
+                "sequential_seconds": round(sequential_seconds, 3),
+                "streamed_seconds": round(streamed_seconds, 3),
+                "speedup": round(sequential_seconds / streamed_seconds, 2),
+                "sequential_first_audio_seconds": round(sequential_first_audio, 3),
+                "streamed_first_audio_seconds": round(streamed_first_audio, 3),
+                "streamed_tts_requests": streamed_calls,
+            }
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
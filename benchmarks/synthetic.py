@@ -0,0 +1,156 @@
+"""Synthetic, offline inputs for the benchmarks."""
+
+import base64
+import os
+import random
+import sys
+from dataclasses import dataclass, field
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "podcaster"))
+
+from core.ffmpeg import run_ffmpeg
+from models.schemas import AlignmentSchema, StorySchema
+from providers.cache import content_key
+
+VOCABULARY = (
+    "the a my our story when then after before night morning office coworker "
+    "neighbour sister brother friend landlord manager coffee lunch car house "
+    "phone message secret always never suddenly finally really quietly told "
+    "asked laughed screamed noticed found opened closed waited realized, "
+    "everything. nothing! somebody? again. anyway, unbelievable. honestly"
+).split()
+
+
+def synthetic_alignment(
+    n_chars: int, chars_per_second: float = 15.0, seed: int = 0
+) -> AlignmentSchema:
+    """Generate a character alignment of roughly `n_chars` characters.
+
+    Words are drawn from a fixed vocabulary with a seeded generator, characters
+    take `1 / chars_per_second` each with some jitter, and spaces are short
+    pauses, similar to what the TTS provider returns.
+    Args:
+        n_chars (int): Number of characters to generate.
+        chars_per_second (float): Average speaking rate.
+        seed (int): Seed of the random generator.
+    Returns:
+        AlignmentSchema: The alignment.
+    """
+    rng = random.Random(seed)
+    characters: List[str] = []
+    starts: List[float] = []
+    ends: List[float] = []
+    t = 0.0
+    step = 1.0 / chars_per_second
+    while len(characters) < n_chars:
+        if characters:
+            characters.append(" ")
+            starts.append(t)
+            t += step * rng.uniform(0.5, 2.0)
+            ends.append(t)
+        for ch in rng.choice(VOCABULARY):
+            characters.append(ch)
+            starts.append(t)
+            t += step * rng.uniform(0.7, 1.3)
+            ends.append(t)
+    return AlignmentSchema(
+        characters=characters[:n_chars],
+        character_start_times_seconds=starts[:n_chars],
+        character_end_times_seconds=ends[:n_chars],
+    )
+
+
+def alignment_text(alignment: AlignmentSchema) -> str:
+    return "".join(alignment.characters)
+
+
+def make_background(
+    path: str, duration: float, width: int = 720, height: int = 1280, fps: int = 30
+) -> str:
+    """Generate a procedural background video with ffmpeg's testsrc2 source.
+    Args:
+        path (str): Path to save the video.
+        duration (float): Duration in seconds.
+        width (int): Width of the video.
+        height (int): Height of the video.
+        fps (int): Frames per second.
+    Returns:
+        str: The path of the video.
+    """
+    run_ffmpeg(
+        [
+            "-f", "lavfi",
+            "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}",
+            "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+            path,
+        ]
+    )  # fmt: skip
+    return path
+
+
+def make_silence(path: str, duration: float) -> str:
+    """Generate a silent MP3 file.
+    Args:
+        path (str): Path to save the audio.
+        duration (float): Duration in seconds.
+    Returns:
+        str: The path of the audio.
+    """
+    run_ffmpeg(
+        [
+            "-f", "lavfi", "-i", "anullsrc=r=44100:cl=mono",
+            "-t", f"{duration:.3f}", "-c:a", "libmp3lame", "-b:a", "64k",
+            path,
+        ]
+    )  # fmt: skip
+    return path
+
+
+@dataclass
+class FakeSpeech:
+    """Stands in for `AudioWithTimestampsResponse`."""
+
+    audio_base_64: str
+    alignment: AlignmentSchema
+    normalized_alignment: AlignmentSchema
+
+
+class FakeStoryTeller:
+    """Offline replacement of `StoryTeller` returning a fixed story."""
+
+    def __init__(self, alignment: AlignmentSchema):
+        self.content = alignment_text(alignment)
+
+    def answer_key(self, prompt: str) -> str:
+        return content_key("fake", prompt, self.content)
+
+    def generate_answer(self, prompt: str) -> StorySchema:
+        return StorySchema(
+            title=prompt,
+            description="Synthetic benchmark story",
+            content=self.content,
+            sex="female",
+            keywords=["benchmark"],
+        )
+
+
+@dataclass
+class FakeSpeechSynthesizer:
+    """Offline replacement of `SpeechSynthesizer` returning silence with a
+    synthetic alignment."""
+
+    alignment: AlignmentSchema
+    audio_path: str
+    calls: List[str] = field(default_factory=list)
+
+    def settings_key(self) -> str:
+        return "fake"
+
+    def generate_speech(
+        self, story_schema: StorySchema | None = None, text: str = ""
+    ) -> FakeSpeech:
+        self.calls.append(story_schema.title if story_schema else text)
+        with open(self.audio_path, "rb") as file:
+            audio = base64.b64encode(file.read()).decode("ascii")
+        return FakeSpeech(audio, self.alignment, self.alignment)
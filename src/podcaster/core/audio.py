@@ -1,4 +1,15 @@
 import base64
+from typing import Iterable, Iterator, List, Tuple
+
+# Layer III bitrates in kbit/s, indexed by the header bitrate index
+_MPEG1_L3_BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+_MPEG2_L3_BITRATES = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+# sample rates indexed by the header version bits, then the sample rate index
+_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),  # MPEG-2.5
+}
 
 
 def base64_to_mp3(base64_string: str, output_file: str) -> None:
@@ -11,3 +22,140 @@ def base64_to_mp3(base64_string: str, output_file: str) -> None:
     audio_data = base64.b64decode(base64_string)
     with open(output_file, "wb") as file:
         file.write(audio_data)
+
+
+def base64_chunks_to_mp3(base64_chunks: Iterable[str], output_file: str) -> int:
+    """Decode a stream of base64 chunks into an MP3 file as they arrive.
+
+    Only one chunk is held in memory at a time. Chunks do not have to be
+    aligned to 4 characters; leftovers are carried over to the next chunk.
+
+    Args:
+        base64_chunks (Iterable[str]): The base64 encoded chunks.
+        output_file (str): The path to the output MP3 file.
+
+    Returns:
+        int: Number of bytes written.
+    """
+    written = 0
+    carry = ""
+    with open(output_file, "wb") as file:
+        for chunk in base64_chunks:
+            data = carry + "".join(chunk.split())
+            usable = len(data) - len(data) % 4
+            carry = data[usable:]
+            if usable:
+                written += file.write(base64.b64decode(data[:usable]))
+        if carry:
+            raise ValueError("Base64 stream ended with an incomplete quantum")
+    return written
+
+
+def _skip_id3(data: bytes, offset: int = 0) -> int:
+    """Return the offset after an ID3v2 tag starting at offset, if any."""
+    if data[offset : offset + 3] != b"ID3" or len(data) < offset + 10:
+        return offset
+    size = 0
+    for byte in data[offset + 6 : offset + 10]:
+        size = (size << 7) | (byte & 0x7F)
+    has_footer = data[offset + 5] & 0x10
+    return offset + 10 + size + (10 if has_footer else 0)
+
+
+def mp3_frames(data: bytes) -> Iterator[Tuple[int, int, int, int]]:
+    """Iterate over the MPEG Layer III frames of an MP3 file.
+
+    Leading ID3v2 tags are skipped, and so is any garbage between frames.
+
+    Args:
+        data (bytes): The MP3 file contents.
+
+    Yields:
+        Tuple[int, int, int, int]: Offset, length, sample count and sample rate of
+        each frame.
+    """
+    offset = _skip_id3(data)
+    while offset + 4 <= len(data):
+        header = int.from_bytes(data[offset : offset + 4], "big")
+        version = (header >> 19) & 3
+        layer = (header >> 17) & 3
+        bitrate_index = (header >> 12) & 0xF
+        rate_index = (header >> 10) & 3
+        if (
+            (header >> 21) != 0x7FF
+            or version == 1
+            or layer != 1  # only Layer III
+            or bitrate_index in (0, 15)
+            or rate_index == 3
+        ):
+            offset += 1
+            continue
+
+        sample_rate = _SAMPLE_RATES[version][rate_index]
+        padding = (header >> 9) & 1
+        if version == 3:
+            bitrate = _MPEG1_L3_BITRATES[bitrate_index] * 1000
+            samples = 1152
+            length = 144 * bitrate // sample_rate + padding
+        else:
+            bitrate = _MPEG2_L3_BITRATES[bitrate_index] * 1000
+            samples = 576
+            length = 72 * bitrate // sample_rate + padding
+
+        yield offset, length, samples, sample_rate
+        offset += length
+
+
+def _is_info_frame(frame: bytes) -> bool:
+    """Check whether a frame is a Xing/Info/VBRI header rather than audio."""
+    return any(tag in frame[:64] for tag in (b"Xing", b"Info", b"VBRI"))
+
+
+def mp3_audio_frames(data: bytes) -> List[bytes]:
+    """Split an MP3 file into its audio frames, without tags and header frames.
+
+    Args:
+        data (bytes): The MP3 file contents.
+
+    Returns:
+        List[bytes]: The audio frames.
+    """
+    frames = []
+    for i, (offset, length, _, _) in enumerate(mp3_frames(data)):
+        frame = data[offset : offset + length]
+        if i == 0 and _is_info_frame(frame):
+            continue
+        frames.append(frame)
+    return frames
+
+
+def mp3_duration(data: bytes) -> float:
+    """Compute the duration of an MP3 file from its frame headers.
+
+    Args:
+        data (bytes): The MP3 file contents.
+
+    Returns:
+        float: Duration in seconds.
+    """
+    duration = 0.0
+    for i, (offset, length, samples, sample_rate) in enumerate(mp3_frames(data)):
+        if i == 0 and _is_info_frame(data[offset : offset + length]):
+            continue
+        duration += samples / sample_rate
+    return duration
+
+
+def concat_mp3(parts: Iterable[bytes]) -> bytes:
+    """Concatenate MP3 files into one stream of audio frames.
+
+    Tags and Xing/Info header frames are dropped, because a header frame of the
+    first part would make players report only the first part's duration.
+
+    Args:
+        parts (Iterable[bytes]): The MP3 files contents, in order.
+
+    Returns:
+        bytes: The concatenated MP3 data.
+    """
+    return b"".join(frame for part in parts for frame in mp3_audio_frames(part))
@@ -0,0 +1,340 @@
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import time
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+from core.ffmpeg import keyframe_times, probe, run_ffmpeg
+from core.metrics import get_metrics
+
+INDEX_FILE = "index.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backgrounds (
+    source TEXT PRIMARY KEY,
+    source_size INTEGER NOT NULL,
+    source_mtime_ns INTEGER NOT NULL,
+    profile TEXT NOT NULL,
+    path TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    fps REAL NOT NULL,
+    duration REAL NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    keyframes BLOB NOT NULL,
+    created REAL NOT NULL
+)
+"""
+
+
+@dataclass(frozen=True)
+class TranscodeProfile:
+    """Format every background of a library is transcoded to."""
+
+    width: int = 1080
+    height: int = 1920
+    fps: int = 30
+    keyframe_interval: float = 1.0
+    crf: int = 20
+    preset: str = "medium"
+
+    def key(self) -> str:
+        return json.dumps(
+            [
+                self.width,
+                self.height,
+                self.fps,
+                self.keyframe_interval,
+                self.crf,
+                self.preset,
+            ]
+        )
+
+
+@dataclass(frozen=True)
+class BackgroundAsset:
+    """Transcoded background video with its index entry."""
+
+    source: str
+    path: str
+    width: int
+    height: int
+    fps: float
+    duration: float
+    size_bytes: int
+    keyframes: List[float]
+
+    @property
+    def id(self) -> str:
+        """Name of the transcoded file, which changes with the source and profile."""
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+    def random_start(self, seed: object, min_remaining: float = 0.0) -> float:
+        """
+        Pick a keyframe to start the background at.
+
+        The pick depends only on the seed, so a job gets the same start on
+        every run.
+
+        Args:
+            seed: Seed of the pick, e.g. the job id
+            min_remaining (float): Seconds that should be left after the start,
+                keyframes too close to the end are only used if no other is
+
+        Returns:
+            float: Start time in seconds
+        """
+        candidates = [
+            t for t in self.keyframes if t <= self.duration - min_remaining
+        ] or self.keyframes[:1]
+        if not candidates:
+            return 0.0
+        return random.Random(str(seed)).choice(candidates)
+
+
+class BackgroundLibrary:
+    """
+    Backgrounds transcoded once to the target format, with an SQLite index.
+
+    Sources are scaled and cropped to the profile's size and frame rate and
+    encoded with a keyframe every `keyframe_interval` seconds, so jobs decode
+    small frames and can start at any keyframe with stream copy. The index
+    holds the duration, size, frame rate and keyframe times of every asset,
+    so jobs never probe the files.
+    """
+
+    def __init__(self, library_dir: str, profile: TranscodeProfile | None = None):
+        """
+        Initialize the library.
+
+        Args:
+            library_dir (str): Directory of the transcoded files and the index
+            profile (TranscodeProfile | None): Target format, the defaults if None
+        """
+        self.library_dir = library_dir
+        self.profile = profile or TranscodeProfile()
+        os.makedirs(library_dir, exist_ok=True)
+        with self._connect() as db:
+            db.execute(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(os.path.join(self.library_dir, INDEX_FILE), timeout=30)
+        try:
+            with db:  # commits, or rolls back on error
+                yield db
+        finally:
+            db.close()
+
+    def get(self, source_path: str) -> Optional[BackgroundAsset]:
+        """
+        Look up the transcoded version of a source video.
+
+        Args:
+            source_path (str): Path to the source video
+
+        Returns:
+            Optional[BackgroundAsset]: The asset, None if the source is not in
+            the library, changed since it was added or was transcoded with
+            another profile
+        """
+        source = os.path.abspath(source_path)
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT source_size, source_mtime_ns, profile, path, width, height, "
+                "fps, duration, size_bytes, keyframes FROM backgrounds "
+                "WHERE source = ?",
+                (source,),
+            ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, profile, path, *info, keyframes = row
+        try:
+            stat = os.stat(source)
+        except FileNotFoundError:
+            stat = None  # the transcoded file is still usable
+        if (
+            profile != self.profile.key()
+            or (
+                stat is not None
+                and (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns)
+            )
+            or not os.path.exists(path)
+        ):
+            return None
+        return BackgroundAsset(source, path, *info, array("d", keyframes).tolist())
+
+    def add(self, source_path: str, force: bool = False) -> BackgroundAsset:
+        """
+        Transcode a source video into the library, unless it is already there.
+
+        Args:
+            source_path (str): Path to the source video
+            force (bool): Transcode even if an up-to-date asset exists
+
+        Returns:
+            BackgroundAsset: The asset
+
+        Raises:
+            RuntimeError: If ffmpeg fails
+        """
+        if not force:
+            asset = self.get(source_path)
+            if asset is not None:
+                return asset
+
+        source = os.path.abspath(source_path)
+        stat = os.stat(source)
+        fingerprint = [source, stat.st_size, stat.st_mtime_ns, self.profile.key()]
+        name = hashlib.sha256(json.dumps(fingerprint).encode("utf-8")).hexdigest()[:32]
+        path = os.path.join(os.path.abspath(self.library_dir), name + ".mp4")
+        tmp_path = f"{path}.{os.getpid()}.tmp.mp4"
+
+        p = self.profile
+        gop = max(1, round(p.fps * p.keyframe_interval))
+        with get_metrics().span("background_transcode"):
+            try:
+                run_ffmpeg(
+                    [
+                        "-i", source,
+                        "-map", "0:v:0", "-an",
+                        "-vf",
+                        f"scale={p.width}:{p.height}:force_original_aspect_ratio=increase,"
+                        f"crop={p.width}:{p.height},fps={p.fps},format=yuv420p",
+                        "-c:v", "libx264", "-preset", p.preset, "-crf", str(p.crf),
+                        "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+                        "-movflags", "+faststart",
+                        tmp_path,
+                    ]
+                )  # fmt: skip
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        info = probe(path)
+        keyframes = keyframe_times(path)
+        asset = BackgroundAsset(
+            source=source,
+            path=path,
+            width=p.width,
+            height=p.height,
+            fps=float(p.fps),
+            duration=float(info["duration"]),
+            size_bytes=os.path.getsize(path),
+            keyframes=keyframes,
+        )
+        with self._connect() as db:
+            old = db.execute(
+                "SELECT path FROM backgrounds WHERE source = ?", (source,)
+            ).fetchone()
+            db.execute(
+                "INSERT OR REPLACE INTO backgrounds VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    source,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    self.profile.key(),
+                    path,
+                    asset.width,
+                    asset.height,
+                    asset.fps,
+                    asset.duration,
+                    asset.size_bytes,
+                    array("d", keyframes).tobytes(),
+                    time.time(),
+                ),
+            )
+        if old is not None and old[0] != path and os.path.exists(old[0]):
+            os.remove(old[0])
+        return asset
+
+    def assets(self) -> List[BackgroundAsset]:
+        """
+        List the indexed assets.
+
+        Returns:
+            List[BackgroundAsset]: The assets, including stale ones
+        """
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT source, path, width, height, fps, duration, size_bytes, "
+                "keyframes FROM backgrounds ORDER BY source"
+            ).fetchall()
+        return [
+            BackgroundAsset(*row[:-1], array("d", row[-1]).tolist()) for row in rows
+        ]
+
+
+def default_library(create: bool = False) -> Optional[BackgroundLibrary]:
+    """
+    Open the library configured by `BackgroundConfig`.
+
+    Args:
+        create (bool): Create the library if it does not exist yet
+
+    Returns:
+        Optional[BackgroundLibrary]: The library, None if it does not exist
+        and `create` is False
+    """
+    from models.configs import BackgroundConfig, get_config
+
+    config = get_config(BackgroundConfig)
+    if not create and not os.path.exists(os.path.join(config.LIBRARY_DIR, INDEX_FILE)):
+        return None
+    return BackgroundLibrary(
+        config.LIBRARY_DIR,
+        TranscodeProfile(
+            width=config.WIDTH,
+            height=config.HEIGHT,
+            fps=config.FPS,
+            keyframe_interval=config.KEYFRAME_INTERVAL,
+            crf=config.CRF,
+            preset=config.PRESET,
+        ),
+    )
+
+
+def fit_asset_to_audio(
+    asset: BackgroundAsset,
+    audio_path: str,
+    out_path: str,
+    start: float = 0.0,
+    audio_duration: float | None = None,
+):
+    """
+    Fit a library background to the audio with stream copy, from a keyframe.
+
+    The background is cut from `start` when long enough, otherwise the rest
+    of it is followed by as many full loops as needed. The asset's index entry
+    replaces probing and keyframe checks.
+
+    Args:
+        asset (BackgroundAsset): The background
+        audio_path (str): Path to the input audio file
+        out_path (str): Path to save the output video file
+        start (float): Start time, a keyframe of the asset
+        audio_duration (float | None): Duration of the audio, probed if None
+
+    Raises:
+        RuntimeError: If ffmpeg fails
+    """
+    from core.video import fit_video_to_audio_stream_copy
+
+    if audio_duration is None:
+        audio_duration = probe(audio_path)["duration"]
+    with get_metrics().span("fit_video", mode="library"):
+        fit_video_to_audio_stream_copy(
+            asset.path,
+            audio_path,
+            out_path,
+            start=start,
+            video_duration=asset.duration,
+            audio_duration=audio_duration,
+        )
@@ -0,0 +1,275 @@
+import math
+import subprocess
+from typing import List, Tuple
+
+import numpy as np
+
+from core.ffmpeg import ffmpeg_binary, probe
+from core.formats import OutputProfile, caption_compositor, render_karaoke_formats
+from core.karaoke import ImageCache, alignment_to_two_lines, load_font
+from core.metrics import get_metrics
+
+DRAFT_PRESET = "ultrafast"
+DRAFT_CRF = 32
+
+
+def draft_profile(
+    width: int,
+    height: int,
+    scale: float = 1 / 3,
+    fps: float = 12.0,
+    y_pos_ratio: float = 0.5,
+    font_size_ratio: float = 0.06,
+) -> OutputProfile:
+    """
+    Format of a draft of a video: downscaled, fewer frames, fast encoder.
+
+    The captions are laid out for the full size and scaled down with the
+    frames, so the draft shows the same line breaks and positions as the
+    final render.
+
+    Args:
+        width (int): Width of the final video
+        height (int): Height of the final video
+        scale (float): Size of the draft relative to the final video
+        fps (float): Frame rate of the draft
+        y_pos_ratio (float): Vertical position ratio for subtitles
+        font_size_ratio (float): Font size ratio relative to video height
+
+    Returns:
+        OutputProfile: The draft format
+    """
+    return OutputProfile(
+        # libx264 with yuv420p needs even sizes
+        width=max(2, round(width * scale / 2) * 2),
+        height=max(2, round(height * scale / 2) * 2),
+        fps=fps,
+        y_pos_ratio=y_pos_ratio,
+        font_size_ratio=font_size_ratio,
+        crf=DRAFT_CRF,
+        preset=DRAFT_PRESET,
+        layout_height=height,
+    )
+
+
+def render_karaoke_draft(
+    video_path: str,
+    audio_path: str,
+    alignment_obj,
+    output_path: str,
+    font_path: str,
+    max_segment_chars: int = 60,
+    max_segment_duration: float = 2.8,
+    max_chars_per_line: int = 20,
+    y_pos_ratio: float = 0.5,
+    font_size_ratio: float = 0.06,
+    scale: float = 1 / 3,
+    fps: float = 12.0,
+    start: float = 0.0,
+    end: float | None = None,
+):
+    """
+    Render a low-resolution, low frame rate preview of the karaoke video.
+
+    Takes the same arguments as `render_karaoke_video`, so the final render
+    can be started with the options approved on the draft.
+
+    Args:
+        video_path (str): Path to the background video file
+        audio_path (str): Path to the narration audio file
+        alignment_obj: Alignment object containing character-level alignment data
+        output_path (str): Path to save the draft video file
+        font_path (str): Path to the font file for rendering subtitles
+        max_segment_chars (int): Maximum characters per segment
+        max_segment_duration (float): Maximum duration of each segment in seconds
+        max_chars_per_line (int): Maximum characters per line
+        y_pos_ratio (float): Vertical position ratio for subtitles
+        font_size_ratio (float): Font size ratio relative to video height
+        scale (float): Size of the draft relative to the background
+        fps (float): Frame rate of the draft
+        start (float): Start of the rendered window in seconds
+        end (float | None): End of the rendered window, the end of the audio
+            if None
+
+    Raises:
+        RuntimeError: If the encoder fails
+    """
+    width, height = probe(video_path)["video_size"]
+    with get_metrics().span("draft", kind="video"):
+        render_karaoke_formats(
+            video_path,
+            audio_path,
+            alignment_obj,
+            {
+                output_path: draft_profile(
+                    width, height, scale, fps, y_pos_ratio, font_size_ratio
+                )
+            },
+            font_path,
+            max_segment_chars=max_segment_chars,
+            max_segment_duration=max_segment_duration,
+            max_chars_per_line=max_chars_per_line,
+            start=start,
+            end=end,
+        )
+
+
+def sheet_times(
+    segment_starts: List[float],
+    start: float = 0.0,
+    end: float | None = None,
+    max_frames: int = 48,
+) -> List[float]:
+    """
+    Pick the times shown on a contact sheet: caption segment starts.
+
+    Args:
+        segment_starts (List[float]): Start times of the caption segments
+        start (float): Start of the window in seconds
+        end (float | None): End of the window, unbounded if None
+        max_frames (int): Maximum number of frames, spread evenly over the
+            segments if there are more
+
+    Returns:
+        List[float]: The times, sorted
+    """
+    times = [t for t in segment_starts if t >= start and (end is None or t < end)]
+    if len(times) > max_frames:
+        step = len(times) / max_frames
+        times = [times[int(i * step)] for i in range(max_frames)]
+    return times
+
+
+def read_frames(
+    video_path: str, times: List[float], size: Tuple[int, int]
+) -> List[np.ndarray]:
+    """
+    Decode the frames of a video at a few times, scaled to a size.
+
+    A single ffmpeg pass selects the frames before scaling them, which is
+    cheaper than seeking for every time. Times past the end of the video wrap
+    around, like a looped background.
+
+    Args:
+        video_path (str): Path to the video file
+        times (List[float]): Times of the frames in seconds
+        size (Tuple[int, int]): Width and height of the frames
+
+    Returns:
+        List[np.ndarray]: The (h, w, 3) uint8 frames, in the order of `times`
+
+    Raises:
+        RuntimeError: If ffmpeg fails
+    """
+    info = probe(video_path)
+    fps = float(info.get("video_fps") or 30.0)
+    n_frames = max(1, int(info.get("video_n_frames") or info["duration"] * fps))
+    numbers = [min(int(t * fps) % n_frames, n_frames - 1) for t in times]
+    selected = sorted(set(numbers))
+
+    w, h = size
+    expression = "+".join(f"eq(n\\,{n})" for n in selected)
+    result = subprocess.run(
+        [
+            ffmpeg_binary(), "-hide_banner", "-loglevel", "error",
+            "-i", video_path,
+            "-vf", f"select='{expression}',scale={w}:{h}",
+            "-fps_mode", "passthrough",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )  # fmt: skip
+    if result.returncode != 0:
+        error = result.stderr.decode(errors="replace")
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {error}")
+    decoded = np.frombuffer(result.stdout, dtype=np.uint8).reshape(-1, h, w, 3)
+    # a frame missing at the very end repeats the last decoded one
+    index = {n: min(i, len(decoded) - 1) for i, n in enumerate(selected)}
+    return [decoded[index[n]].copy() for n in numbers]
+
+
+def render_contact_sheet(
+    video_path: str,
+    audio_path: str,
+    alignment_obj,
+    output_path: str,
+    font_path: str,
+    max_segment_chars: int = 60,
+    max_segment_duration: float = 2.8,
+    max_chars_per_line: int = 20,
+    y_pos_ratio: float = 0.5,
+    font_size_ratio: float = 0.06,
+    scale: float = 1 / 4,
+    start: float = 0.0,
+    end: float | None = None,
+    columns: int = 6,
+    max_frames: int = 48,
+):
+    """
+    Render a contact sheet: one captioned thumbnail per caption segment.
+
+    Every thumbnail is the frame at the start of a segment with its caption
+    laid out as in the final render and scaled down, labeled with its time.
+    The frames are picked in one pass over the background, so a sheet takes
+    about as long as decoding it once.
+
+    Args:
+        video_path (str): Path to the background video file
+        audio_path (str): Path to the narration audio file
+        alignment_obj: Alignment object containing character-level alignment data
+        output_path (str): Path to save the sheet, e.g. a PNG file
+        font_path (str): Path to the font file for rendering subtitles
+        max_segment_chars (int): Maximum characters per segment
+        max_segment_duration (float): Maximum duration of each segment in seconds
+        max_chars_per_line (int): Maximum characters per line
+        y_pos_ratio (float): Vertical position ratio for subtitles
+        font_size_ratio (float): Font size ratio relative to video height
+        scale (float): Size of the thumbnails relative to the background
+        start (float): Start of the window in seconds
+        end (float | None): End of the window, the end of the audio if None
+        columns (int): Number of thumbnails per row
+        max_frames (int): Maximum number of thumbnails
+    """
+    from PIL import Image, ImageDraw
+
+    duration = probe(audio_path)["duration"]
+    two_lines = alignment_to_two_lines(
+        alignment_obj, max_segment_chars, max_segment_duration, max_chars_per_line
+    )
+    times = sheet_times([seg.start for seg in two_lines], start, end, max_frames)
+    if not times:
+        times = [start]
+
+    with get_metrics().span("draft", kind="sheet", frames=len(times)):
+        width, height = probe(video_path)["video_size"]
+        profile = draft_profile(width, height, scale, 1.0, y_pos_ratio, font_size_ratio)
+        w, h = profile.width, profile.height
+        frames = read_frames(video_path, [min(t, duration) for t in times], (w, h))
+        compositor = (
+            caption_compositor(two_lines, profile, 30.0, font_path, ImageCache())
+            if two_lines
+            else None
+        )
+        label_font = load_font(font_path, max(10, h // 24))
+
+        columns = max(1, min(columns, len(times)))
+        sheet = Image.new(
+            "RGB", (columns * w, math.ceil(len(times) / columns) * h), (0, 0, 0)
+        )
+        for i, (t, frame) in enumerate(zip(times, frames)):
+            if compositor is not None:
+                sprite = compositor.sprite_at(t)
+                if sprite is not None:
+                    compositor.blend_into(frame, sprite)
+            tile = Image.fromarray(frame)
+            ImageDraw.Draw(tile).text(
+                (4, 2),
+                f"{int(t // 60)}:{t % 60:05.2f}",
+                font=label_font,
+                fill=(255, 255, 255),
+                stroke_width=2,
+                stroke_fill=(0, 0, 0),
+            )
+            sheet.paste(tile, ((i % columns) * w, (i // columns) * h))
+        sheet.save(output_path)
@@ -0,0 +1,181 @@
+import os
+import re
+import subprocess
+import threading
+from typing import List, Optional
+
+_PTS_TIME = re.compile(r"pts_time:\s*(-?[0-9.]+)")
+
+
+def ffmpeg_binary() -> str:
+    """
+    Path of the ffmpeg binary used by moviepy.
+
+    moviepy is imported on first use only, since importing it takes a while.
+
+    Returns:
+        str: Path to the ffmpeg executable
+    """
+    from moviepy.config import FFMPEG_BINARY
+
+    return FFMPEG_BINARY
+
+
+def run_ffmpeg(args: List[str]) -> None:
+    """
+    Run ffmpeg with the given arguments, overwriting outputs.
+
+    Args:
+        args (List[str]): Arguments after the binary name
+
+    Raises:
+        RuntimeError: If ffmpeg exits with an error
+    """
+    result = subprocess.run(
+        [ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error", *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode != 0:
+        error = result.stderr.decode(errors="replace")
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {error}")
+
+
+class FFmpegProcess:
+    """
+    ffmpeg running in the background, with raw frames piped in or out.
+
+    stderr is drained by a thread so that a chatty process never blocks on
+    it, and is reported if the process fails.
+    """
+
+    def __init__(self, args: List[str], stdin: bool = False, stdout: bool = False):
+        """
+        Start ffmpeg, overwriting outputs.
+
+        Args:
+            args (List[str]): Arguments after the binary name
+            stdin (bool): Whether to open a pipe to its stdin
+            stdout (bool): Whether to open a pipe from its stdout
+        """
+        self.process = subprocess.Popen(
+            [ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error", *args],
+            stdin=subprocess.PIPE if stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE if stdout else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        self.stdin = self.process.stdin
+        self.stdout = self.process.stdout
+        self._stderr: List[bytes] = []
+        self._stderr_thread = threading.Thread(
+            target=lambda: self._stderr.append(self.process.stderr.read()),
+            daemon=True,
+        )
+        self._stderr_thread.start()
+
+    def close(self) -> None:
+        """
+        Close the pipes and wait for ffmpeg to exit.
+
+        Raises:
+            RuntimeError: If ffmpeg exits with an error
+        """
+        for pipe in (self.stdin, self.stdout):
+            if pipe is not None:
+                try:
+                    pipe.close()
+                except OSError:
+                    pass  # the process exited before reading everything
+        returncode = self.process.wait()
+        self._stderr_thread.join()
+        if returncode != 0:
+            stderr = b"".join(self._stderr).decode(errors="replace")
+            raise RuntimeError(f"ffmpeg failed ({returncode}): {stderr}")
+
+    def kill(self) -> None:
+        """Stop ffmpeg without waiting for its output."""
+        self.process.kill()
+        self.process.wait()
+        self._stderr_thread.join()
+
+
+def probe(path: str) -> dict:
+    """
+    Read stream information of a media file.
+
+    Args:
+        path (str): Path to the media file
+
+    Returns:
+        dict: Information as returned by moviepy's `ffmpeg_parse_infos`
+        (duration, video_size, video_fps, video_codec_name, ...)
+    """
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    return ffmpeg_parse_infos(path)
+
+
+def escape_filter_value(value: str) -> str:
+    """
+    Escape a value, such as a file path, for use inside a filtergraph.
+
+    Args:
+        value (str): The raw value
+
+    Returns:
+        str: The value quoted for the filter option and filtergraph parsers
+    """
+    # option level: escape backslash, quote and colon
+    value = value.replace("\\", "\\\\").replace("'", "\\'").replace(":", "\\:")
+    # filtergraph level: wrap in quotes, escaping quotes again
+    return "'" + value.replace("'", "'\\''") + "'"
+
+
+def keyframe_times(path: str, max_count: Optional[int] = None) -> List[float]:
+    """
+    List the timestamps of the keyframes of the first video stream.
+
+    Only keyframes are decoded, so this is much faster than a full decode.
+
+    Args:
+        path (str): Path to the video file
+        max_count (Optional[int]): Stop after this many keyframes
+
+    Returns:
+        List[float]: Keyframe timestamps in seconds, in decode order
+
+    Raises:
+        RuntimeError: If ffmpeg exits with an error
+    """
+    limit = ["-frames:v", str(max_count)] if max_count else []
+    result = subprocess.run(
+        [
+            ffmpeg_binary(), "-hide_banner", "-nostats",
+            "-skip_frame", "nokey", "-i", path,
+            "-map", "0:v:0", "-vf", "showinfo", *limit,
+            "-f", "null", "-",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )  # fmt: skip
+    stderr = result.stderr.decode(errors="replace")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {stderr}")
+    return [float(t) for t in _PTS_TIME.findall(stderr)]
+
+
+def write_concat_list(paths: List[str], list_path: str, inpoint: float = 0.0) -> None:
+    """
+    Write an input list for ffmpeg's concat demuxer.
+
+    Args:
+        paths (List[str]): Files to concatenate, in order
+        list_path (str): Path to save the list file
+        inpoint (float): Start time in the first file, best on a keyframe
+    """
+    with open(list_path, "w", encoding="utf-8") as file:
+        for i, path in enumerate(paths):
+            quoted = os.path.abspath(path).replace("'", "'\\''")
+            file.write(f"file '{quoted}'\n")
+            if i == 0 and inpoint > 0:
+                file.write(f"inpoint {inpoint:.6f}\n")
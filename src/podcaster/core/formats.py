@@ -0,0 +1,373 @@
+import math
+import queue
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from core.ffmpeg import FFmpegProcess, probe
+from core.karaoke import (
+    ImageCache,
+    KaraokeCompositor,
+    KaraokeTimeline,
+    TwoLineSegment,
+    alignment_to_two_lines,
+    report_cache_stats,
+)
+from core.metrics import get_metrics
+from core.video import fit_clip_to_duration
+
+FIT_MODES = ("crop", "pad")
+
+# decoded frames waiting for a slow output, per output
+_QUEUE_FRAMES = 8
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """Format of one output of a multi-format render."""
+
+    width: Optional[int] = None  # the background's width if None
+    height: Optional[int] = None  # the background's height if None
+    fit: str = "crop"  # "crop" fills the frame, "pad" letterboxes in black
+    fps: Optional[float] = None  # the background's frame rate if None
+    bitrate: Optional[str] = None  # e.g. "6M", constant quality (crf) if None
+    y_pos_ratio: float = 0.5
+    font_size_ratio: float = 0.06
+    crf: int = 20
+    preset: str = "medium"
+    # height the captions are laid out for, then scaled to the output's
+    layout_height: Optional[int] = None
+
+
+def caption_compositor(
+    two_lines: List[TwoLineSegment],
+    profile: OutputProfile,
+    fps: float,
+    font_path: str,
+    cache: ImageCache,
+) -> KaraokeCompositor:
+    """
+    Build the compositor drawing the captions of an output.
+
+    The font size and position follow `add_karaoke` for `layout_height`, and
+    the whole layout is scaled from there to the output's height, so a
+    downscaled output shows the same line breaks and positions.
+
+    Args:
+        two_lines (List[TwoLineSegment]): Caption segments
+        profile (OutputProfile): Format of the output, with its size set
+        fps (float): Frame rate of the output
+        font_path (str): Path to the font file for rendering subtitles
+        cache (ImageCache): Cache for rendered caption images
+
+    Returns:
+        KaraokeCompositor: The compositor
+    """
+    layout_h = profile.layout_height or profile.height
+    scale = profile.height / layout_h
+    font_size = max(18, int(layout_h * profile.font_size_ratio))
+    return KaraokeCompositor(
+        KaraokeTimeline(two_lines, safety_pad=1.0 / fps),
+        video_w=profile.width,
+        video_h=profile.height,
+        y_pos=round(int(layout_h * profile.y_pos_ratio) * scale),
+        font_path=font_path,
+        font_size=max(1, round(font_size * scale)),
+        cache=cache,
+        scale=scale,
+    )
+
+
+class _Output:
+    """
+    One output of `render_karaoke_formats`: geometry, captions and encoder.
+
+    The scaled background is written into a frame buffer allocated once,
+    captions are blended into it in place and it is written straight to the
+    encoder's stdin. Frames are consumed from a queue by a thread of their
+    own, so scaling, blending and the pipe writes of all outputs overlap.
+    """
+
+    def __init__(
+        self,
+        profile: OutputProfile,
+        output_path: str,
+        audio_path: str,
+        start: float,
+        duration: float,
+        source_size: tuple,
+        source_fps: float,
+        compositor: Optional[KaraokeCompositor],
+    ):
+        if profile.fit not in FIT_MODES:
+            raise ValueError(f"Unknown fit mode: {profile.fit}")
+        self.profile = profile
+        self.fps = float(profile.fps or source_fps)
+        self.start = start
+        self.n_frames = int(duration * self.fps)
+        self.compositor = compositor
+        self.error: Optional[BaseException] = None
+        self.queue: queue.Queue = queue.Queue(maxsize=_QUEUE_FRAMES)
+
+        w, h = profile.width, profile.height
+        sw, sh = source_size
+        self.frame = np.zeros((h, w, 3), dtype=np.uint8)  # pad borders stay black
+        if profile.fit == "crop":
+            # largest centered box of the output's aspect ratio, scaled to fill it
+            scale = max(w / sw, h / sh)
+            cw, ch = min(sw, round(w / scale)), min(sh, round(h / scale))
+            x0, y0 = (sw - cw) // 2, (sh - ch) // 2
+            self.crop = (slice(y0, y0 + ch), slice(x0, x0 + cw))
+            self.size = (w, h)
+            self.region = self.frame
+        else:
+            scale = min(w / sw, h / sh)
+            rw, rh = max(1, round(sw * scale)), max(1, round(sh * scale))
+            x0, y0 = (w - rw) // 2, (h - rh) // 2
+            self.crop = (slice(None), slice(None))
+            self.size = (rw, rh)
+            self.region = self.frame[y0 : y0 + rh, x0 : x0 + rw]
+
+        rate = (
+            ["-b:v", profile.bitrate, "-maxrate", profile.bitrate,
+             "-bufsize", profile.bitrate]
+            if profile.bitrate
+            else ["-crf", str(profile.crf)]
+        )  # fmt: skip
+        self.encoder = FFmpegProcess(
+            [
+                "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}",
+                "-r", f"{self.fps:.6f}", "-i", "-",
+                *(["-ss", f"{start:.6f}"] if start > 0 else []), "-i", audio_path,
+                "-map", "0:v:0", "-map", "1:a:0",
+                "-t", f"{duration:.3f}",
+                "-c:v", "libx264", "-preset", profile.preset, *rate,
+                "-pix_fmt", "yuv420p",
+                "-c:a", "aac",
+                "-movflags", "+faststart",
+                output_path,
+            ],
+            stdin=True,
+        )  # fmt: skip
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _scale(self, source: np.ndarray) -> None:
+        from PIL import Image
+
+        part = source[self.crop]
+        if part.shape[1::-1] == self.size:
+            np.copyto(self.region, part)
+        else:
+            image = Image.fromarray(part).resize(self.size, Image.BILINEAR)
+            np.copyto(self.region, np.asarray(image))
+
+    def _run(self) -> None:
+        metrics = get_metrics()
+        stdin = self.encoder.stdin
+        next_frame = 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None or next_frame >= self.n_frames:
+                continue  # keep draining so that the decoder never blocks
+            source, end = item
+            try:
+                # every output frame whose time falls before the next source frame
+                while next_frame < self.n_frames and next_frame / self.fps < end:
+                    with metrics.timer("format_scale"):
+                        self._scale(source)
+                    sprite = None
+                    if self.compositor is not None:
+                        sprite = self.compositor.sprite_at(
+                            self.start + next_frame / self.fps
+                        )
+                        if sprite is not None:
+                            with metrics.timer("caption_blend"):
+                                self.compositor.blend_into(self.frame, sprite)
+                    with metrics.timer("format_write"):
+                        stdin.write(memoryview(self.frame).cast("B"))
+                    if sprite is not None and self.region is not self.frame:
+                        # the caption may cover the pad borders, which are not redrawn
+                        h, w = sprite.inv_alpha.shape[:2]
+                        self.frame[sprite.y : sprite.y + h, sprite.x : sprite.x + w] = 0
+                    next_frame += 1
+            except BaseException as e:  # reported by close()
+                self.error = e
+
+    def close(self) -> None:
+        """Flush the remaining frames and wait for the encoder."""
+        self.queue.put(None)
+        self.thread.join()
+        self.encoder.close()
+        if self.error is not None:
+            raise self.error
+
+
+def _decode_size(source_size: tuple, profiles) -> tuple:
+    """
+    Smallest size to decode the background at without upscaling any output.
+
+    ffmpeg scales the frames while decoding, so small outputs such as drafts
+    do not pay for converting and copying full-size frames.
+
+    Args:
+        source_size (tuple): Width and height of the background
+        profiles: Formats of the outputs, with their sizes set
+
+    Returns:
+        tuple: Width and height to decode at, the source size if no output
+        is smaller
+    """
+    sw, sh = source_size
+    scale = 0.0
+    for p in profiles:
+        fit = max if p.fit == "crop" else min
+        scale = max(scale, fit(p.width / sw, p.height / sh))
+    if scale >= 1.0:
+        return source_size
+    return max(2, math.ceil(sw * scale)), max(2, math.ceil(sh * scale))
+
+
+def render_karaoke_formats(
+    video_path: str,
+    audio_path: str,
+    alignment_obj,
+    outputs: Dict[str, OutputProfile],
+    font_path: str,
+    max_segment_chars: int = 60,
+    max_segment_duration: float = 2.8,
+    max_chars_per_line: int = 20,
+    cache: ImageCache | None = None,
+    start: float = 0.0,
+    end: float | None = None,
+):
+    """
+    Render the karaoke video in several formats from a single decode.
+
+    The background is fitted to the narration and decoded once, and the
+    alignment is cut into caption segments once. Every output then scales
+    (crop or pad) the shared frames to its size, resamples them to its frame
+    rate, blends captions laid out for its own size and caption options, and
+    feeds its own ffmpeg encoder. The encoders run in parallel, so N formats
+    cost one decode plus N scale-and-encode passes instead of N full renders.
+
+    With `start` or `end` only that window of the video is rendered.
+
+    Args:
+        video_path (str): Path to the background video file
+        audio_path (str): Path to the narration audio file
+        alignment_obj: Alignment object containing character-level alignment data
+        outputs (Dict[str, OutputProfile]): Output paths and their formats
+        font_path (str): Path to the font file for rendering subtitles
+        max_segment_chars (int): Maximum characters per segment
+        max_segment_duration (float): Maximum duration of each segment in seconds
+        max_chars_per_line (int): Maximum characters per line
+        cache (ImageCache | None): Cache for rendered caption images, shared
+            by the outputs
+        start (float): Start of the rendered window in seconds
+        end (float | None): End of the rendered window, the end of the audio
+            if None
+
+    Raises:
+        RuntimeError: If an encoder fails
+
+    Example:
+        render_karaoke_formats(
+            video_path="background.mp4",
+            audio_path="speech.mp3",
+            alignment_obj=audio.normalized_alignment,
+            outputs={
+                "story.mp4": OutputProfile(1080, 1920),
+                "wide.mp4": OutputProfile(1920, 1080, fit="pad", bitrate="8M"),
+            },
+            font_path="/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+        )
+    """
+    from moviepy import VideoFileClip
+
+    metrics = get_metrics()
+    cache = cache if cache is not None else ImageCache()
+    cache_stats = replace(cache.stats)
+    two_lines = alignment_to_two_lines(
+        alignment_obj, max_segment_chars, max_segment_duration, max_chars_per_line
+    )
+    total = probe(audio_path)["duration"]
+    end = total if end is None else min(end, total)
+    if not 0 <= start < end:
+        raise ValueError(f"Empty render window: {start} to {end}")
+    duration = end - start
+
+    sw, sh = probe(video_path)["video_size"]
+    profiles = {
+        output_path: replace(
+            profile, width=profile.width or sw, height=profile.height or sh
+        )
+        for output_path, profile in outputs.items()
+    }
+    decode_size = _decode_size((sw, sh), profiles.values())
+
+    with metrics.span("render", backend="formats", outputs=len(outputs)):
+        video = VideoFileClip(
+            video_path,
+            audio=False,
+            target_resolution=decode_size if decode_size != (sw, sh) else None,
+        )
+        source_fps = float(getattr(video, "fps", 30)) or 30.0
+        fitted = fit_clip_to_duration(video, total)
+        if duration < total:
+            fitted = fitted.subclipped(start, end)
+
+        opened: List[_Output] = []
+        try:
+            for output_path, profile in profiles.items():
+                compositor = None
+                if two_lines:
+                    compositor = caption_compositor(
+                        two_lines,
+                        profile,
+                        float(profile.fps or source_fps),
+                        font_path,
+                        cache,
+                    )
+                opened.append(
+                    _Output(
+                        profile,
+                        output_path,
+                        audio_path,
+                        start,
+                        duration,
+                        tuple(video.size),
+                        source_fps,
+                        compositor,
+                    )
+                )
+
+            with metrics.span("decode", renderer="formats"):
+                n_source = int(duration * source_fps)
+                for i, frame in enumerate(
+                    fitted.iter_frames(fps=source_fps, dtype="uint8")
+                ):
+                    if i >= n_source:
+                        break
+                    # the last source frame is held until the end of the video
+                    end = (i + 1) / source_fps if i + 1 < n_source else float("inf")
+                    for output in opened:
+                        output.queue.put((frame, end))
+                    metrics.count("frames_decoded")
+        finally:
+            errors = []
+            for output in opened:
+                try:
+                    output.close()
+                except Exception as e:
+                    errors.append(e)
+            video.close()
+            fitted.close()
+        if errors:
+            raise errors[0]
+    report_cache_stats(cache, cache_stats)
+    metrics.flush()
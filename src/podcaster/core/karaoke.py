@@ -1,10 +1,15 @@
-from dataclasses import dataclass, field
-from typing import List, Optional, Tuple, Dict
+import hashlib
+import os
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, replace
+from functools import lru_cache
+from typing import List, Optional, Tuple
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
-from moviepy import VideoFileClip, CompositeVideoClip
-from moviepy.video.VideoClip import VideoClip
+from core.metrics import get_metrics
 
 
 @dataclass(frozen=True)
@@ -29,36 +34,224 @@ class TwoLineSegment:
     cut_index: int  # section between line 1 and line 2
 
 
-@dataclass
-class WordAccumulator:
-    """Helper class to accumulate characters into words."""
+@lru_cache(maxsize=1)
+def _whitespace_codes() -> np.ndarray:
+    """Function to list the code points for which `str.isspace` is true.
+    Returns:
+        np.ndarray: Sorted uint32 code points (all are below U+3001).
+    """
+    return np.array([c for c in range(0x3001) if chr(c).isspace()], dtype=np.uint32)
 
-    buf: List[str] = field(default_factory=list)
-    start: Optional[float] = None
-    end: Optional[float] = None
 
-    def add_char(self, ch: str, st: float, en: float) -> None:
-        """Function to add a character to the accumulator.
+@dataclass(frozen=True)
+class WordColumns:
+    """Columnar word-level alignment with one array element per word.
+
+    Words are runs of non-whitespace characters of the alignment, word i is
+    `text[text_start[i]:text_end[i]]` and lasts from `starts[i]` to `ends[i]`.
+    """
+
+    text: str
+    text_start: np.ndarray
+    text_end: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @classmethod
+    def from_alignment(
+        cls, chars: List[str], starts: List[float], ends: List[float]
+    ) -> "WordColumns":
+        """Function to find the words of a character-level alignment.
         Args:
-            ch (str): The character to add.
-            st (float): The start time of the character.
-            en (float): The end time of the character.
+            chars (List[str]): List of characters.
+            starts (List[float]): List of start times for each character.
+            ends (List[float]): List of end times for each character.
+        Returns:
+            WordColumns: The words.
         """
-        if self.start is None:
-            self.start = float(st)
-        self.buf.append(ch)
-        self.end = float(en)
+        n = len(chars)
+        if not (n == len(starts) == len(ends)):
+            raise ValueError("characters / starts / ends muszą mieć tę samą długość")
+
+        text = "".join(chars)
+        if max(map(len, chars), default=1) == 1 and len(text) == n:
+            # one code point per character: classify them all at once
+            codes = np.frombuffer(
+                text.encode("utf-32-le", "surrogatepass"), dtype="<u4"
+            )
+            is_word = ~np.isin(codes, _whitespace_codes())
+            char_offsets = None
+        else:
+            is_word = np.fromiter(
+                (not ch.isspace() for ch in chars), dtype=bool, count=n
+            )
+            char_offsets = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(
+                np.fromiter(map(len, chars), dtype=np.int64, count=n),
+                out=char_offsets[1:],
+            )
+
+        edges = np.diff(is_word.astype(np.int8), prepend=0, append=0)
+        first = np.flatnonzero(edges == 1)
+        last = np.flatnonzero(edges == -1)  # exclusive
 
-    def flush_to(self, out: List[WordSpan]) -> None:
-        """Function to flush the accumulated characters as a word to the output list.
+        if char_offsets is None:
+            text_start, text_end = first, last
+        else:
+            text_start, text_end = char_offsets[first], char_offsets[last]
+        # only the times of the first and last characters of words are needed
+        return cls(
+            text=text,
+            text_start=text_start,
+            text_end=text_end,
+            starts=np.array(
+                list(map(starts.__getitem__, first.tolist())), dtype=np.float64
+            ),
+            ends=np.array(
+                list(map(ends.__getitem__, (last - 1).tolist())), dtype=np.float64
+            ),
+        )
+
+    @classmethod
+    def from_spans(cls, words: List[WordSpan]) -> "WordColumns":
+        """Function to convert word spans to columns.
+        Args:
+            words (List[WordSpan]): List of word-level alignments.
+        Returns:
+            WordColumns: The words.
+        """
+        lengths = np.fromiter(
+            (len(w.text) for w in words), dtype=np.int64, count=len(words)
+        )
+        text_end = np.cumsum(lengths)
+        return cls(
+            text="".join(w.text for w in words),
+            text_start=text_end - lengths,
+            text_end=text_end,
+            starts=np.fromiter((w.start for w in words), np.float64, len(words)),
+            ends=np.fromiter((w.end for w in words), np.float64, len(words)),
+        )
+
+    def to_spans(self) -> List[WordSpan]:
+        """Function to convert the columns to word spans.
+        Returns:
+            List[WordSpan]: List of word-level alignments.
+        """
+        texts = map(
+            self.text.__getitem__,
+            map(slice, self.text_start.tolist(), self.text_end.tolist()),
+        )
+        return list(map(WordSpan, texts, self.starts.tolist(), self.ends.tolist()))
+
+    def segment_bounds(
+        self, max_chars: int = 60, max_duration: float = 2.8
+    ) -> List[Tuple[int, int]]:
+        """Function to split the words into segments, see `words_to_segments`.
+
+        A prefix sum of the word lengths gives the last word that fits in
+        `max_chars` with one binary search, the duration is only checked for
+        the words before it, so the whole split is linear in the word count.
+        Args:
+            max_chars (int): Maximum number of characters per segment.
+            max_duration (float): Maximum duration of each segment in seconds.
+        Returns:
+            List[Tuple[int, int]]: First and end (exclusive) word of each segment.
+        """
+        n = len(self)
+        prefix = self._prefix_lengths()
+        # first word that does not fit in a segment starting at each word
+        fits = (
+            np.searchsorted(prefix, prefix[:-1] + 1 + max_chars, "right") - 1
+        ).tolist()
+        starts = self.starts.tolist()
+        ends = self.ends.tolist()
+
+        bounds = []
+        i = 0
+        while i < n:
+            # the first word is always taken, whatever its length or duration
+            end = min(max(fits[i], i + 1), n)
+            seg_start = starts[i]
+            j = i + 1
+            while j < end and not ends[j] - seg_start > max_duration:
+                j += 1
+            bounds.append((i, j))
+            i = j
+        return bounds
+
+    def line_cuts(
+        self, bounds: List[Tuple[int, int]], max_chars_per_line: int = 32
+    ) -> List[int]:
+        """Function to split segments into two lines, see `split_to_two_lines`.
+
+        Every possible cut of every segment is scored at once from the prefix
+        sums, then the best cut of each segment is picked with one reduction.
+        Args:
+            bounds (List[Tuple[int, int]]): Segments from `segment_bounds`.
+            max_chars_per_line (int): Maximum characters allowed per line.
+        Returns:
+            List[int]: Index of the first word of the second line in each segment.
+        """
+        n = len(self)
+        if not bounds:
+            return []
+        prefix = self._prefix_lengths()
+        first = np.fromiter((i for i, _ in bounds), dtype=np.int64, count=len(bounds))
+        end = np.fromiter((j for _, j in bounds), dtype=np.int64, count=len(bounds))
+
+        # candidate k cuts a segment between words k and k + 1
+        k = np.arange(n)
+        seg_first = np.repeat(first, end - first)
+        seg_end = np.repeat(end, end - first)
+        l1 = prefix[k + 1] - prefix[seg_first] - 1
+        l2 = prefix[seg_end] - prefix[k + 1] - 1
+        score = (
+            np.abs(l1 - l2)
+            + np.maximum(l1 - max_chars_per_line, 0) * 10
+            + np.maximum(l2 - max_chars_per_line, 0) * 10
+        )
+        cut = k - seg_first + 1
+        # the lowest score wins, the first cut on ties
+        key = score * (n + 1) + cut
+        key[k >= seg_end - 1] = np.iinfo(np.int64).max
+        best = np.minimum.reduceat(key, first) % (n + 1)
+
+        counts = end - first
+        return np.where(counts <= 1, counts, best).tolist()
+
+    def two_line_segments(
+        self,
+        max_chars: int = 60,
+        max_duration: float = 2.8,
+        max_chars_per_line: int = 32,
+    ) -> List[TwoLineSegment]:
+        """Function to split the words into two-line segments.
+
+        Same result as `words_to_segments` followed by `segments_to_two_lines`.
         Args:
-            out (List[WordSpan]): The list to append the word to.
+            max_chars (int): Maximum number of characters per segment.
+            max_duration (float): Maximum duration of each segment in seconds.
+            max_chars_per_line (int): Maximum characters allowed per line.
+        Returns:
+            List[TwoLineSegment]: List of two-line segments.
         """
-        if self.buf and self.start is not None and self.end is not None:
-            out.append(WordSpan("".join(self.buf), self.start, self.end))
-        self.buf.clear()
-        self.start = None
-        self.end = None
+        words = self.to_spans()
+        bounds = self.segment_bounds(max_chars, max_duration)
+        cuts = self.line_cuts(bounds, max_chars_per_line)
+        return [
+            TwoLineSegment(words[i].start, words[j - 1].end, tuple(words[i:j]), cut)
+            for (i, j), cut in zip(bounds, cuts)
+        ]
+
+    def _prefix_lengths(self) -> np.ndarray:
+        """Function to sum word lengths plus one space, so that the joined
+        length of words i..j-1 is `prefix[j] - prefix[i] - 1`."""
+        prefix = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(self.text_end - self.text_start + 1, out=prefix[1:])
+        return prefix
 
 
 def alignment_to_words(
@@ -72,20 +265,7 @@ def alignment_to_words(
     Returns:
         List[WordSpan]: List of word-level alignments.
     """
-    if not (len(chars) == len(starts) == len(ends)):
-        raise ValueError("characters / starts / ends muszą mieć tę samą długość")
-
-    out: List[WordSpan] = []
-    acc = WordAccumulator()
-
-    for ch, st, en in zip(chars, starts, ends):
-        if ch.isspace():
-            acc.flush_to(out)
-        else:
-            acc.add_char(ch, st, en)
-
-    acc.flush_to(out)
-    return out
+    return WordColumns.from_alignment(chars, starts, ends).to_spans()
 
 
 def words_to_segments(
@@ -99,52 +279,11 @@ def words_to_segments(
     Returns:
         List[SegmentSpan]: List of segments.
     """
-    segments: List[SegmentSpan] = []
-    cur: List[WordSpan] = []
-    cur_len = 0
-    seg_start = None
-    seg_end = None
-
-    def flush():
-        nonlocal cur, cur_len, seg_start, seg_end
-        if cur and seg_start is not None and seg_end is not None:
-            segments.append(SegmentSpan(seg_start, seg_end, tuple(cur)))
-        cur, cur_len, seg_start, seg_end = [], 0, None, None
-
-    for w in words:
-        add_len = (1 if cur else 0) + len(w.text)
-        if seg_start is None:
-            seg_start = w.start
-
-        prospective_len = cur_len + add_len
-        prospective_dur = w.end - seg_start
-
-        if cur and (prospective_len > max_chars or prospective_dur > max_duration):
-            flush()
-            seg_start = w.start
-            cur = [w]
-            cur_len = len(w.text)
-            seg_end = w.end
-            continue
-
-        cur.append(w)
-        cur_len = prospective_len
-        seg_end = w.end
-
-    flush()
-    return segments
-
-
-def _joined_len(ws: Tuple[WordSpan, ...]) -> int:
-    """Function to calculate the length of joined words including spaces.
-    Args:
-        ws (Tuple[WordSpan, ...]): Tuple of WordSpan objects.
-    Returns:
-        int: The total length of the joined words including spaces.
-    """
-    if not ws:
-        return 0
-    return sum(len(w.text) for w in ws) + (len(ws) - 1)
+    bounds = WordColumns.from_spans(words).segment_bounds(max_chars, max_duration)
+    return [
+        SegmentSpan(words[i].start, words[j - 1].end, tuple(words[i:j]))
+        for i, j in bounds
+    ]
 
 
 def split_to_two_lines(
@@ -166,9 +305,12 @@ def split_to_two_lines(
     best_cut = 1
     best_score = float("inf")
 
+    # running lengths of both lines, joined with spaces
+    total = sum(len(w.text) for w in words) + n - 1
+    l1 = -1
     for cut in range(1, n):
-        l1 = _joined_len(words[:cut])
-        l2 = _joined_len(words[cut:])
+        l1 += len(words[cut - 1].text) + 1
+        l2 = total - l1 - 1
 
         penalty = 0
         if l1 > max_chars_per_line:
@@ -196,11 +338,159 @@ def segments_to_two_lines(
     return [split_to_two_lines(s, max_chars_per_line) for s in segments]
 
 
+class KaraokeTimeline:
+    """Class for looking up the visible segment and highlighted word at a given time.
+
+    Segment and word start times are kept in sorted lists, so each lookup is a
+    binary search instead of a scan over every segment and word.
+    """
+
+    def __init__(self, segments: List[TwoLineSegment], safety_pad: float = 0.0):
+        """Initialize the timeline.
+        Args:
+            segments (List[TwoLineSegment]): Two-line segments sorted by start time.
+            safety_pad (float): Extra time a segment stays visible after its end.
+        """
+        self.segments = segments
+        self.safety_pad = safety_pad
+        self._seg_starts = [s.start for s in segments]
+        self._word_starts = [[w.start for w in s.words] for s in segments]
+
+    @property
+    def duration(self) -> float:
+        """float: Time at which the last segment disappears."""
+        if not self.segments:
+            return 0.0
+        return self.segments[-1].end + self.safety_pad
+
+    def locate(self, t: float) -> Optional[Tuple[int, int]]:
+        """Function to find the segment and highlighted word visible at time t.
+        Args:
+            t (float): Absolute time in seconds.
+        Returns:
+            Optional[Tuple[int, int]]: Segment index and highlighted word index,
+            or None if no segment is visible.
+        """
+        i = bisect_right(self._seg_starts, t) - 1
+        if i < 0:
+            return None
+        seg = self.segments[i]
+        if t >= seg.end + self.safety_pad or not seg.words:
+            return None
+        # last word that already started; before the first word highlight it
+        hi = max(bisect_right(self._word_starts[i], t) - 1, 0)
+        return i, hi
+
+
+@dataclass
+class CacheStats:
+    """Counters of an ImageCache."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    disk_hits: int = 0
+    disk_writes: int = 0
+    disk_evictions: int = 0
+
+
+def report_cache_stats(cache: "ImageCache", since: CacheStats) -> None:
+    """Function to add the activity of a cache to the pipeline metrics.
+    Args:
+        cache (ImageCache): The cache.
+        since (CacheStats): Copy of the cache stats taken before the activity.
+    """
+    metrics = get_metrics()
+    before = asdict(since)
+    for name, value in asdict(cache.stats).items():
+        metrics.count(f"image_cache_{name}", value - before[name])
+
+
 class ImageCache:
-    """Class for caching rendered images."""
+    """Class for caching rendered images.
+
+    Images are kept in memory in LRU order under a byte budget. When `disk_dir`
+    is set, images are also stored there as .npy files named by a hash of the
+    key and loaded memory-mapped, so later renders of the same captions skip
+    rasterization. The least recently used files are deleted when the
+    directory grows over `disk_max_bytes`. The cache may be shared by threads,
+    such as the outputs of a multi-format render.
+    """
 
-    def __init__(self):
-        self._cache: Dict[Tuple, np.ndarray] = {}
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 1024 * 1024 * 1024,
+    ):
+        """Initialize the cache.
+        Args:
+            max_bytes (int): Memory budget for cached images in bytes.
+            disk_dir (Optional[str]): Directory of the on-disk tier, disabled
+                if None.
+            disk_max_bytes (int): Size budget of the on-disk tier in bytes.
+        """
+        self._cache: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.disk_dir = disk_dir
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self.disk_max_bytes = disk_max_bytes
+        self._disk_bytes = 0
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _disk_path(self, key: Tuple) -> str:
+        digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, digest + ".npy")
+
+    def _disk_entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict_disk(self) -> None:
+        """Delete least recently used files until the disk tier fits its budget."""
+        entries = self._disk_entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._disk_bytes = total
+            self.stats.disk_evictions += evicted
+
+    def _put(self, key: Tuple, value: np.ndarray) -> None:
+        # called with the lock held
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        if value.nbytes > self.max_bytes:
+            return
+        self._cache[key] = value
+        self.nbytes += value.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.stats.evictions += 1
 
     def get(self, key: Tuple) -> Optional[np.ndarray]:
         """Function to get a cached image.
@@ -208,7 +498,30 @@ class ImageCache:
             key (Tuple): The key for the cached image.
         Returns:
             Optional[np.ndarray]: The cached image or None if not found."""
-        return self._cache.get(key)
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+                self.stats.hits += 1
+                return value
+
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            try:
+                value = np.load(path, mmap_mode="r")
+                os.utime(path)  # mark as recently used
+            except (OSError, ValueError):
+                value = None  # missing, evicted meanwhile or unreadable
+            if value is not None:
+                with self._lock:
+                    self._put(key, value)
+                    self.stats.hits += 1
+                    self.stats.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.stats.misses += 1
+        return None
 
     def set(self, key: Tuple, value: np.ndarray) -> None:
         """Function to set a cached image.
@@ -216,54 +529,89 @@ class ImageCache:
             key (Tuple): The key for the cached image.
             value (np.ndarray): The image to cache.
         """
-        self._cache[key] = value
+        with self._lock:
+            self._put(key, value)
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            # unique per writer, threads of one process may write the same key
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as file:
+                np.save(file, value)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self.stats.disk_writes += 1
+                self._disk_bytes += os.path.getsize(path)
+                over = self._disk_bytes > self.disk_max_bytes
+            if over:
+                self.evict_disk()
+
+
+HIGHLIGHT_COLOR = (255, 235, 59, 255)
+TEXT_COLOR = (255, 255, 255, 255)
+STROKE_COLOR = (0, 0, 0, 255)
+
+
+@lru_cache(maxsize=64)
+def load_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    """Function to load a font, cached per (path, size).
+    Args:
+        font_path (str): Path to the font file.
+        font_size (int): Font size.
+    Returns:
+        ImageFont.FreeTypeFont: The loaded font.
+    """
+    return ImageFont.truetype(font_path, font_size)
 
 
-def render_two_line_image(
+@lru_cache(maxsize=64)
+def font_stamp(font_path: str) -> Tuple[int, int]:
+    """Function to identify the contents of a font file, cached like `load_font`.
+    Args:
+        font_path (str): Path to the font file.
+    Returns:
+        Tuple[int, int]: Size and modification time in ns of the file, so that
+        images cached on disk are not reused once the font is replaced.
+    """
+    stat = os.stat(font_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+@dataclass(frozen=True)
+class TwoLineLayout:
+    """Layout of a two-line image, shared by all of its highlight variants."""
+
+    font_size: int
+    width: int
+    height: int
+    positions: Tuple[Tuple[int, int], ...]  # text origin of each word
+
+
+@lru_cache(maxsize=1024)
+def layout_two_lines(
     words: Tuple[str, ...],
     cut_index: int,
-    highlight_index: int,
     canvas_w: int,
     font_path: str,
     font_size: int,
-    cache: ImageCache,
     padding: int = 18,
     line_gap: int = 10,
     stroke: int = 4,
     min_font_size: int = 12,
-) -> np.ndarray:
-    """Render a two-line karaoke image with highlighted word.
+) -> TwoLineLayout:
+    """Compute font size, line split and word positions of a two-line image.
     Args:
         words (Tuple[str, ...]): Tuple of words to render.
         cut_index (int): Index to split words into two lines.
-        highlight_index (int): Index of the word to highlight.
         canvas_w (int): Width of the canvas.
         font_path (str): Path to the font file.
         font_size (int): Initial font size.
-        cache (ImageCache): Cache for rendered images.
         padding (int): Padding around the text.
         line_gap (int): Gap between the two lines.
         stroke (int): Stroke width for text outline.
         min_font_size (int): Minimum font size to use.
     Returns:
-        np.ndarray: The rendered image as a NumPy array.
+        TwoLineLayout: The computed layout.
     """
-    # cache key MUST depend on font_size (it will be auto-changed)
-    key = (
-        words,
-        cut_index,
-        highlight_index,
-        canvas_w,
-        font_path,
-        font_size,
-        padding,
-        line_gap,
-        stroke,
-    )
-    cached = cache.get(key)
-    if cached is not None:
-        return cached
-
     line1 = words[:cut_index]
     line2 = words[cut_index:]
 
@@ -272,7 +620,7 @@ def render_two_line_image(
 
     def measure(font, ws):
         if not ws:
-            return 0.0, []
+            return 0.0, [], 0.0
         space_w = float(font.getlength(" "))
         widths = [float(font.getlength(w)) for w in ws]
         total = sum(widths) + space_w * (len(ws) - 1)
@@ -281,7 +629,7 @@ def render_two_line_image(
     # Auto-fit: if any line is too wide (with stroke margin), decrease font size
     fs = int(font_size)
     while True:
-        font = ImageFont.truetype(font_path, fs)
+        font = load_font(font_path, fs)
         w1, widths1, space_w1 = measure(font, line1)
         w2, widths2, space_w2 = measure(font, line2)
 
@@ -297,128 +645,409 @@ def render_two_line_image(
 
     img_h = int(text_h * (2 if line2 else 1) + padding * 2 + (line_gap if line2 else 0))
 
-    img = Image.new("RGBA", (img_w, img_h), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(img)
+    positions: List[Tuple[int, int]] = []
 
-    def draw_line(ws, widths, space_w, y, offset):
-        if not ws:
-            return
-        total_line_w = sum(widths) + space_w * (len(ws) - 1)
+    def place_line(total_line_w, widths, space_w, y):
         x = (img_w - total_line_w) / 2.0  # centered within the full width
+        for w in widths:
+            positions.append((int(round(x)), y))
+            x += w + space_w
 
-        for i, word in enumerate(ws):
-            gi = offset + i
-            color = (
-                (255, 235, 59, 255) if gi == highlight_index else (255, 255, 255, 255)
-            )
-            draw.text(
-                (x, y),
-                word,
-                font=font,
-                fill=color,
-                stroke_width=stroke,
-                stroke_fill=(0, 0, 0, 255),
-            )
-            x += widths[i] + space_w
-
-    y = padding
-    draw_line(line1, widths1, space_w1, y, 0)
+    place_line(w1, widths1, space_w1, padding)
     if line2:
-        draw_line(line2, widths2, space_w2, y + text_h + line_gap, cut_index)
+        place_line(w2, widths2, space_w2, padding + text_h + line_gap)
 
-    arr = np.array(img)
-    cache.set(key, arr)
-    return arr
+    return TwoLineLayout(fs, img_w, img_h, tuple(positions))
 
 
-def make_segment_karaoke_clip(
-    seg: TwoLineSegment,
-    video_w: int,
-    y_pos: int,
+@lru_cache(maxsize=4096)
+def render_word(
+    word: str,
+    font_path: str,
+    font_size: int,
+    stroke: int,
+    color: Tuple[int, int, int, int],
+) -> Tuple[Image.Image, int, int]:
+    """Rasterize a single stroked word, cached per (word, font, size, colour).
+    Args:
+        word (str): The word to render.
+        font_path (str): Path to the font file.
+        font_size (int): Font size.
+        stroke (int): Stroke width for text outline.
+        color (Tuple[int, int, int, int]): Fill colour of the text.
+    Returns:
+        Tuple[Image.Image, int, int]: The word bitmap and its offset from the
+        text origin.
+    """
+    font = load_font(font_path, font_size)
+    left, top, right, bottom = font.getbbox(word, stroke_width=stroke)
+    img = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), (0, 0, 0, 0))
+    ImageDraw.Draw(img).text(
+        (-left, -top),
+        word,
+        font=font,
+        fill=color,
+        stroke_width=stroke,
+        stroke_fill=STROKE_COLOR,
+    )
+    return img, left, top
+
+
+def _blit(canvas: Image.Image, bitmap: Image.Image, x: int, y: int) -> None:
+    """Function to alpha-composite a bitmap onto a canvas, clipped to its bounds.
+    Args:
+        canvas (Image.Image): The RGBA canvas.
+        bitmap (Image.Image): The RGBA bitmap.
+        x (int): Horizontal position of the bitmap.
+        y (int): Vertical position of the bitmap.
+    """
+    sx, sy = max(0, -x), max(0, -y)
+    w = min(bitmap.width, canvas.width - x) - sx
+    h = min(bitmap.height, canvas.height - y) - sy
+    if w <= 0 or h <= 0:
+        return
+    canvas.alpha_composite(
+        bitmap, dest=(x + sx, y + sy), source=(sx, sy, sx + w, sy + h)
+    )
+
+
+def render_two_line_image(
+    words: Tuple[str, ...],
+    cut_index: int,
+    highlight_index: int,
+    canvas_w: int,
     font_path: str,
     font_size: int,
     cache: ImageCache,
-    fps: float,
-    safety_pad: float = 0.0,  # set e.g. 1/fps
-):
-    """Function to create a karaoke clip for a segment.
+    padding: int = 18,
+    line_gap: int = 10,
+    stroke: int = 4,
+    min_font_size: int = 12,
+) -> np.ndarray:
+    """Render a two-line karaoke image with highlighted word.
+
+    The layout is computed once per word sequence and each word is rasterized
+    once per colour, so a highlight variant is only a few bitmap blits.
     Args:
-        seg (TwoLineSegment): The segment to create the clip for.
-        video_w (int): Width of the video.
-        y_pos (int): Vertical position of the clip.
+        words (Tuple[str, ...]): Tuple of words to render.
+        cut_index (int): Index to split words into two lines.
+        highlight_index (int): Index of the word to highlight.
+        canvas_w (int): Width of the canvas.
         font_path (str): Path to the font file.
-        font_size (int): Font size for rendering text.
+        font_size (int): Initial font size.
         cache (ImageCache): Cache for rendered images.
-        fps (float): Frames per second of the video.
-        safety_pad (float): Safety padding to avoid edge cases.
+        padding (int): Padding around the text.
+        line_gap (int): Gap between the two lines.
+        stroke (int): Stroke width for text outline.
+        min_font_size (int): Minimum font size to use.
     Returns:
-        VideoClip: The created karaoke clip with mask.
+        np.ndarray: The rendered image as a NumPy array.
     """
-    texts = tuple(w.text for w in seg.words)
-    words = seg.words
+    # cache key MUST depend on font_size (it will be auto-changed)
+    key = (
+        words,
+        cut_index,
+        highlight_index,
+        canvas_w,
+        font_path,
+        font_stamp(font_path),
+        font_size,
+        padding,
+        line_gap,
+        stroke,
+    )
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    layout = layout_two_lines(
+        words,
+        cut_index,
+        canvas_w,
+        font_path,
+        font_size,
+        padding,
+        line_gap,
+        stroke,
+        min_font_size,
+    )
 
-    state = {"hi": -1, "rgba": None}
+    img = Image.new("RGBA", (layout.width, layout.height), (0, 0, 0, 0))
+    for i, (word, (x, y)) in enumerate(zip(words, layout.positions)):
+        color = HIGHLIGHT_COLOR if i == highlight_index else TEXT_COLOR
+        bitmap, dx, dy = render_word(word, font_path, layout.font_size, stroke, color)
+        _blit(img, bitmap, x + dx, y + dy)
 
-    def pick_highlight(abs_t: float) -> int:
-        for i, w in enumerate(words):
-            if w.start <= abs_t < w.end:
-                return i
+    arr = np.array(img)
+    cache.set(key, arr)
+    return arr
 
-        if abs_t < words[0].start:
-            return 0
-        if abs_t >= words[-1].end:
-            return len(words) - 1
 
-        last = 0
-        for i, w in enumerate(words):
-            if abs_t >= w.start:
-                last = i
-            else:
-                break
-        return last
-
-    def ensure_rgba(abs_t: float) -> None:
-        hi = pick_highlight(abs_t)
-        if hi != state["hi"] or state["rgba"] is None:
-            state["hi"] = hi
-            state["rgba"] = render_two_line_image(
-                texts,
+@dataclass(frozen=True)
+class CaptionSprite:
+    """Rendered caption cropped to its tight bounding box, ready for blending.
+
+    Alpha is stored on a 0..256 scale so that blending is integer-only:
+    out = (frame * inv_alpha + premultiplied) >> 8.
+    """
+
+    x: int
+    y: int
+    premultiplied: np.ndarray  # (h, w, 3) uint16, rgb * alpha
+    inv_alpha: np.ndarray  # (h, w, 1) uint16, 256 - alpha
+
+    @classmethod
+    def from_rgba(
+        cls, rgba: np.ndarray, x: int, y: int, frame_w: int, frame_h: int
+    ) -> Optional["CaptionSprite"]:
+        """Function to build a sprite from an RGBA image placed at (x, y).
+        Args:
+            rgba (np.ndarray): The rendered RGBA image.
+            x (int): Horizontal position of the image in the frame.
+            y (int): Vertical position of the image in the frame.
+            frame_w (int): Width of the frame the sprite is blended into.
+            frame_h (int): Height of the frame the sprite is blended into.
+        Returns:
+            Optional[CaptionSprite]: The sprite or None if nothing is visible.
+        """
+        # clip the image to the frame first
+        x0, y0 = max(0, -x), max(0, -y)
+        x1 = min(rgba.shape[1], frame_w - x)
+        y1 = min(rgba.shape[0], frame_h - y)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        alpha = rgba[y0:y1, x0:x1, 3]
+
+        rows = np.flatnonzero(alpha.any(axis=1))
+        cols = np.flatnonzero(alpha.any(axis=0))
+        if rows.size == 0:
+            return None
+        r0, r1 = y0 + rows[0], y0 + rows[-1] + 1
+        c0, c1 = x0 + cols[0], x0 + cols[-1] + 1
+
+        crop = rgba[r0:r1, c0:c1]
+        a = crop[..., 3:4].astype(np.uint16)
+        a += a >> 7  # 0..255 -> 0..256, so that opaque pixels stay exact
+        return cls(
+            x=int(x + c0),
+            y=int(y + r0),
+            premultiplied=crop[..., :3].astype(np.uint16) * a,
+            inv_alpha=256 - a,
+        )
+
+
+def blend_sprite(frame: np.ndarray, sprite: CaptionSprite, scratch: np.ndarray) -> None:
+    """Function to blend a sprite into a frame in place.
+    Args:
+        frame (np.ndarray): Writable (h, w, 3) uint8 frame.
+        sprite (CaptionSprite): The sprite to blend.
+        scratch (np.ndarray): Flat uint16 buffer of at least 3 values per
+            pixel of the sprite, reused between calls.
+    """
+    h, w = sprite.inv_alpha.shape[:2]
+    region = frame[sprite.y : sprite.y + h, sprite.x : sprite.x + w]
+    tmp = scratch[: h * w * 3].reshape(h, w, 3)
+    np.multiply(region, sprite.inv_alpha, out=tmp)
+    tmp += sprite.premultiplied
+    tmp >>= 8
+    np.copyto(region, tmp, casting="unsafe")
+
+
+class KaraokeCompositor:
+    """Class for blending karaoke captions into background frames.
+
+    Only the bounding box of the current caption is blended, with integer
+    math on buffers that are allocated once and reused for every frame.
+    """
+
+    def __init__(
+        self,
+        timeline: KaraokeTimeline,
+        video_w: int,
+        video_h: int,
+        y_pos: int,
+        font_path: str,
+        font_size: int,
+        cache: ImageCache,
+        scale: float = 1.0,
+    ):
+        """Initialize the compositor.
+        Args:
+            timeline (KaraokeTimeline): Timeline of the segments to display.
+            video_w (int): Width of the video.
+            video_h (int): Height of the video.
+            y_pos (int): Vertical position of the subtitles.
+            font_path (str): Path to the font file.
+            font_size (int): Font size for rendering text.
+            cache (ImageCache): Cache for rendered images.
+            scale (float): Scale of the padding, line gap, stroke and minimum
+                font size of the images, for a downscaled copy of a layout.
+        """
+        self.timeline = timeline
+        self.video_w = video_w
+        self.video_h = video_h
+        self.y_pos = y_pos
+        self.font_path = font_path
+        self.font_size = font_size
+        self.cache = cache
+        self._layout = (
+            {}
+            if scale == 1.0
+            else dict(
+                padding=max(1, round(18 * scale)),
+                line_gap=max(1, round(10 * scale)),
+                stroke=max(1, round(4 * scale)),
+                min_font_size=max(1, round(12 * scale)),
+            )
+        )
+
+        self._metrics = get_metrics()
+        self._key: Optional[Tuple[int, int]] = None
+        self._sprite: Optional[CaptionSprite] = None
+        self._frame = np.empty((video_h, video_w, 3), dtype=np.uint8)
+        self._scratch = np.empty(video_h * video_w * 3, dtype=np.uint16)
+
+    def sprite_at(self, t: float) -> Optional[CaptionSprite]:
+        """Function to get the caption sprite visible at time t.
+        Args:
+            t (float): Absolute time in seconds.
+        Returns:
+            Optional[CaptionSprite]: The sprite or None if no caption is visible.
+        """
+        key = self.timeline.locate(t)
+        if key == self._key:
+            return self._sprite
+
+        self._key = key
+        self._sprite = None
+        if key is not None:
+            # images are rendered at full video width, so they start at x=0
+            self._sprite = CaptionSprite.from_rgba(
+                self.image(key), 0, self.y_pos, self.video_w, self.video_h
+            )
+        return self._sprite
+
+    def image(self, key: Tuple[int, int]) -> np.ndarray:
+        """Function to render the caption of a segment with a highlighted word.
+        Args:
+            key (Tuple[int, int]): Segment index and highlighted word index.
+        Returns:
+            np.ndarray: The RGBA image, placed at (0, y_pos) in the frame.
+        """
+        seg = self.timeline.segments[key[0]]
+        with self._metrics.timer("caption_raster"):
+            return render_two_line_image(
+                tuple(w.text for w in seg.words),
                 seg.cut_index,
-                hi,
-                video_w,
-                font_path,
-                font_size,
-                cache,
+                key[1],
+                self.video_w,
+                self.font_path,
+                self.font_size,
+                self.cache,
+                **self._layout,
             )
 
-    def make_frame_rgb(t: float):
-        abs_t = seg.start + t
-        ensure_rgba(abs_t)
-        return state["rgba"][..., :3]
+    def blend_into(self, frame: np.ndarray, sprite: CaptionSprite) -> None:
+        """Function to blend a sprite into a frame in place.
+        Args:
+            frame (np.ndarray): Writable (h, w, 3) uint8 frame.
+            sprite (CaptionSprite): The sprite to blend.
+        """
+        blend_sprite(frame, sprite, self._scratch)
+
+    def composite(self, get_frame, t: float) -> np.ndarray:
+        """Function to use with `clip.transform` to draw captions on a clip.
 
-    def make_frame_rgba(t: float):
-        abs_t = seg.start + t
-        ensure_rgba(abs_t)
-        return state["rgba"]
+        The returned array is an internal buffer reused on the next call.
+        Args:
+            get_frame: Function returning the background frame at time t.
+            t (float): Time in seconds.
+        Returns:
+            np.ndarray: The frame with the caption blended in.
+        """
+        self._metrics.count("frames_rendered")
+        frame = get_frame(t)
+        sprite = self.sprite_at(t)
+        if sprite is None:
+            return frame
+        np.copyto(self._frame, frame[..., :3])
+        self.blend_into(self._frame, sprite)
+        return self._frame
 
-    dur = (seg.end - seg.start) + safety_pad
 
-    # RGB Clip
-    clip = (
-        VideoClip(make_frame_rgb, duration=dur)
-        .with_start(seg.start)
-        .with_position(("center", y_pos))
+def alignment_to_two_lines(
+    alignment_obj,
+    max_segment_chars: int = 60,
+    max_segment_duration: float = 2.8,
+    max_chars_per_line: int = 20,
+) -> List[TwoLineSegment]:
+    """Function to turn an alignment object into two-line karaoke segments.
+    Args:
+        alignment_obj: Alignment object containing character-level alignment data.
+        max_segment_chars (int): Maximum characters per segment.
+        max_segment_duration (float): Maximum duration of each segment in seconds.
+        max_chars_per_line (int): Maximum characters per line.
+    Returns:
+        List[TwoLineSegment]: List of two-line segments.
+    """
+    columns = WordColumns.from_alignment(
+        alignment_obj.characters,
+        alignment_obj.character_start_times_seconds,
+        alignment_obj.character_end_times_seconds,
     )
+    return columns.two_line_segments(
+        max_segment_chars, max_segment_duration, max_chars_per_line
+    )
+
 
-    # RGBA Clip converted to Mask
-    rgba_clip = (
-        VideoClip(make_frame_rgba, duration=dur)
-        .with_start(seg.start)
-        .with_position(("center", y_pos))
+def add_karaoke(
+    video,
+    alignment_obj,
+    font_path: str,
+    max_segment_chars: int = 60,
+    max_segment_duration: float = 2.8,
+    max_chars_per_line: int = 20,
+    y_pos_ratio: float = 0.5,
+    font_size_ratio: float = 0.06,
+    cache: Optional[ImageCache] = None,
+):
+    """Function to overlay karaoke subtitles on a clip without rendering it.
+    Args:
+        video: The clip to put the subtitles on.
+        alignment_obj: Alignment object containing character-level alignment data.
+        font_path (str): Path to the font file for rendering subtitles.
+        max_segment_chars (int): Maximum characters per segment.
+        max_segment_duration (float): Maximum duration of each segment in seconds.
+        max_chars_per_line (int): Maximum characters per line.
+        y_pos_ratio (float): Vertical position ratio for subtitles.
+        font_size_ratio (float): Font size ratio relative to video height.
+        cache (Optional[ImageCache]): Cache for rendered images, a new one if None.
+    Returns:
+        VideoClip: The clip with subtitles blended in.
+    """
+    two_lines = alignment_to_two_lines(
+        alignment_obj, max_segment_chars, max_segment_duration, max_chars_per_line
     )
-    mask = rgba_clip.to_mask()
 
-    return clip.with_mask(mask)
+    font_size = max(18, int(video.h * font_size_ratio))
+    y_pos = int(video.h * y_pos_ratio)
+
+    fps = float(getattr(video, "fps", 30)) or 30.0
+    safety_pad = 1.0 / fps  # removing edge cases with timing
+
+    if not two_lines:
+        return video
+
+    compositor = KaraokeCompositor(
+        KaraokeTimeline(two_lines, safety_pad),
+        video_w=video.w,
+        video_h=video.h,
+        y_pos=y_pos,
+        font_path=font_path,
+        font_size=font_size,
+        cache=cache if cache is not None else ImageCache(),
+    )
+    return video.transform(compositor.composite)
 
 
 def burn_karaoke_moviepy(
@@ -431,6 +1060,7 @@ def burn_karaoke_moviepy(
     max_chars_per_line: int = 20,
     y_pos_ratio: float = 0.5,
     font_size_ratio: float = 0.06,
+    cache: Optional[ImageCache] = None,
 ):
     """Function to burn karaoke subtitles onto a video using MoviePy.
     Args:
@@ -443,6 +1073,7 @@ def burn_karaoke_moviepy(
         max_chars_per_line (int): Maximum characters per line.
         y_pos_ratio (float): Vertical position ratio for subtitles.
         font_size_ratio (float): Font size ratio relative to video height.
+        cache (Optional[ImageCache]): Cache for rendered images, a new one if None.
     Example:
         burn_karaoke_moviepy(
             video_path="video.mp4",
@@ -451,39 +1082,27 @@ def burn_karaoke_moviepy(
             font_path="/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
         )
     """
-    video = VideoFileClip(video_path)
+    from moviepy import VideoFileClip
 
-    words = alignment_to_words(
-        alignment_obj.characters,
-        alignment_obj.character_start_times_seconds,
-        alignment_obj.character_end_times_seconds,
-    )
-
-    segments = words_to_segments(words, max_segment_chars, max_segment_duration)
-    two_lines = segments_to_two_lines(segments, max_chars_per_line)
-
-    font_size = max(18, int(video.h * font_size_ratio))
-    y_pos = int(video.h * y_pos_ratio)
-
-    cache = ImageCache()
-    clips = []
+    metrics = get_metrics()
+    cache = cache if cache is not None else ImageCache()
+    cache_stats = replace(cache.stats)
 
+    video = VideoFileClip(video_path)
     fps = float(getattr(video, "fps", 30)) or 30.0
-    safety_pad = 1.0 / fps  # removing edge cases with timing
-
-    for seg in two_lines:
-        clips.append(
-            make_segment_karaoke_clip(
-                seg=seg,
-                video_w=video.w,
-                y_pos=y_pos,
-                font_path=font_path,
-                font_size=font_size,
-                cache=cache,
-                fps=fps,
-                safety_pad=safety_pad,
-            )
-        )
 
-    final = CompositeVideoClip([video, *clips])
-    final.write_videofile(output_path, audio_codec="aac", fps=int(round(fps)))
+    final = add_karaoke(
+        video,
+        alignment_obj,
+        font_path,
+        max_segment_chars=max_segment_chars,
+        max_segment_duration=max_segment_duration,
+        max_chars_per_line=max_chars_per_line,
+        y_pos_ratio=y_pos_ratio,
+        font_size_ratio=font_size_ratio,
+        cache=cache,
+    )
+    with metrics.span("encode", renderer="burn_karaoke_moviepy"):
+        final.write_videofile(output_path, audio_codec="aac", fps=int(round(fps)))
+    report_cache_stats(cache, cache_stats)
+    metrics.flush()
@@ -0,0 +1,445 @@
+import fcntl
+import json
+import os
+import re
+import resource
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import Dict, Optional, Tuple
+
+_NOOP = nullcontext()
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_METRIC_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _rss_bytes() -> int:
+    """Function to read the current resident set size of the process.
+    Returns:
+        int: RSS in bytes, the peak RSS where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as file:
+            return int(file.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Span:
+    """Timed region of a pipeline stage, written as one JSON line on exit."""
+
+    __slots__ = ("metrics", "name", "labels", "started", "start", "peak_rss")
+
+    def __init__(self, metrics: "Metrics", name: str, labels: Dict[str, object]):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "Span":
+        self.started = time.time()
+        self.peak_rss = _rss_bytes()
+        self.metrics._open(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        seconds = time.perf_counter() - self.start
+        self.metrics._close(self)
+        self.peak_rss = max(self.peak_rss, _rss_bytes())
+        self.metrics._emit(
+            {
+                "type": "span",
+                "name": self.name,
+                "labels": {k: str(v) for k, v in self.labels.items()},
+                "start": self.started,
+                "seconds": seconds,
+                "peak_rss_bytes": self.peak_rss,
+                "error": None if exc_type is None else exc_type.__name__,
+                "pid": os.getpid(),
+            }
+        )
+
+
+class _Timer:
+    """Adds the time spent in a block to a counter, without writing a line."""
+
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics: "Metrics", name: str, labels: Dict[str, object]):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.metrics.count(
+            self.name + "_seconds", time.perf_counter() - self.start, **self.labels
+        )
+
+
+class Metrics:
+    """Collector of spans and counters of the production pipeline.
+
+    Spans are appended to a JSON Lines file as they end, counters are kept in
+    memory until `flush`, which also adds the records appended to the JSON
+    Lines file since the last flush, by any process, to the totals of the
+    Prometheus textfile. While spans
+    are open, a background thread samples the RSS to record their peak memory.
+    When disabled, `span` and `timer` return a shared no-op context manager
+    and `count` returns immediately.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        jsonl_path: Optional[str] = None,
+        prometheus_path: Optional[str] = None,
+        sample_interval: float = 0.05,
+    ):
+        """Initialize the collector.
+        Args:
+            enabled (bool): Whether to record anything.
+            jsonl_path (Optional[str]): File the records are appended to.
+            prometheus_path (Optional[str]): Prometheus textfile written on flush.
+            sample_interval (float): Seconds between RSS samples while spans are open.
+        """
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.sample_interval = sample_interval
+
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self._spans: set = set()
+        self._sampler: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+
+    def span(self, name: str, **labels):
+        """Function to time a stage.
+        Args:
+            name (str): Name of the stage.
+            **labels: Extra fields of the record, e.g. the job id.
+        Returns:
+            Context manager timing the block.
+        """
+        if not self.enabled:
+            return _NOOP
+        return Span(self, name, labels)
+
+    def timer(self, name: str, **labels):
+        """Function to add the time spent in a block to the `<name>_seconds` counter.
+        Args:
+            name (str): Name of the counter without the suffix.
+            **labels: Labels of the counter.
+        Returns:
+            Context manager timing the block.
+        """
+        if not self.enabled:
+            return _NOOP
+        return _Timer(self, name, labels)
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        """Function to add a value to a counter.
+        Args:
+            name (str): Name of the counter.
+            value (float): Value to add.
+            **labels: Labels of the counter.
+        """
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] += value
+
+    def flush(self) -> None:
+        """Function to write the counters and update the Prometheus textfile."""
+        if not self.enabled:
+            return
+        with self._lock:
+            counters, self._counters = self._counters, defaultdict(float)
+        now = time.time()
+        for (name, labels), value in counters.items():
+            self._emit(
+                {
+                    "type": "counter",
+                    "name": name,
+                    "labels": dict(labels),
+                    "value": value,
+                    "time": now,
+                    "pid": os.getpid(),
+                }
+            )
+        if self.prometheus_path and self.jsonl_path:
+            write_prometheus(self.jsonl_path, self.prometheus_path)
+
+    def _emit(self, record: dict) -> None:
+        if not self.jsonl_path:
+            return
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            # one write per line on an O_APPEND file, so processes can share it
+            with open(self.jsonl_path, "a", encoding="utf-8") as file:
+                file.write(line)
+
+    def _open(self, span: Span) -> None:
+        with self._lock:
+            self._spans.add(span)
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._sample, name="metrics-rss", daemon=True
+                )
+                self._sampler.start()
+        self._wakeup.set()
+
+    def _close(self, span: Span) -> None:
+        with self._lock:
+            self._spans.discard(span)
+
+    def _sample(self) -> None:
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                spans = list(self._spans)
+                if not spans:
+                    self._wakeup.clear()
+                    continue
+            rss = _rss_bytes()
+            for span in spans:
+                if rss > span.peak_rss:
+                    span.peak_rss = rss
+            time.sleep(self.sample_interval)
+
+
+def _prometheus_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{_METRIC_NAME.sub("_", k)}="'
+        + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        + '"'
+        for k, v in sorted(labels.items())
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _load_totals(state_path: str) -> dict:
+    """Function to read the totals of a Prometheus textfile and how far they go.
+    Args:
+        state_path (str): The state file written by `write_prometheus`.
+    Returns:
+        dict: Byte offset and inode of the JSON Lines file read so far and the
+        totals, empty ones if there is no state yet.
+    """
+    try:
+        with open(state_path, "r", encoding="utf-8") as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        state = {}
+    state.setdefault("offset", 0)
+    state.setdefault("inode", None)
+    for key in ("seconds", "runs", "errors", "peak"):
+        state.setdefault(key, {})
+    state.setdefault("counters", [])
+    return state
+
+
+def write_prometheus(
+    jsonl_path: str, prometheus_path: str, state_path: Optional[str] = None
+) -> None:
+    """Function to add new records of a JSON Lines metrics file to a textfile.
+
+    Spans are aggregated per stage name (total seconds, runs, errors and the
+    highest peak RSS), counters are summed per name and labels. The totals and
+    the offset of the JSON Lines file they cover are kept in a small state
+    file, so each call only reads the lines appended since the previous one,
+    by any process, however long the history is. If the JSON Lines file was
+    rotated or truncated, the new file is read from its start and added to the
+    totals, which only ever grow as Prometheus counters do.
+    Args:
+        jsonl_path (str): The JSON Lines file written by `Metrics`.
+        prometheus_path (str): Path of the textfile, replaced atomically.
+        state_path (Optional[str]): State file, `<prometheus_path>.state` if None.
+    """
+    state_path = state_path or prometheus_path + ".state"
+    with open(state_path + ".lock", "a") as lock:
+        # processes flushing at the same time would each add the same lines
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = _load_totals(state_path)
+        _add_new_records(jsonl_path, state)
+        tmp_path = f"{state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(state, file, separators=(",", ":"))
+        os.replace(tmp_path, state_path)
+        _write_textfile(state, prometheus_path)
+
+
+def _add_new_records(jsonl_path: str, state: dict) -> None:
+    """Function to add the lines appended to a JSON Lines file to the totals.
+    Args:
+        jsonl_path (str): The JSON Lines file written by `Metrics`.
+        state (dict): Totals loaded by `_load_totals`, updated in place.
+    """
+    seconds = defaultdict(float, state["seconds"])
+    runs = defaultdict(int, state["runs"])
+    errors = defaultdict(int, state["errors"])
+    peak = defaultdict(int, state["peak"])
+    counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+    for name, labels, value in state["counters"]:
+        counters[(name, _labels(labels))] += value
+
+    try:
+        file = open(jsonl_path, "rb")
+    except FileNotFoundError:
+        return
+    with file:
+        inode = os.fstat(file.fileno()).st_ino
+        offset = state["offset"]
+        if inode != state["inode"] or os.fstat(file.fileno()).st_size < offset:
+            offset = 0  # a new file
+        file.seek(offset)
+        data = file.read()
+    # a line without its newline is still being written, it is read next time
+    complete = data.rfind(b"\n") + 1
+    for line in data[:complete].splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        name = record.get("name", "")
+        if record.get("type") == "span":
+            seconds[name] += record["seconds"]
+            runs[name] += 1
+            errors[name] += record.get("error") is not None
+            peak[name] = max(peak[name], record.get("peak_rss_bytes", 0))
+        elif record.get("type") == "counter":
+            counters[(name, _labels(record.get("labels", {})))] += record["value"]
+
+    state.update(
+        offset=offset + complete,
+        inode=inode,
+        seconds=seconds,
+        runs=runs,
+        errors=errors,
+        peak=peak,
+        counters=[
+            [name, dict(labels), value] for (name, labels), value in counters.items()
+        ],
+    )
+
+
+def _write_textfile(state: dict, prometheus_path: str) -> None:
+    """Function to write totals as a Prometheus textfile.
+    Args:
+        state (dict): Totals of `_add_new_records`.
+        prometheus_path (str): Path of the textfile, replaced atomically.
+    """
+    seconds, runs = state["seconds"], state["runs"]
+    errors, peak = state["errors"], state["peak"]
+    counters = {
+        (name, _labels(labels)): value for name, labels, value in state["counters"]
+    }
+
+    lines = []
+
+    def family(metric: str, kind: str, help_text: str, samples) -> None:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for labels, value in samples:
+            lines.append(f"{metric}{_prometheus_labels(labels)} {value}")
+
+    stages = sorted(runs)
+    family(
+        "podcaster_stage_seconds_total",
+        "counter",
+        "Time spent in each pipeline stage.",
+        [({"stage": s}, seconds[s]) for s in stages],
+    )
+    family(
+        "podcaster_stage_runs_total",
+        "counter",
+        "Number of times each pipeline stage ran.",
+        [({"stage": s}, runs[s]) for s in stages],
+    )
+    family(
+        "podcaster_stage_errors_total",
+        "counter",
+        "Number of times each pipeline stage failed.",
+        [({"stage": s}, errors[s]) for s in stages],
+    )
+    family(
+        "podcaster_stage_peak_rss_bytes",
+        "gauge",
+        "Highest resident memory seen during each pipeline stage.",
+        [({"stage": s}, peak[s]) for s in stages],
+    )
+    by_name: Dict[str, list] = defaultdict(list)
+    for (name, labels), value in sorted(counters.items()):
+        by_name[name].append((dict(labels), value))
+    for name, samples in by_name.items():
+        family(
+            f"podcaster_{_METRIC_NAME.sub('_', name)}_total",
+            "counter",
+            f"Total of the {name} counter.",
+            samples,
+        )
+
+    tmp_path = f"{prometheus_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, prometheus_path)
+
+
+_metrics: Optional[Metrics] = None
+
+
+def get_metrics() -> Metrics:
+    """Function to get the collector of this process, created from `MetricsConfig`.
+    Returns:
+        Metrics: The shared collector.
+    """
+    global _metrics
+    if _metrics is None:
+        from models.configs import MetricsConfig, get_config
+
+        config = get_config(MetricsConfig)
+        if config.ENABLED:
+            for path in (config.JSONL_PATH, config.PROMETHEUS_PATH):
+                if path and os.path.dirname(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+        _metrics = Metrics(
+            enabled=config.ENABLED,
+            jsonl_path=config.JSONL_PATH,
+            prometheus_path=config.PROMETHEUS_PATH,
+            sample_interval=config.SAMPLE_INTERVAL,
+        )
+    return _metrics
+
+
+def span(name: str, **labels):
+    """Shortcut for `get_metrics().span`."""
+    return get_metrics().span(name, **labels)
+
+
+def timer(name: str, **labels):
+    """Shortcut for `get_metrics().timer`."""
+    return get_metrics().timer(name, **labels)
+
+
+def count(name: str, value: float = 1, **labels) -> None:
+    """Shortcut for `get_metrics().count`."""
+    get_metrics().count(name, value, **labels)
+
+
+def flush() -> None:
+    """Shortcut for `get_metrics().flush`."""
+    get_metrics().flush()
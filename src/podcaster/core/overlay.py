@@ -0,0 +1,531 @@
+import hashlib
+import json
+import os
+from bisect import bisect_right
+from dataclasses import replace
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from core.ffmpeg import probe
+from core.formats import OutputProfile, caption_compositor
+from core.karaoke import (
+    CaptionSprite,
+    ImageCache,
+    KaraokeCompositor,
+    alignment_to_two_lines,
+    blend_sprite,
+    report_cache_stats,
+)
+from core.metrics import get_metrics
+from core.pipe import composite_pipe
+
+TRACK_VERSION = 1
+
+# columns of CaptionTrack.patches used by name
+_W, _H, _KEYFRAME = 3, 4, 5
+
+
+def _changed_box(a: np.ndarray, b: np.ndarray) -> Tuple[int, int, int, int]:
+    """
+    Bounding box of the pixels that differ between two images of one size.
+
+    Args:
+        a (np.ndarray): The first image
+        b (np.ndarray): The second image
+
+    Returns:
+        Tuple[int, int, int, int]: x, y, width and height, all 0 if the
+        images are equal
+    """
+    changed = (a != b).any(axis=2)
+    rows = np.flatnonzero(changed.any(axis=1))
+    if rows.size == 0:
+        return 0, 0, 0, 0
+    cols = np.flatnonzero(changed.any(axis=0))
+    return (
+        int(cols[0]),
+        int(rows[0]),
+        int(cols[-1] + 1 - cols[0]),
+        int(rows[-1] + 1 - rows[0]),
+    )
+
+
+class CaptionTrack:
+    """
+    Caption layer of a video, rendered once and blended onto any background.
+
+    The layer is a sequence of caption states (a segment with one highlighted
+    word) with the times they are visible. The first state of every segment
+    is a keyframe, its RGBA image cropped to the caption; the following ones
+    only keep the rectangle that changed, usually the previous and the new
+    highlighted word. Blending a state rebuilds its sprite from the keyframe
+    and deltas once, when it becomes visible, so compositing a track costs
+    no segmentation or rasterization.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        patches: np.ndarray,
+        pixels: np.ndarray,
+        key: str = "",
+    ):
+        """
+        Wrap the arrays of a track.
+
+        Args:
+            width (int): Width of the frames the track is laid out for
+            height (int): Height of the frames the track is laid out for
+            starts (np.ndarray): (n,) float64 start time of every state
+            ends (np.ndarray): (n,) float64 end time of every state
+            patches (np.ndarray): (n, 6) int64 offset in `pixels`, x, y, width,
+                height and keyframe flag of the image of every state, x and y
+                in the frame for keyframes and in the keyframe for deltas
+            pixels (np.ndarray): Flat uint8 RGBA pixels of all images
+            key (str): Hash of what the track was rendered from
+        """
+        self.width = width
+        self.height = height
+        self.starts = starts
+        self.ends = ends
+        self.patches = patches
+        self.pixels = pixels
+        self.key = key
+
+        self._starts = starts.tolist()  # bisect on a list is faster per frame
+        # index of the keyframe every state is a delta of
+        self._keyframe_of = (
+            np.maximum.accumulate(
+                np.where(patches[:, _KEYFRAME] != 0, np.arange(len(patches)), 0)
+            )
+            if len(patches)
+            else np.zeros(0, dtype=np.int64)
+        )
+        largest = max((int(p[_W] * p[_H]) for p in patches if p[_KEYFRAME]), default=0)
+        self._scratch = np.empty(largest * 3, dtype=np.uint16)
+        self._canvas: Optional[np.ndarray] = None
+        self._applied: Optional[int] = None  # state currently in the canvas
+        self._state: Optional[int] = None
+        self._sprite: Optional[CaptionSprite] = None
+
+    @classmethod
+    def from_compositor(
+        cls, compositor: KaraokeCompositor, key: str = ""
+    ) -> "CaptionTrack":
+        """
+        Render every caption state of a compositor into a track.
+
+        The states and their times are those `compositor.sprite_at` shows,
+        so blending the track draws the same frames as the compositor.
+
+        Args:
+            compositor (KaraokeCompositor): Captions laid out for a frame size
+            key (str): Hash of what the captions were built from
+
+        Returns:
+            CaptionTrack: The track
+        """
+        timeline = compositor.timeline
+        segments = timeline.segments
+        w, h = compositor.video_w, compositor.video_h
+        starts: List[float] = []
+        ends: List[float] = []
+        patches: List[Tuple[int, ...]] = []
+        pixels: List[np.ndarray] = []
+        offset = 0
+
+        def add(image: np.ndarray, x: int, y: int, keyframe: bool) -> None:
+            nonlocal offset
+            patches.append((offset, x, y, image.shape[1], image.shape[0], keyframe))
+            pixels.append(image.reshape(-1))
+            offset += image.size
+
+        for i, seg in enumerate(segments):
+            if not seg.words:
+                continue
+            # visible until the next segment starts or this one ends
+            seg_end = seg.end + timeline.safety_pad
+            if i + 1 < len(segments):
+                seg_end = min(seg_end, segments[i + 1].start)
+            # the first word is highlighted from the start of the segment
+            word_starts = [seg.start] + [w.start for w in seg.words[1:]]
+            states = []
+            for hi in range(len(seg.words)):
+                start = max(word_starts[hi], seg.start)
+                end = min(
+                    word_starts[hi + 1] if hi + 1 < len(seg.words) else seg_end,
+                    seg_end,
+                )
+                if start < end:
+                    states.append((hi, start, end))
+            if not states:
+                continue
+
+            # images are rendered at full width at (0, y_pos), clipped to the frame
+            y0 = max(0, -compositor.y_pos)
+            images = []
+            for hi, _, _ in states:
+                rgba = compositor.image((i, hi))
+                images.append(
+                    rgba[y0 : max(y0, h - compositor.y_pos), : min(rgba.shape[1], w)]
+                )
+            alpha = np.zeros(images[0].shape[:2], dtype=bool)
+            for image in images:
+                alpha |= image[..., 3] > 0
+            rows = np.flatnonzero(alpha.any(axis=1))
+            if rows.size == 0:
+                continue
+            cols = np.flatnonzero(alpha.any(axis=0))
+            r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            crops = [image[r0:r1, c0:c1] for image in images]
+
+            add(
+                np.ascontiguousarray(crops[0]),
+                int(c0),
+                int(compositor.y_pos + y0 + r0),
+                True,
+            )
+            for prev, crop in zip(crops, crops[1:]):
+                x, y, dw, dh = _changed_box(prev, crop)
+                add(np.ascontiguousarray(crop[y : y + dh, x : x + dw]), x, y, False)
+            for _, start, end in states:
+                starts.append(start)
+                ends.append(end)
+
+        return cls(
+            w,
+            h,
+            np.array(starts, dtype=np.float64),
+            np.array(ends, dtype=np.float64),
+            np.array(patches, dtype=np.int64).reshape(-1, 6),
+            np.concatenate(pixels) if pixels else np.zeros(0, dtype=np.uint8),
+            key,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "CaptionTrack":
+        """
+        Read a track saved with `save`.
+
+        Args:
+            path (str): Path to the .npz file
+
+        Returns:
+            CaptionTrack: The track
+
+        Raises:
+            ValueError: If the file is of another version of the format
+        """
+        with np.load(path) as data:
+            if int(data["version"]) != TRACK_VERSION:
+                raise ValueError(f"Unsupported caption track version in {path}")
+            width, height = (int(v) for v in data["size"])
+            return cls(
+                width,
+                height,
+                data["starts"],
+                data["ends"],
+                data["patches"],
+                data["pixels"],
+                str(data["key"]),
+            )
+
+    def save(self, path: str) -> None:
+        """
+        Write the track as a compressed .npz file, atomically.
+
+        Args:
+            path (str): Path to the file, ending in .npz
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            version=TRACK_VERSION,
+            size=np.array([self.width, self.height]),
+            starts=self.starts,
+            ends=self.ends,
+            patches=self.patches,
+            pixels=self.pixels,
+            key=np.array(self.key),
+        )
+        os.replace(tmp_path, path)
+
+    def _image(self, i: int) -> np.ndarray:
+        offset, _, _, w, h, _ = self.patches[i]
+        return self.pixels[offset : offset + w * h * 4].reshape(h, w, 4)
+
+    def _apply(self, state: int) -> None:
+        """Bring the canvas to a state, from its keyframe if needed."""
+        keyframe = int(self._keyframe_of[state])
+        applied = self._applied
+        if applied is None or applied > state or self._keyframe_of[applied] != keyframe:
+            self._canvas = self._image(keyframe).copy()
+            applied = keyframe
+        for i in range(applied + 1, state + 1):
+            _, x, y, w, h, _ = self.patches[i]
+            self._canvas[y : y + h, x : x + w] = self._image(i)
+        self._applied = state
+
+    def sprite_at(self, t: float) -> Optional[CaptionSprite]:
+        """
+        Caption sprite visible at a time.
+
+        Args:
+            t (float): Time in seconds
+
+        Returns:
+            Optional[CaptionSprite]: The sprite, None if no caption is visible
+        """
+        state = bisect_right(self._starts, t) - 1
+        if state < 0 or t >= self.ends[state]:
+            state = None
+        if state == self._state:
+            return self._sprite
+
+        self._state = state
+        self._sprite = None
+        if state is not None:
+            self._apply(state)
+            _, x, y, _, _, _ = self.patches[int(self._keyframe_of[state])]
+            self._sprite = CaptionSprite.from_rgba(
+                self._canvas, int(x), int(y), self.width, self.height
+            )
+        return self._sprite
+
+    def blend_into(self, frame: np.ndarray, sprite: CaptionSprite) -> None:
+        """
+        Blend a sprite of the track into a frame in place.
+
+        Args:
+            frame (np.ndarray): Writable (h, w, 3) uint8 frame
+            sprite (CaptionSprite): The sprite to blend
+        """
+        blend_sprite(frame, sprite, self._scratch)
+
+
+def track_key(
+    alignment_obj,
+    width: int,
+    height: int,
+    fps: float,
+    font_path: str,
+    caption_options: dict,
+) -> str:
+    """
+    Hash of everything a caption track depends on.
+
+    Args:
+        alignment_obj: Alignment object containing character-level alignment data
+        width (int): Width of the frames
+        height (int): Height of the frames
+        fps (float): Frame rate of the background
+        font_path (str): Path to the font file for rendering subtitles
+        caption_options (dict): Segmentation and layout options
+
+    Returns:
+        str: Hex SHA-256 digest
+    """
+    stat = os.stat(font_path)
+    payload = json.dumps(
+        [
+            TRACK_VERSION,
+            list(alignment_obj.characters),
+            list(alignment_obj.character_start_times_seconds),
+            list(alignment_obj.character_end_times_seconds),
+            [width, height, fps],
+            [os.path.abspath(font_path), stat.st_size, stat.st_mtime_ns],
+            caption_options,
+        ],
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def render_caption_track(
+    alignment_obj,
+    track_path: str,
+    width: int,
+    height: int,
+    font_path: str,
+    fps: float = 30.0,
+    max_segment_chars: int = 60,
+    max_segment_duration: float = 2.8,
+    max_chars_per_line: int = 20,
+    y_pos_ratio: float = 0.5,
+    font_size_ratio: float = 0.06,
+    cache: ImageCache | None = None,
+) -> CaptionTrack:
+    """
+    Render the caption layer of a video once, for any background of its size.
+
+    A track already at `track_path` that was rendered from the same inputs
+    is loaded instead.
+
+    Args:
+        alignment_obj: Alignment object containing character-level alignment data
+        track_path (str): Path to save the track, ending in .npz
+        width (int): Width of the backgrounds
+        height (int): Height of the backgrounds
+        font_path (str): Path to the font file for rendering subtitles
+        fps (float): Frame rate of the backgrounds, for the caption timing
+        max_segment_chars (int): Maximum characters per segment
+        max_segment_duration (float): Maximum duration of each segment in seconds
+        max_chars_per_line (int): Maximum characters per line
+        y_pos_ratio (float): Vertical position ratio for subtitles
+        font_size_ratio (float): Font size ratio relative to video height
+        cache (ImageCache | None): Cache for rendered caption images
+
+    Returns:
+        CaptionTrack: The track
+    """
+    options = dict(
+        max_segment_chars=max_segment_chars,
+        max_segment_duration=max_segment_duration,
+        max_chars_per_line=max_chars_per_line,
+        y_pos_ratio=y_pos_ratio,
+        font_size_ratio=font_size_ratio,
+    )
+    key = track_key(alignment_obj, width, height, fps, font_path, options)
+    if os.path.exists(track_path):
+        try:
+            track = CaptionTrack.load(track_path)
+            if track.key == key:
+                get_metrics().count("caption_track_hits")
+                return track
+        except (OSError, ValueError, KeyError):
+            pass  # unreadable or of another version, rendered again
+
+    cache = cache if cache is not None else ImageCache()
+    cache_stats = replace(cache.stats)
+    with get_metrics().span("caption_track", width=width, height=height):
+        two_lines = alignment_to_two_lines(
+            alignment_obj, max_segment_chars, max_segment_duration, max_chars_per_line
+        )
+        profile = OutputProfile(
+            width=width,
+            height=height,
+            y_pos_ratio=y_pos_ratio,
+            font_size_ratio=font_size_ratio,
+        )
+        track = CaptionTrack.from_compositor(
+            caption_compositor(two_lines, profile, fps, font_path, cache), key
+        )
+        track.save(track_path)
+    report_cache_stats(cache, cache_stats)
+    return track
+
+
+def render_caption_overlay(
+    video_path: str, audio_path: str, track_path: str, output_path: str
+):
+    """
+    Composite a caption track onto a background and mux the narration.
+
+    The background is looped or trimmed to the narration, the track is
+    blended into its frames in place and the result is encoded, see
+    `composite_pipe`. Nothing about the captions is computed again, so
+    swapping the background of a video costs one decode and encode.
+
+    Args:
+        video_path (str): Path to the background video file
+        audio_path (str): Path to the narration audio file
+        track_path (str): Path to a track from `render_caption_track`
+        output_path (str): Path to save the output video file
+
+    Raises:
+        ValueError: If the background is not of the size of the track
+        RuntimeError: If the decoder or the encoder fails
+    """
+    track = CaptionTrack.load(track_path)
+    video_info = probe(video_path)
+    size = tuple(video_info["video_size"])
+    if size != (track.width, track.height):
+        raise ValueError(
+            f"The caption track is laid out for {track.width}x{track.height}, "
+            f"the background is {size[0]}x{size[1]}"
+        )
+    composite_pipe(
+        video_path,
+        audio_path,
+        output_path,
+        track,
+        size,
+        int(round(float(video_info.get("video_fps") or 30.0))),
+        probe(audio_path)["duration"],
+        renderer="overlay",
+    )
+
+
+def caption_track_path(audio_path: str) -> str:
+    """
+    Path of the caption track kept next to a narration.
+
+    Args:
+        audio_path (str): Path to the narration audio file
+
+    Returns:
+        str: Path to the track
+    """
+    return os.path.splitext(audio_path)[0] + ".captions.npz"
+
+
+def render_karaoke_video_overlay(
+    video_path: str,
+    audio_path: str,
+    alignment_obj,
+    output_path: str,
+    font_path: str,
+    max_segment_chars: int = 60,
+    max_segment_duration: float = 2.8,
+    max_chars_per_line: int = 20,
+    y_pos_ratio: float = 0.5,
+    font_size_ratio: float = 0.06,
+    cache: ImageCache | None = None,
+):
+    """
+    Render the final video from a caption track stored next to the narration.
+
+    The track is rendered on the first call for a narration, caption options
+    and background size, and reused by every later call, so rendering the
+    same narration on other backgrounds of that size only composites and
+    encodes. The frames are the same as with the "moviepy" backend.
+
+    Args:
+        video_path (str): Path to the background video file
+        audio_path (str): Path to the narration audio file, its directory
+            must be writable
+        alignment_obj: Alignment object containing character-level alignment data
+        output_path (str): Path to save the output video file
+        font_path (str): Path to the font file for rendering subtitles
+        max_segment_chars (int): Maximum characters per segment
+        max_segment_duration (float): Maximum duration of each segment in seconds
+        max_chars_per_line (int): Maximum characters per line
+        y_pos_ratio (float): Vertical position ratio for subtitles
+        font_size_ratio (float): Font size ratio relative to video height
+        cache (ImageCache | None): Cache for rendered caption images
+
+    Raises:
+        RuntimeError: If the decoder or the encoder fails
+    """
+    video_info = probe(video_path)
+    width, height = video_info["video_size"]
+    track_path = caption_track_path(audio_path)
+    render_caption_track(
+        alignment_obj,
+        track_path,
+        width,
+        height,
+        font_path,
+        fps=float(video_info.get("video_fps") or 30.0),
+        max_segment_chars=max_segment_chars,
+        max_segment_duration=max_segment_duration,
+        max_chars_per_line=max_chars_per_line,
+        y_pos_ratio=y_pos_ratio,
+        font_size_ratio=font_size_ratio,
+        cache=cache,
+    )
+    render_caption_overlay(video_path, audio_path, track_path, output_path)
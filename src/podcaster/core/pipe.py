@@ -0,0 +1,272 @@
+import queue
+import threading
+from dataclasses import replace
+from typing import Optional, Tuple
+
+import numpy as np
+
+from core.ffmpeg import FFmpegProcess, probe
+from core.formats import OutputProfile, caption_compositor
+from core.karaoke import ImageCache, alignment_to_two_lines, report_cache_stats
+from core.metrics import get_metrics
+
+# decoded frames in flight between the decoder and the encoder
+RING_FRAMES = 4
+
+
+def _read_frame(stdout, view: memoryview) -> bool:
+    """
+    Fill a frame buffer from a pipe.
+
+    Args:
+        stdout: Binary pipe of raw frames
+        view (memoryview): Byte view of the buffer
+
+    Returns:
+        bool: False if the pipe ended before the frame was complete
+    """
+    got = stdout.readinto(view)
+    while got and got < len(view):
+        n = stdout.readinto(view[got:])
+        if not n:
+            return False
+        got += n
+    return got == len(view)
+
+
+class FrameRing:
+    """
+    Fixed set of frame buffers passed between a decoder and a consumer.
+
+    The decoder thread reads every frame into a free buffer of the ring and
+    hands over its index; the consumer returns the index once the frame is
+    written. No frame is allocated after the ring is created, and at most
+    `size` frames are decoded ahead of the consumer.
+    """
+
+    def __init__(self, stdout, width: int, height: int, size: int = RING_FRAMES):
+        """
+        Allocate the buffers and start reading frames.
+
+        Args:
+            stdout: Binary pipe of rgb24 frames of the decoder
+            width (int): Width of the frames
+            height (int): Height of the frames
+            size (int): Number of buffers
+        """
+        self.frames = np.empty((size, height, width, 3), dtype=np.uint8)
+        self._views = [memoryview(frame).cast("B") for frame in self.frames]
+        self._stdout = stdout
+        self._free: queue.Queue = queue.Queue()
+        self._filled: queue.Queue = queue.Queue()
+        for i in range(size):
+            self._free.put(i)
+        self.error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                i = self._free.get()
+                if i is None or not _read_frame(self._stdout, self._views[i]):
+                    break
+                self._filled.put(i)
+        except BaseException as e:  # reported by the consumer
+            self.error = e
+        finally:
+            self._filled.put(None)
+
+    def get(self) -> Optional[int]:
+        """
+        Wait for the next decoded frame.
+
+        Returns:
+            Optional[int]: Index of its buffer in `frames`, None at the end
+        """
+        i = self._filled.get()
+        if i is None and self.error is not None:
+            raise self.error
+        return i
+
+    def view(self, i: int) -> memoryview:
+        """Byte view of a buffer, to write it without a copy."""
+        return self._views[i]
+
+    def release(self, i: int) -> None:
+        """Hand a buffer back to the decoder."""
+        self._free.put(i)
+
+    def close(self) -> None:
+        """Stop reading, once the decoder's stdout is closed or at its end."""
+        self._free.put(None)
+        self._thread.join()
+
+
+def render_karaoke_video_pipe(
+    video_path: str,
+    audio_path: str,
+    alignment_obj,
+    output_path: str,
+    font_path: str,
+    max_segment_chars: int = 60,
+    max_segment_duration: float = 2.8,
+    max_chars_per_line: int = 20,
+    y_pos_ratio: float = 0.5,
+    font_size_ratio: float = 0.06,
+    cache: ImageCache | None = None,
+    ring_frames: int = RING_FRAMES,
+):
+    """
+    Render the final video with raw frames piped between two ffmpeg processes.
+
+    One ffmpeg loops or trims the background and decodes it to raw frames at
+    a constant frame rate, which are read into a small ring of preallocated
+    buffers. Captions are blended into each buffer in place and the buffer
+    is written as is to the stdin of a second ffmpeg, which encodes it and
+    muxes the narration. Unlike the moviepy backend, no array is allocated
+    per frame and no clip layers run per frame; decoding, blending and
+    encoding overlap.
+
+    The captions are the same as with the "moviepy" backend.
+
+    Args:
+        video_path (str): Path to the background video file
+        audio_path (str): Path to the narration audio file
+        alignment_obj: Alignment object containing character-level alignment data
+        output_path (str): Path to save the output video file
+        font_path (str): Path to the font file for rendering subtitles
+        max_segment_chars (int): Maximum characters per segment
+        max_segment_duration (float): Maximum duration of each segment in seconds
+        max_chars_per_line (int): Maximum characters per line
+        y_pos_ratio (float): Vertical position ratio for subtitles
+        font_size_ratio (float): Font size ratio relative to video height
+        cache (ImageCache | None): Cache for rendered caption images
+        ring_frames (int): Number of frame buffers between decoder and encoder
+
+    Raises:
+        RuntimeError: If the decoder or the encoder fails
+    """
+    cache = cache if cache is not None else ImageCache()
+    cache_stats = replace(cache.stats)
+
+    video_info = probe(video_path)
+    duration = probe(audio_path)["duration"]
+    w, h = video_info["video_size"]
+    source_fps = float(video_info.get("video_fps") or 30.0)
+    fps = int(round(source_fps))
+
+    two_lines = alignment_to_two_lines(
+        alignment_obj, max_segment_chars, max_segment_duration, max_chars_per_line
+    )
+    compositor = None
+    if two_lines:
+        profile = OutputProfile(
+            width=w, height=h, y_pos_ratio=y_pos_ratio, font_size_ratio=font_size_ratio
+        )
+        compositor = caption_compositor(
+            two_lines, profile, source_fps, font_path, cache
+        )
+
+    composite_pipe(
+        video_path,
+        audio_path,
+        output_path,
+        compositor,
+        (w, h),
+        fps,
+        duration,
+        ring_frames=ring_frames,
+    )
+    report_cache_stats(cache, cache_stats)
+
+
+def composite_pipe(
+    video_path: str,
+    audio_path: str,
+    output_path: str,
+    compositor,
+    size: Tuple[int, int],
+    fps: int,
+    duration: float,
+    renderer: str = "pipe",
+    ring_frames: int = RING_FRAMES,
+):
+    """
+    Blend captions into a background piped from an ffmpeg decoder to an encoder.
+
+    The background is looped or trimmed to `duration` and decoded at `fps`
+    into a `FrameRing`; the caption visible at each frame's time is blended
+    into its buffer in place, which is then written to the encoder muxing the
+    narration.
+
+    Args:
+        video_path (str): Path to the background video file
+        audio_path (str): Path to the narration audio file
+        output_path (str): Path to save the output video file
+        compositor: Caption source with `sprite_at(t)` and `blend_into(frame,
+            sprite)`, such as a `KaraokeCompositor`, None for no captions
+        size (Tuple[int, int]): Width and height of the background
+        fps (int): Frame rate of the output
+        duration (float): Duration of the output in seconds
+        renderer (str): Name of the renderer in the metrics
+        ring_frames (int): Number of frame buffers between decoder and encoder
+
+    Raises:
+        RuntimeError: If the decoder or the encoder fails
+    """
+    metrics = get_metrics()
+    w, h = size
+    decoder = FFmpegProcess(
+        [
+            "-stream_loop", "-1", "-i", video_path,
+            "-map", "0:v:0",
+            "-t", f"{duration:.3f}",
+            "-r", str(fps),
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-",
+        ],
+        stdout=True,
+    )  # fmt: skip
+    encoder = FFmpegProcess(
+        [
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}",
+            "-r", str(fps), "-i", "-",
+            "-i", audio_path,
+            "-map", "0:v:0", "-map", "1:a:0",
+            "-t", f"{duration:.3f}",
+            "-c:v", "libx264", "-pix_fmt", "yuv420p",
+            "-c:a", "aac",
+            output_path,
+        ],
+        stdin=True,
+    )  # fmt: skip
+    ring = FrameRing(decoder.stdout, w, h, ring_frames)
+    frames = 0
+    try:
+        with metrics.span("encode", renderer=renderer):
+            while True:
+                i = ring.get()
+                if i is None:
+                    break
+                if compositor is not None:
+                    sprite = compositor.sprite_at(frames / fps)
+                    if sprite is not None:
+                        compositor.blend_into(ring.frames[i], sprite)
+                encoder.stdin.write(ring.view(i))
+                ring.release(i)
+                frames += 1
+    except BrokenPipeError:
+        # the encoder exited, its own error says why
+        decoder.kill()
+        ring.close()
+        encoder.close()
+        raise
+    except BaseException:
+        decoder.kill()
+        ring.close()
+        encoder.kill()
+        raise
+    ring.close()
+    decoder.close()
+    encoder.close()
+    metrics.count("frames_rendered", frames)
@@ -0,0 +1,479 @@
+import multiprocessing
+import os
+import tempfile
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from typing import List, Tuple
+
+from core.ffmpeg import escape_filter_value, probe, run_ffmpeg, write_concat_list
+from core.karaoke import (
+    CacheStats,
+    ImageCache,
+    add_karaoke,
+    alignment_to_two_lines,
+    report_cache_stats,
+)
+from core.metrics import get_metrics
+from core.subtitles import write_ass_subtitles
+from core.video import fit_clip_to_duration
+
+
+def render_karaoke_video(
+    video_path: str,
+    audio_path: str,
+    alignment_obj,
+    output_path: str,
+    font_path: str,
+    max_segment_chars: int = 60,
+    max_segment_duration: float = 2.8,
+    max_chars_per_line: int = 20,
+    y_pos_ratio: float = 0.5,
+    font_size_ratio: float = 0.06,
+    cache: ImageCache | None = None,
+    backend: str = "moviepy",
+    shards: int = 1,
+    cores: int | None = None,
+):
+    """
+    Render the final video in a single decode -> composite -> encode pass.
+
+    Fits the background to the narration (trim or loop), overlays the karaoke
+    subtitles and muxes the narration audio, so the background is decoded and
+    encoded only once instead of going through `fit_video_to_audio` and then
+    `burn_karaoke_moviepy`.
+
+    The "moviepy" backend rasterizes captions with PIL and is the reference.
+    The "ass" backend exports the captions as ASS subtitles and burns them in
+    with ffmpeg's libass filter, so no Python code runs per frame.
+    The "pipe" backend draws the same captions as "moviepy" into raw frames
+    piped from an ffmpeg decoder to an ffmpeg encoder, see
+    `render_karaoke_video_pipe`. The "overlay" backend does the same with
+    captions rendered once into a track stored next to the narration and
+    reused for other backgrounds, see `render_karaoke_video_overlay`.
+
+    With more than one shard the "moviepy" backend splits the timeline and
+    renders the pieces in parallel processes, see `render_karaoke_video_sharded`.
+    There are at most as many shards as `cores`, which the shards' encoders
+    share, so a render running next to others in a pool only uses its part
+    of the machine.
+
+    Args:
+        video_path (str): Path to the background video file
+        audio_path (str): Path to the narration audio file
+        alignment_obj: Alignment object containing character-level alignment data
+        output_path (str): Path to save the output video file
+        font_path (str): Path to the font file for rendering subtitles
+        max_segment_chars (int): Maximum characters per segment
+        max_segment_duration (float): Maximum duration of each segment in seconds
+        max_chars_per_line (int): Maximum characters per line
+        y_pos_ratio (float): Vertical position ratio for subtitles
+        font_size_ratio (float): Font size ratio relative to video height
+        cache (ImageCache | None): Cache for rendered caption images
+        backend (str): "moviepy", "ass", "pipe" or "overlay"
+        shards (int): Number of parallel render processes for the "moviepy" backend
+        cores (int | None): CPU cores available to this render, all of the
+            machine's if None
+
+    Example:
+        render_karaoke_video(
+            video_path="background.mp4",
+            audio_path="speech.mp3",
+            alignment_obj=audio.normalized_alignment,
+            output_path="video_karaoke.mp4",
+            font_path="/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+        )
+    """
+    cores = cores or os.cpu_count() or 1
+    shards = max(1, min(shards, cores))
+    metrics = get_metrics()
+    with metrics.span("render", backend=backend, shards=shards):
+        _render_karaoke_video(
+            video_path,
+            audio_path,
+            alignment_obj,
+            output_path,
+            font_path,
+            max_segment_chars=max_segment_chars,
+            max_segment_duration=max_segment_duration,
+            max_chars_per_line=max_chars_per_line,
+            y_pos_ratio=y_pos_ratio,
+            font_size_ratio=font_size_ratio,
+            cache=cache,
+            backend=backend,
+            shards=shards,
+            cores=cores,
+        )
+    metrics.flush()
+
+
+def _render_karaoke_video(
+    video_path: str,
+    audio_path: str,
+    alignment_obj,
+    output_path: str,
+    font_path: str,
+    max_segment_chars: int,
+    max_segment_duration: float,
+    max_chars_per_line: int,
+    y_pos_ratio: float,
+    font_size_ratio: float,
+    cache: ImageCache | None,
+    backend: str,
+    shards: int,
+    cores: int,
+):
+    """Dispatch of `render_karaoke_video` to the backends."""
+    if backend == "ass":
+        render_karaoke_video_ass(
+            video_path,
+            audio_path,
+            alignment_obj,
+            output_path,
+            font_path,
+            max_segment_chars=max_segment_chars,
+            max_segment_duration=max_segment_duration,
+            max_chars_per_line=max_chars_per_line,
+            y_pos_ratio=y_pos_ratio,
+            font_size_ratio=font_size_ratio,
+        )
+        return
+    if backend == "pipe":
+        from core.pipe import render_karaoke_video_pipe
+
+        render_karaoke_video_pipe(
+            video_path,
+            audio_path,
+            alignment_obj,
+            output_path,
+            font_path,
+            max_segment_chars=max_segment_chars,
+            max_segment_duration=max_segment_duration,
+            max_chars_per_line=max_chars_per_line,
+            y_pos_ratio=y_pos_ratio,
+            font_size_ratio=font_size_ratio,
+            cache=cache,
+        )
+        return
+    if backend == "overlay":
+        from core.overlay import render_karaoke_video_overlay
+
+        render_karaoke_video_overlay(
+            video_path,
+            audio_path,
+            alignment_obj,
+            output_path,
+            font_path,
+            max_segment_chars=max_segment_chars,
+            max_segment_duration=max_segment_duration,
+            max_chars_per_line=max_chars_per_line,
+            y_pos_ratio=y_pos_ratio,
+            font_size_ratio=font_size_ratio,
+            cache=cache,
+        )
+        return
+    if backend != "moviepy":
+        raise ValueError(f"Unknown render backend: {backend}")
+    if shards > 1:
+        render_karaoke_video_sharded(
+            video_path,
+            audio_path,
+            alignment_obj,
+            output_path,
+            font_path,
+            shards=shards,
+            cores=cores,
+            max_segment_chars=max_segment_chars,
+            max_segment_duration=max_segment_duration,
+            max_chars_per_line=max_chars_per_line,
+            y_pos_ratio=y_pos_ratio,
+            font_size_ratio=font_size_ratio,
+        )
+        return
+
+    from moviepy import AudioFileClip, VideoFileClip
+
+    cache = cache if cache is not None else ImageCache()
+    cache_stats = replace(cache.stats)
+
+    video = VideoFileClip(video_path)
+    audio = AudioFileClip(audio_path)
+    fps = float(getattr(video, "fps", 30)) or 30.0
+
+    fitted = fit_clip_to_duration(video, audio.duration)
+    final = (
+        add_karaoke(
+            fitted,
+            alignment_obj,
+            font_path,
+            max_segment_chars=max_segment_chars,
+            max_segment_duration=max_segment_duration,
+            max_chars_per_line=max_chars_per_line,
+            y_pos_ratio=y_pos_ratio,
+            font_size_ratio=font_size_ratio,
+            cache=cache,
+        )
+        .with_duration(audio.duration)
+        .with_audio(audio)
+    )
+
+    with get_metrics().span("encode", renderer="moviepy"):
+        final.write_videofile(
+            output_path,
+            codec="libx264",
+            audio_codec="aac",
+            fps=int(round(fps)),
+        )
+    report_cache_stats(cache, cache_stats)
+
+    video.close()
+    audio.close()
+    final.close()
+
+
+def render_karaoke_video_ass(
+    video_path: str,
+    audio_path: str,
+    alignment_obj,
+    output_path: str,
+    font_path: str,
+    max_segment_chars: int = 60,
+    max_segment_duration: float = 2.8,
+    max_chars_per_line: int = 20,
+    y_pos_ratio: float = 0.5,
+    font_size_ratio: float = 0.06,
+):
+    """
+    Render the final video with ffmpeg, burning in karaoke subtitles with libass.
+
+    The subtitles are written next to the output as an .ass file, then ffmpeg
+    loops or trims the background, draws the subtitles and muxes the narration
+    in a single encode.
+
+    Args:
+        video_path (str): Path to the background video file
+        audio_path (str): Path to the narration audio file
+        alignment_obj: Alignment object containing character-level alignment data
+        output_path (str): Path to save the output video file
+        font_path (str): Path to the font file for rendering subtitles
+        max_segment_chars (int): Maximum characters per segment
+        max_segment_duration (float): Maximum duration of each segment in seconds
+        max_chars_per_line (int): Maximum characters per line
+        y_pos_ratio (float): Vertical position ratio for subtitles
+        font_size_ratio (float): Font size ratio relative to video height
+    """
+    video_info = probe(video_path)
+    audio_duration = probe(audio_path)["duration"]
+    video_w, video_h = video_info["video_size"]
+    fps = float(video_info.get("video_fps") or 30.0)
+
+    metrics = get_metrics()
+    ass_path = os.path.splitext(output_path)[0] + ".ass"
+    with metrics.span("ass_export"):
+        write_ass_subtitles(
+            alignment_obj,
+            ass_path,
+            video_w=video_w,
+            video_h=video_h,
+            fps=fps,
+            font_path=font_path,
+            max_segment_chars=max_segment_chars,
+            max_segment_duration=max_segment_duration,
+            max_chars_per_line=max_chars_per_line,
+            y_pos_ratio=y_pos_ratio,
+            font_size_ratio=font_size_ratio,
+        )
+
+    subtitles = (
+        f"subtitles=filename={escape_filter_value(ass_path)}"
+        f":fontsdir={escape_filter_value(os.path.dirname(os.path.abspath(font_path)))}"
+    )
+    with metrics.span("encode", renderer="ass"):
+        run_ffmpeg(
+            [
+                "-stream_loop", "-1", "-i", video_path,
+                "-i", audio_path,
+                "-map", "0:v:0", "-map", "1:a:0",
+                "-vf", subtitles,
+                "-t", f"{audio_duration:.3f}",
+                "-r", str(int(round(fps))),
+                "-c:v", "libx264", "-pix_fmt", "yuv420p",
+                "-c:a", "aac",
+                output_path,
+            ]
+        )  # fmt: skip
+
+
+def plan_shards(
+    segment_starts: List[float], total_frames: int, fps: int, shards: int
+) -> List[Tuple[int, int]]:
+    """
+    Split a timeline of frames into shards of similar length.
+
+    Each cut is moved to the segment start closest to the even split, so a
+    caption is rendered by a single shard whenever possible.
+
+    Args:
+        segment_starts (List[float]): Sorted start times of the caption segments
+        total_frames (int): Number of frames of the video
+        fps (int): Frames per second
+        shards (int): Desired number of shards
+
+    Returns:
+        List[Tuple[int, int]]: First and end (exclusive) frame of each shard
+    """
+    start_frames = sorted({int(round(t * fps)) for t in segment_starts})
+    cuts = [0]
+    for i in range(1, shards):
+        ideal = total_frames * i // shards
+        j = bisect_left(start_frames, ideal)
+        candidates = start_frames[max(j - 1, 0) : j + 1] or [ideal]
+        cut = min(candidates, key=lambda f: abs(f - ideal))
+        if cuts[-1] < cut < total_frames:
+            cuts.append(cut)
+    cuts.append(total_frames)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def _render_shard(
+    video_path: str,
+    alignment_obj,
+    shard_path: str,
+    first_frame: int,
+    end_frame: int,
+    fps: int,
+    duration: float,
+    font_path: str,
+    threads: int,
+    caption_kwargs: dict,
+):
+    """
+    Render frames [first_frame, end_frame) of the karaoke video without audio.
+
+    Runs in a worker process of `render_karaoke_video_sharded`.
+    """
+    from moviepy import VideoFileClip
+
+    metrics = get_metrics()
+    cache = ImageCache()
+    video = VideoFileClip(video_path, audio=False)
+    fitted = fit_clip_to_duration(video, duration)
+    # the half frame keeps int(duration * fps) from dropping the last frame
+    shard = (
+        add_karaoke(fitted, alignment_obj, font_path, cache=cache, **caption_kwargs)
+        .subclipped(first_frame / fps)
+        .with_duration((end_frame - first_frame + 0.5) / fps)
+    )
+    with metrics.span("encode", renderer="shard", first_frame=first_frame):
+        shard.write_videofile(
+            shard_path,
+            codec="libx264",
+            audio=False,
+            fps=fps,
+            threads=threads,
+            logger=None,
+        )
+    video.close()
+    shard.close()
+    report_cache_stats(cache, CacheStats())
+    metrics.flush()
+
+
+def render_karaoke_video_sharded(
+    video_path: str,
+    audio_path: str,
+    alignment_obj,
+    output_path: str,
+    font_path: str,
+    shards: int,
+    max_segment_chars: int = 60,
+    max_segment_duration: float = 2.8,
+    max_chars_per_line: int = 20,
+    y_pos_ratio: float = 0.5,
+    font_size_ratio: float = 0.06,
+    cores: int | None = None,
+):
+    """
+    Render the final video in time shards on several CPU cores.
+
+    The timeline is cut at caption segment boundaries, every shard (background
+    slice with karaoke overlay) is encoded by its own process, then the shards
+    are joined with the concat demuxer without re-encoding and the narration
+    is muxed once.
+
+    Args:
+        video_path (str): Path to the background video file
+        audio_path (str): Path to the narration audio file
+        alignment_obj: Alignment object containing character-level alignment data
+        output_path (str): Path to save the output video file
+        font_path (str): Path to the font file for rendering subtitles
+        shards (int): Number of shards rendered in parallel
+        max_segment_chars (int): Maximum characters per segment
+        max_segment_duration (float): Maximum duration of each segment in seconds
+        max_chars_per_line (int): Maximum characters per line
+        y_pos_ratio (float): Vertical position ratio for subtitles
+        font_size_ratio (float): Font size ratio relative to video height
+        cores (int | None): CPU cores shared by the shards' encoders, all of
+            the machine's if None
+    """
+    video_info = probe(video_path)
+    duration = probe(audio_path)["duration"]
+    fps = int(round(float(video_info.get("video_fps") or 30.0)))
+
+    caption_kwargs = dict(
+        max_segment_chars=max_segment_chars,
+        max_segment_duration=max_segment_duration,
+        max_chars_per_line=max_chars_per_line,
+        y_pos_ratio=y_pos_ratio,
+        font_size_ratio=font_size_ratio,
+    )
+    two_lines = alignment_to_two_lines(
+        alignment_obj, max_segment_chars, max_segment_duration, max_chars_per_line
+    )
+    plan = plan_shards(
+        [seg.start for seg in two_lines], int(duration * fps), fps, shards
+    )
+    threads = max(1, (cores or os.cpu_count() or 1) // len(plan))
+
+    with tempfile.TemporaryDirectory(
+        dir=os.path.dirname(os.path.abspath(output_path))
+    ) as tmp_dir:
+        shard_paths = [
+            os.path.join(tmp_dir, f"shard_{i:04d}.mp4") for i in range(len(plan))
+        ]
+        with ProcessPoolExecutor(
+            max_workers=len(plan), mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            futures = [
+                pool.submit(
+                    _render_shard,
+                    video_path,
+                    alignment_obj,
+                    shard_path,
+                    first_frame,
+                    end_frame,
+                    fps,
+                    duration,
+                    font_path,
+                    threads,
+                    caption_kwargs,
+                )
+                for shard_path, (first_frame, end_frame) in zip(shard_paths, plan)
+            ]
+            for future in futures:
+                future.result()
+
+        list_path = os.path.join(tmp_dir, "shards.txt")
+        write_concat_list(shard_paths, list_path)
+        with get_metrics().span("join", shards=len(plan)):
+            run_ffmpeg(
+                [
+                    "-f", "concat", "-safe", "0", "-i", list_path,
+                    "-i", audio_path,
+                    "-map", "0:v:0", "-map", "1:a:0",
+                    "-t", f"{duration:.3f}",
+                    "-c:v", "copy",
+                    "-c:a", "aac",
+                    output_path,
+                ]
+            )  # fmt: skip
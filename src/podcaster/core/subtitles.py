@@ -0,0 +1,218 @@
+from typing import List, Tuple
+
+from core.karaoke import (
+    HIGHLIGHT_COLOR,
+    STROKE_COLOR,
+    TEXT_COLOR,
+    TwoLineSegment,
+    alignment_to_two_lines,
+    layout_two_lines,
+    load_font,
+)
+
+
+def _ass_time(t: float) -> str:
+    """Function to format seconds as an ASS timestamp (H:MM:SS.cc).
+    Args:
+        t (float): Time in seconds.
+    Returns:
+        str: The formatted timestamp.
+    """
+    cs = max(0, int(round(t * 100)))
+    h, cs = divmod(cs, 360000)
+    m, cs = divmod(cs, 6000)
+    s, cs = divmod(cs, 100)
+    return f"{h}:{m:02d}:{s:02d}.{cs:02d}"
+
+
+def _ass_color(rgba: Tuple[int, int, int, int]) -> str:
+    """Function to convert an RGBA colour to ASS &HAABBGGRR notation.
+    Args:
+        rgba (Tuple[int, int, int, int]): The colour.
+    Returns:
+        str: The colour in ASS notation (alpha 00 is opaque).
+    """
+    r, g, b, a = rgba
+    return f"&H{255 - a:02X}{b:02X}{g:02X}{r:02X}"
+
+
+def _ass_escape(text: str) -> str:
+    """Function to escape override and line break characters in text.
+    Args:
+        text (str): The raw text.
+    Returns:
+        str: Text safe to use in a Dialogue line.
+    """
+    # a zero-width space after the backslash stops \N, \h and \n sequences
+    return text.replace("\\", "\\\u200b").replace("{", "\\{").replace("}", "\\}")
+
+
+def _highlight_events(
+    seg: TwoLineSegment, visible_until: float
+) -> List[Tuple[float, float, int]]:
+    """Function to split a segment into intervals of constant highlight.
+
+    Follows `KaraokeTimeline.locate`: the highlighted word is the last one
+    that already started, or the first word before any started.
+    Args:
+        seg (TwoLineSegment): The segment.
+        visible_until (float): Time at which the segment disappears.
+    Returns:
+        List[Tuple[float, float, int]]: Start, end and highlighted word index.
+    """
+    events = []
+    n = len(seg.words)
+    for i, w in enumerate(seg.words):
+        start = seg.start if i == 0 else max(seg.start, w.start)
+        end = seg.words[i + 1].start if i + 1 < n else visible_until
+        end = min(end, visible_until)
+        if end > start:
+            events.append((start, end, i))
+    return events
+
+
+def segments_to_ass(
+    two_lines: List[TwoLineSegment],
+    video_w: int,
+    video_h: int,
+    y_pos: int,
+    font_path: str,
+    font_size: int,
+    safety_pad: float = 0.0,
+    padding: int = 18,
+    line_gap: int = 10,
+    stroke: int = 4,
+    min_font_size: int = 12,
+) -> str:
+    """Function to export two-line karaoke segments as an ASS subtitle script.
+
+    Uses the same layout as `render_two_line_image`: each line is its own
+    top-centre anchored event at the line's y position, with the auto-fitted
+    font size, the stroke as outline and the current word in yellow.
+    Args:
+        two_lines (List[TwoLineSegment]): Segments sorted by start time.
+        video_w (int): Width of the video.
+        video_h (int): Height of the video.
+        y_pos (int): Vertical position of the subtitles.
+        font_path (str): Path to the font file.
+        font_size (int): Initial font size.
+        safety_pad (float): Extra time a segment stays visible after its end.
+        padding (int): Padding around the text.
+        line_gap (int): Gap between the two lines.
+        stroke (int): Stroke width for text outline.
+        min_font_size (int): Minimum font size to use.
+    Returns:
+        str: The ASS script.
+    """
+    family, style = load_font(font_path, font_size).getname()
+    bold = -1 if "bold" in (style or "").lower() else 0
+    text_color = _ass_color(TEXT_COLOR)
+    highlight_color = _ass_color(HIGHLIGHT_COLOR)
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {video_w}",
+        f"PlayResY: {video_h}",
+        "ScaledBorderAndShadow: yes",
+        "WrapStyle: 2",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, "
+        "OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, "
+        "ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, "
+        "MarginL, MarginR, MarginV, Encoding",
+        f"Style: Karaoke,{family},{font_size},{text_color},{highlight_color},"
+        f"{_ass_color(STROKE_COLOR)},&H00000000,{bold},0,0,0,100,100,0,0,1,"
+        f"{stroke},0,8,0,0,0,1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, "
+        "Effect, Text",
+    ]
+
+    for k, seg in enumerate(two_lines):
+        if not seg.words:
+            continue
+        texts = tuple(w.text for w in seg.words)
+        layout = layout_two_lines(
+            texts,
+            seg.cut_index,
+            video_w,
+            font_path,
+            font_size,
+            padding,
+            line_gap,
+            stroke,
+            min_font_size,
+        )
+        # libass sizes fonts by their line height, PIL by the em size
+        ascent, descent = load_font(font_path, layout.font_size).getmetrics()
+        ass_size = ascent + descent
+
+        visible_until = seg.end + safety_pad
+        if k + 1 < len(two_lines):
+            visible_until = min(visible_until, two_lines[k + 1].start)
+
+        line_ranges = [(0, seg.cut_index), (seg.cut_index, len(texts))]
+        for start, end, hi in _highlight_events(seg, visible_until):
+            for first, last in line_ranges:
+                if first >= last:
+                    continue
+                y = y_pos + layout.positions[first][1]
+                words = []
+                for i in range(first, last):
+                    word = _ass_escape(texts[i])
+                    if i == hi:
+                        word = f"{{\\c{highlight_color}}}{word}{{\\c{text_color}}}"
+                    words.append(word)
+                lines.append(
+                    f"Dialogue: 0,{_ass_time(start)},{_ass_time(end)},Karaoke,,0,0,0,,"
+                    f"{{\\an8\\pos({video_w // 2},{y})\\fs{ass_size}}}"
+                    + " ".join(words)
+                )
+
+    return "\n".join(lines) + "\n"
+
+
+def write_ass_subtitles(
+    alignment_obj,
+    output_path: str,
+    video_w: int,
+    video_h: int,
+    fps: float,
+    font_path: str,
+    max_segment_chars: int = 60,
+    max_segment_duration: float = 2.8,
+    max_chars_per_line: int = 20,
+    y_pos_ratio: float = 0.5,
+    font_size_ratio: float = 0.06,
+) -> None:
+    """Function to write karaoke subtitles for a video as an ASS file.
+    Args:
+        alignment_obj: Alignment object containing character-level alignment data.
+        output_path (str): Path to save the ASS file.
+        video_w (int): Width of the video.
+        video_h (int): Height of the video.
+        fps (float): Frames per second of the video.
+        font_path (str): Path to the font file for rendering subtitles.
+        max_segment_chars (int): Maximum characters per segment.
+        max_segment_duration (float): Maximum duration of each segment in seconds.
+        max_chars_per_line (int): Maximum characters per line.
+        y_pos_ratio (float): Vertical position ratio for subtitles.
+        font_size_ratio (float): Font size ratio relative to video height.
+    """
+    two_lines = alignment_to_two_lines(
+        alignment_obj, max_segment_chars, max_segment_duration, max_chars_per_line
+    )
+    script = segments_to_ass(
+        two_lines,
+        video_w=video_w,
+        video_h=video_h,
+        y_pos=int(video_h * y_pos_ratio),
+        font_path=font_path,
+        font_size=max(18, int(video_h * font_size_ratio)),
+        safety_pad=1.0 / fps,
+    )
+    with open(output_path, "w", encoding="utf-8") as file:
+        file.write(script)
@@ -1,32 +1,148 @@
-from moviepy import VideoFileClip, AudioFileClip
-from moviepy.video.fx.Loop import Loop
+import math
+import os
+import tempfile
 
+from core.ffmpeg import keyframe_times, probe, run_ffmpeg, write_concat_list
+from core.metrics import get_metrics
 
-def fit_video_to_audio(video_path: str, audio_path: str, out_path: str):
+# codecs that can be stream-copied into an MP4 container
+STREAM_COPY_CODECS = {"h264", "hevc", "av1", "vp9", "mpeg4"}
+
+
+def fit_clip_to_duration(video, duration: float):
+    """
+    Trim or loop a clip so that it lasts exactly the given duration.
+
+    Args:
+        video: The clip to fit
+        duration (float): Target duration in seconds
+
+    Returns:
+        The trimmed or looped clip
+    """
+    from moviepy.video.fx.Loop import Loop
+
+    if video.duration >= duration:
+        return video.subclipped(0, duration)
+    return video.with_effects([Loop(duration=duration)])
+
+
+def can_stream_copy(video_path: str, tolerance: float = 0.01) -> bool:
+    """
+    Check whether a video can be trimmed and looped without re-encoding.
+
+    The codec must fit in an MP4 container and the stream must open on a
+    keyframe, so that the trimmed clip and every loop iteration start with a
+    decodable frame.
+
+    Args:
+        video_path (str): Path to the video file
+        tolerance (float): Allowed offset of the first keyframe in seconds
+
+    Returns:
+        bool: True if stream copy is possible
+    """
+    info = probe(video_path)
+    if info.get("video_codec_name") not in STREAM_COPY_CODECS:
+        return False
+    keyframes = keyframe_times(video_path, max_count=1)
+    return bool(keyframes) and keyframes[0] - info.get("start", 0.0) <= tolerance
+
+
+def fit_video_to_audio_stream_copy(
+    video_path: str,
+    audio_path: str,
+    out_path: str,
+    start: float = 0.0,
+    video_duration: float | None = None,
+    audio_duration: float | None = None,
+):
+    """
+    Fit the video to the audio without re-encoding the video stream.
+
+    A longer video is cut after the audio duration, a shorter one is repeated
+    through the concat demuxer. Only the audio is encoded.
+
+    Args:
+        video_path (str): Path to the input video file
+        audio_path (str): Path to the input audio file
+        out_path (str): Path to save the output video file
+        start (float): Start time in the video, which must be a keyframe
+        video_duration (float | None): Duration of the video, probed if None
+        audio_duration (float | None): Duration of the audio, probed if None
+
+    Raises:
+        RuntimeError: If ffmpeg fails
+    """
+    if video_duration is None:
+        video_duration = probe(video_path)["duration"]
+    if audio_duration is None:
+        audio_duration = probe(audio_path)["duration"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if video_duration - start >= audio_duration:
+            seek = ["-ss", f"{start:.6f}"] if start > 0 else []
+            video_input = [*seek, "-i", video_path]
+        else:
+            list_path = os.path.join(tmp_dir, "loop.txt")
+            repeats = 1 + math.ceil(
+                (audio_duration - (video_duration - start)) / video_duration
+            )
+            write_concat_list([video_path] * repeats, list_path, inpoint=start)
+            video_input = ["-f", "concat", "-safe", "0", "-i", list_path]
+
+        run_ffmpeg(
+            [
+                *video_input,
+                "-i", audio_path,
+                "-map", "0:v:0", "-map", "1:a:0",
+                "-t", f"{audio_duration:.3f}",
+                "-c:v", "copy",
+                "-c:a", "aac",
+                out_path,
+            ]
+        )  # fmt: skip
+
+
+def fit_video_to_audio(
+    video_path: str, audio_path: str, out_path: str, stream_copy: bool = True
+):
     """
     Fit the video duration to match the audio duration by trimming or looping the video.
 
+    With `stream_copy` the video stream is copied as is when its codec and
+    keyframes allow it, which takes a fraction of a second. Otherwise, or if
+    copying fails, the video is re-encoded with libx264.
+
     Args:
         video_path (str): Path to the input video file
         audio_path (str): Path to the input audio file
         out_path (str): Path to save the output video file
+        stream_copy (bool): Try to avoid re-encoding the video
     """
-    video = VideoFileClip(video_path)
-    audio = AudioFileClip(audio_path)
+    metrics = get_metrics()
+    if stream_copy and can_stream_copy(video_path):
+        try:
+            with metrics.span("fit_video", mode="copy"):
+                fit_video_to_audio_stream_copy(video_path, audio_path, out_path)
+            return
+        except RuntimeError:
+            pass  # fall back to re-encoding
+
+    from moviepy import AudioFileClip, VideoFileClip
 
-    if video.duration >= audio.duration:
-        fitted = video.subclipped(0, audio.duration)
-    else:
-        fitted = video.with_effects([Loop(duration=audio.duration)])
+    with metrics.span("fit_video", mode="reencode"):
+        video = VideoFileClip(video_path)
+        audio = AudioFileClip(audio_path)
 
-    final = fitted.with_audio(audio)
+        final = fit_clip_to_duration(video, audio.duration).with_audio(audio)
 
-    final.write_videofile(
-        out_path,
-        codec="libx264",
-        audio_codec="aac",
-    )
+        final.write_videofile(
+            out_path,
+            codec="libx264",
+            audio_codec="aac",
+        )
 
-    video.close()
-    audio.close()
-    final.close()
+        video.close()
+        audio.close()
+        final.close()
@@ -0,0 +1,217 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Tuple
+
+from core import metrics
+from providers.cache import content_key
+
+MANIFEST = "manifest.json"
+
+
+@dataclass(frozen=True)
+class Artifact:
+    """Output directory of a completed stage, named by the stage's key."""
+
+    stage: str
+    key: str
+    path: str
+    reused: bool = False
+
+    def file(self, name: str) -> str:
+        """Path of a file of the artifact.
+        Args:
+            name (str): File name.
+        Returns:
+            str: The path."""
+        return os.path.join(self.path, name)
+
+
+StageRun = Callable[[Dict[str, Artifact], str], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class Stage:
+    """Step of a pipeline graph.
+
+    `run` gets the artifacts of the `inputs` stages and a directory to write
+    its files to. Everything the output depends on besides these inputs must
+    be in `params`, which are hashed into the artifact key; `version` is bumped
+    when the stage's code changes its output.
+    """
+
+    name: str
+    run: StageRun
+    inputs: Tuple[str, ...] = ()
+    params: Dict[str, object] = field(default_factory=dict)
+    version: int = 1
+
+
+class ArtifactStore:
+    """Directory of stage outputs keyed by the hash of their inputs.
+
+    A stage writes into a private temporary directory that is renamed into
+    place once complete, so an interrupted run never leaves a partial artifact
+    behind and the next run resumes after the last completed stage.
+    """
+
+    def __init__(self, root: str):
+        """Initialize the store.
+        Args:
+            root (str): Directory holding the artifacts.
+        """
+        self.root = root
+
+    def path(self, stage: str, key: str) -> str:
+        return os.path.join(self.root, stage, key[:2], key)
+
+    def get(self, stage: str, key: str) -> Artifact | None:
+        """Return a completed artifact.
+        Args:
+            stage (str): Stage name.
+            key (str): Artifact key.
+        Returns:
+            Artifact | None: The artifact, None if it was never completed."""
+        path = self.path(stage, key)
+        if not os.path.exists(os.path.join(path, MANIFEST)):
+            return None
+        return Artifact(stage, key, path, reused=True)
+
+    def remove_stale(self) -> int:
+        """Delete the temporary directories left behind by killed processes.
+        Returns:
+            int: Number of directories deleted."""
+        removed = 0
+        if not os.path.isdir(self.root):
+            return removed
+        for stage in os.listdir(self.root):
+            stage_dir = os.path.join(self.root, stage)
+            if not os.path.isdir(stage_dir):
+                continue
+            for name in os.listdir(stage_dir):
+                if not name.startswith(".tmp-"):
+                    continue
+                try:
+                    pid = int(name.split("-")[1])
+                    os.kill(pid, 0)
+                    continue  # still being written
+                except ProcessLookupError:
+                    pass
+                except (ValueError, IndexError, PermissionError):
+                    continue
+                shutil.rmtree(os.path.join(stage_dir, name), ignore_errors=True)
+                removed += 1
+        return removed
+
+    async def build(
+        self,
+        stage: Stage,
+        key: str,
+        inputs: Dict[str, Artifact],
+        replace: bool = False,
+    ) -> Artifact:
+        """Run a stage and publish its output as an artifact.
+        Args:
+            stage (Stage): The stage.
+            key (str): Artifact key of the stage.
+            inputs (Dict[str, Artifact]): Artifacts of the stage's inputs.
+            replace (bool): Whether to replace an existing artifact.
+        Returns:
+            Artifact: The new artifact."""
+        path = self.path(stage.name, key)
+        tmp_path = os.path.join(
+            self.root, stage.name, f".tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        )
+        os.makedirs(tmp_path)
+        try:
+            await stage.run(inputs, tmp_path)
+            manifest = {
+                "stage": stage.name,
+                "key": key,
+                "version": stage.version,
+                "params": stage.params,
+                "inputs": {name: a.key for name, a in inputs.items()},
+                "created": time.time(),
+            }
+            with open(os.path.join(tmp_path, MANIFEST), "w", encoding="utf-8") as file:
+                json.dump(manifest, file, indent=2, default=str)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if replace and os.path.exists(path):
+                shutil.rmtree(path)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                # another job built the same artifact meanwhile
+                existing = self.get(stage.name, key)
+                if existing is None:
+                    raise
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                return existing
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        return Artifact(stage.name, key, path)
+
+
+class PipelineGraph:
+    """Graph of stages run in dependency order, each only when its key changed.
+
+    The key of a stage hashes its name, version and params together with the
+    keys of its inputs, so a change anywhere invalidates exactly the stages
+    downstream of it: new caption options re-render the video but reuse the
+    story, the speech and the fitted background.
+    """
+
+    def __init__(self, store: ArtifactStore):
+        """Initialize an empty graph.
+        Args:
+            store (ArtifactStore): Where the artifacts are kept.
+        """
+        self.store = store
+        self.stages: Dict[str, Stage] = {}
+
+    def add(self, stage: Stage) -> None:
+        """Add a stage, after the stages it depends on.
+        Args:
+            stage (Stage): The stage."""
+        missing = [name for name in stage.inputs if name not in self.stages]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages {missing}")
+        if stage.name in self.stages:
+            raise ValueError(f"Duplicate stage {stage.name}")
+        self.stages[stage.name] = stage
+
+    def keys(self) -> Dict[str, str]:
+        """Compute the artifact key of every stage without running anything.
+        Returns:
+            Dict[str, str]: Key of each stage."""
+        keys: Dict[str, str] = {}
+        for stage in self.stages.values():
+            keys[stage.name] = content_key(
+                stage.name,
+                stage.version,
+                stage.params,
+                [keys[name] for name in stage.inputs],
+            )
+        return keys
+
+    async def run(self, force: bool = False) -> Dict[str, Artifact]:
+        """Run the stages whose artifacts are missing.
+        Args:
+            force (bool): Whether to run every stage even if its artifact exists.
+        Returns:
+            Dict[str, Artifact]: Artifact of each stage."""
+        artifacts: Dict[str, Artifact] = {}
+        for name, key in self.keys().items():
+            stage = self.stages[name]
+            artifact = None if force else self.store.get(name, key)
+            if artifact is None:
+                inputs = {n: artifacts[n] for n in stage.inputs}
+                artifact = await self.store.build(stage, key, inputs, replace=force)
+            else:
+                metrics.count("artifacts_reused", stage=name)
+            artifacts[name] = artifact
+        return artifacts
@@ -0,0 +1,399 @@
+import asyncio
+import os
+import shutil
+from concurrent.futures import Executor
+from functools import partial
+from typing import TYPE_CHECKING, Dict
+
+from core import metrics
+from graphs.graph import Artifact, ArtifactStore, PipelineGraph, Stage
+from models.schemas import AlignmentSchema, DraftSchema, JobSchema, StorySchema
+
+if TYPE_CHECKING:
+    from core.backgrounds import BackgroundLibrary
+    from main import StageLimits
+    from providers.elevenlabs import SpeechSynthesizer
+    from providers.openai import StoryTeller
+
+STORY_FILE = "story.json"
+SPEECH_FILE = "speech.mp3"
+ALIGNMENT_FILE = "alignment.json"
+FITTED_FILE = "fitted.mp4"
+VIDEO_FILE = "video.mp4"
+CAPTIONS_FILE = "captions.npz"
+DRAFT_FILE = "draft.mp4"
+SHEET_FILE = "contact_sheet.png"
+
+
+def format_file(name: str) -> str:
+    """Name of the file of an extra output format.
+    Args:
+        name (str): Name of the format.
+    Returns:
+        str: The file name."""
+    return f"video_{name}.mp4"
+
+
+def file_fingerprint(path: str) -> list:
+    """Identify a file by path, size and modification time, without reading it.
+    Args:
+        path (str): Path to the file.
+    Returns:
+        list: The absolute path, size and mtime in nanoseconds."""
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def job_graph(
+    job: JobSchema,
+    store: ArtifactStore,
+    story_teller: "StoryTeller",
+    speech_synthesizer: "SpeechSynthesizer",
+    limits: "StageLimits",
+    render_pool: Executor,
+    font_path: str,
+    render_shards: int = 1,
+    render_cores: int | None = None,
+    library: "BackgroundLibrary | None" = None,
+    draft: DraftSchema | None = None,
+    stream_speech: bool = False,
+) -> PipelineGraph:
+    """Build the graph producing a job's video: story, speech, fitted video, karaoke.
+
+    The story depends on the topic, the model and the prompt; the speech on
+    the story and the voice settings; the fitted background on the background
+    file and the speech; the karaoke render on both of them, the font and the
+    job's render options. The number of render shards is left out of the keys
+    since it does not change the video.
+
+    A job with extra output formats renders all of them together with the main
+    video from one decode of the background, see `render_karaoke_formats`;
+    render shards do not apply then (`run_batch` warns about it) and
+    `JobSchema` rejects another render backend.
+
+    With `draft` the karaoke stage is replaced by a `draft` stage rendering a
+    small, fast preview (or a contact sheet) of the main video with the same
+    caption options, reusing the story, speech and fitted background.
+
+    With `stream_speech` the story stage also speaks the story while it is
+    generated, see `stream_story_speech`, and the speech stage picks up the
+    streamed speech; the keys of the stages are the same either way.
+
+    With the "overlay" render backend the captions are rendered by a
+    `captions` stage into a track that only depends on the speech, the
+    caption options and the size of a library background (the background
+    file otherwise, probed by the stage), and the karaoke stage composites it
+    onto the fitted background. Trying another library background of the
+    same size then reruns the fitting and the composite only.
+
+    A background found in the library is replaced by its transcoded version,
+    started at a keyframe picked from the job id, and stream-copied without
+    probing it.
+    Args:
+        job (JobSchema): The job.
+        store (ArtifactStore): Where the artifacts are kept.
+        story_teller (StoryTeller): Shared story generator.
+        speech_synthesizer (SpeechSynthesizer): Shared speech synthesizer.
+        limits (StageLimits): Concurrency limits of the network-bound stages.
+        render_pool (Executor): Executor running the CPU-bound stages.
+        font_path (str): Path to the subtitles font.
+        render_shards (int): Number of parallel time shards of the render.
+        render_cores (int | None): CPU cores of one render worker, which caps
+            the shards and their encoder threads, all cores if None.
+        library (BackgroundLibrary | None): Library of transcoded backgrounds.
+        draft (DraftSchema | None): Render a draft instead of the final video.
+        stream_speech (bool): Synthesize the speech while the story is generated.
+    Returns:
+        PipelineGraph: The graph."""
+    loop = asyncio.get_running_loop()
+
+    async def story(inputs: Dict[str, Artifact], out_dir: str) -> None:
+        if stream_speech:
+            answer = await streamed_story()
+        else:
+            async with limits.llm:
+                with metrics.span("story", job=job.id):
+                    answer: StorySchema = await asyncio.to_thread(
+                        story_teller.generate_answer, job.topic
+                    )
+        with open(os.path.join(out_dir, STORY_FILE), "w", encoding="utf-8") as file:
+            file.write(answer.model_dump_json(indent=2))
+
+    async def streamed_story() -> StorySchema:
+        from providers.streaming import stream_story_speech
+
+        # the LLM and the TTS provider are both busy until the story ends
+        async with limits.llm, limits.tts:
+            with metrics.span("story", job=job.id, streamed=True):
+                answer, _ = await asyncio.to_thread(
+                    stream_story_speech, story_teller, speech_synthesizer, job.topic
+                )
+        return answer
+
+    async def speech(inputs: Dict[str, Artifact], out_dir: str) -> None:
+        from core.audio import base64_to_mp3
+
+        with open(inputs["story"].file(STORY_FILE), "r", encoding="utf-8") as file:
+            answer = StorySchema.model_validate_json(file.read())
+        async with limits.tts:
+            with metrics.span("speech", job=job.id):
+                audio = await asyncio.to_thread(
+                    speech_synthesizer.generate_speech, answer
+                )
+        if audio.normalized_alignment is None:
+            raise ValueError("The speech provider returned no alignment")
+        with metrics.span("audio_decode", job=job.id):
+            await asyncio.to_thread(
+                base64_to_mp3, audio.audio_base_64, os.path.join(out_dir, SPEECH_FILE)
+            )
+        alignment = AlignmentSchema.model_validate(
+            audio.normalized_alignment, from_attributes=True
+        )
+        with open(os.path.join(out_dir, ALIGNMENT_FILE), "w", encoding="utf-8") as file:
+            file.write(alignment.model_dump_json())
+
+    async def fitted(inputs: Dict[str, Artifact], out_dir: str) -> None:
+        from core.video import fit_video_to_audio
+
+        await loop.run_in_executor(
+            render_pool,
+            partial(
+                fit_video_to_audio,
+                job.background_path,
+                inputs["speech"].file(SPEECH_FILE),
+                os.path.join(out_dir, FITTED_FILE),
+            ),
+        )
+
+    async def fitted_from_library(inputs: Dict[str, Artifact], out_dir: str) -> None:
+        from core.backgrounds import fit_asset_to_audio
+        from core.ffmpeg import probe
+
+        audio_path = inputs["speech"].file(SPEECH_FILE)
+        audio_duration = (await asyncio.to_thread(probe, audio_path))["duration"]
+        start = asset.random_start(seed=job.id, min_remaining=audio_duration)
+        await asyncio.to_thread(
+            fit_asset_to_audio,
+            asset,
+            audio_path,
+            os.path.join(out_dir, FITTED_FILE),
+            start=start,
+            audio_duration=audio_duration,
+        )
+
+    async def captions(inputs: Dict[str, Artifact], out_dir: str) -> None:
+        from core.ffmpeg import probe
+        from core.overlay import render_caption_track
+
+        if asset is not None:
+            track_size, track_fps = (asset.width, asset.height), asset.fps
+        else:
+            # the fitted background keeps the size and frame rate of the source
+            info = await asyncio.to_thread(probe, job.background_path)
+            track_size = tuple(info["video_size"])
+            track_fps = float(info.get("video_fps") or 30.0)
+        with open(inputs["speech"].file(ALIGNMENT_FILE), "rb") as file:
+            alignment = AlignmentSchema.model_validate_json(file.read())
+        await loop.run_in_executor(
+            render_pool,
+            partial(
+                render_caption_track,
+                alignment_obj=alignment,
+                track_path=os.path.join(out_dir, CAPTIONS_FILE),
+                width=track_size[0],
+                height=track_size[1],
+                font_path=font_path,
+                fps=track_fps,
+                **job.render.model_dump(exclude={"backend"}),
+            ),
+        )
+
+    async def karaoke(inputs: Dict[str, Artifact], out_dir: str) -> None:
+        from core.overlay import render_caption_overlay
+        from core.render import render_karaoke_video
+
+        if "captions" in inputs:
+            await loop.run_in_executor(
+                render_pool,
+                partial(
+                    render_caption_overlay,
+                    video_path=inputs["fitted"].file(FITTED_FILE),
+                    audio_path=inputs["speech"].file(SPEECH_FILE),
+                    track_path=inputs["captions"].file(CAPTIONS_FILE),
+                    output_path=os.path.join(out_dir, VIDEO_FILE),
+                ),
+            )
+            return
+        with open(inputs["speech"].file(ALIGNMENT_FILE), "rb") as file:
+            alignment = AlignmentSchema.model_validate_json(file.read())
+        if job.formats:
+            await karaoke_formats(inputs, out_dir, alignment)
+            return
+        await loop.run_in_executor(
+            render_pool,
+            partial(
+                render_karaoke_video,
+                video_path=inputs["fitted"].file(FITTED_FILE),
+                audio_path=inputs["speech"].file(SPEECH_FILE),
+                alignment_obj=alignment,
+                output_path=os.path.join(out_dir, VIDEO_FILE),
+                font_path=font_path,
+                shards=render_shards,
+                cores=render_cores,
+                **job.render.model_dump(),
+            ),
+        )
+
+    async def karaoke_formats(
+        inputs: Dict[str, Artifact], out_dir: str, alignment: AlignmentSchema
+    ) -> None:
+        from core.formats import OutputProfile, render_karaoke_formats
+
+        render = job.render
+        outputs = {
+            os.path.join(out_dir, VIDEO_FILE): OutputProfile(
+                y_pos_ratio=render.y_pos_ratio, font_size_ratio=render.font_size_ratio
+            )
+        }
+        for f in job.formats:
+            outputs[os.path.join(out_dir, format_file(f.name))] = OutputProfile(
+                width=f.width,
+                height=f.height,
+                fit=f.fit,
+                fps=f.fps,
+                bitrate=f.bitrate,
+                y_pos_ratio=f.y_pos_ratio or render.y_pos_ratio,
+                font_size_ratio=f.font_size_ratio or render.font_size_ratio,
+            )
+        await loop.run_in_executor(
+            render_pool,
+            partial(
+                render_karaoke_formats,
+                video_path=inputs["fitted"].file(FITTED_FILE),
+                audio_path=inputs["speech"].file(SPEECH_FILE),
+                alignment_obj=alignment,
+                outputs=outputs,
+                font_path=font_path,
+                max_segment_chars=render.max_segment_chars,
+                max_segment_duration=render.max_segment_duration,
+                max_chars_per_line=render.max_chars_per_line,
+            ),
+        )
+
+    async def draft_stage(inputs: Dict[str, Artifact], out_dir: str) -> None:
+        from core.draft import render_contact_sheet, render_karaoke_draft
+
+        with open(inputs["speech"].file(ALIGNMENT_FILE), "rb") as file:
+            alignment = AlignmentSchema.model_validate_json(file.read())
+        render = job.render.model_dump(exclude={"backend"})
+        if draft.sheet:
+            func = partial(
+                render_contact_sheet,
+                output_path=os.path.join(out_dir, SHEET_FILE),
+                scale=draft.scale,
+            )
+        else:
+            func = partial(
+                render_karaoke_draft,
+                output_path=os.path.join(out_dir, DRAFT_FILE),
+                scale=draft.scale,
+                fps=draft.fps,
+            )
+        await loop.run_in_executor(
+            render_pool,
+            partial(
+                func,
+                video_path=inputs["fitted"].file(FITTED_FILE),
+                audio_path=inputs["speech"].file(SPEECH_FILE),
+                alignment_obj=alignment,
+                font_path=font_path,
+                start=draft.start,
+                end=draft.end,
+                **render,
+            ),
+        )
+
+    graph = PipelineGraph(store)
+    graph.add(
+        Stage("story", story, params={"answer": story_teller.answer_key(job.topic)})
+    )
+    graph.add(
+        Stage(
+            "speech",
+            speech,
+            inputs=("story",),
+            params={"settings": speech_synthesizer.settings_key()},
+        )
+    )
+    asset = library.get(job.background_path) if library is not None else None
+    if asset is None:
+        graph.add(
+            Stage(
+                "fitted",
+                fitted,
+                inputs=("speech",),
+                params={"background": file_fingerprint(job.background_path)},
+            )
+        )
+    else:
+        graph.add(
+            Stage(
+                "fitted",
+                fitted_from_library,
+                inputs=("speech",),
+                params={"asset": asset.id, "seed": job.id},
+            )
+        )
+    if draft is not None:
+        graph.add(
+            Stage(
+                "draft",
+                draft_stage,
+                inputs=("speech", "fitted"),
+                params={
+                    "font": file_fingerprint(font_path),
+                    "render": job.render.model_dump(exclude={"backend"}),
+                    "draft": draft.model_dump(),
+                },
+            )
+        )
+        return graph
+    karaoke_params = {
+        "font": file_fingerprint(font_path),
+        "render": job.render.model_dump(),
+    }
+    if job.formats:
+        karaoke_params["formats"] = [f.model_dump() for f in job.formats]
+    karaoke_inputs = ("speech", "fitted")
+    if job.render.backend == "overlay":
+        captions_params = {
+            "font": file_fingerprint(font_path),
+            "render": job.render.model_dump(exclude={"backend"}),
+        }
+        if asset is not None:
+            captions_params["size"] = [asset.width, asset.height]
+            captions_params["fps"] = asset.fps
+        else:
+            # probed by the stage, the file stands for its size and frame rate
+            captions_params["background"] = file_fingerprint(job.background_path)
+        graph.add(
+            Stage("captions", captions, inputs=("speech",), params=captions_params)
+        )
+        karaoke_inputs = ("speech", "captions", "fitted")
+    graph.add(Stage("karaoke", karaoke, inputs=karaoke_inputs, params=karaoke_params))
+    return graph
+
+
+def publish(artifact_path: str, output_path: str) -> None:
+    """Expose an artifact file at an output path, hard-linked when possible.
+    Args:
+        artifact_path (str): File in the artifact store.
+        output_path (str): Path to expose it at, replaced if it exists."""
+    if os.path.exists(output_path) and os.path.samefile(artifact_path, output_path):
+        return
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        os.link(artifact_path, tmp_path)
+    except OSError:
+        shutil.copyfile(artifact_path, tmp_path)
+    os.replace(tmp_path, output_path)
@@ -0,0 +1,493 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from core import metrics
+
+if TYPE_CHECKING:
+    from core.backgrounds import BackgroundLibrary
+    from graphs.graph import ArtifactStore
+    from models.schemas import DraftSchema, JobSchema
+    from providers.elevenlabs import SpeechSynthesizer
+    from providers.openai import StoryTeller
+
+# Commands import what they need when they run, so that starting the CLI and
+# spawning render workers does not load the providers and the video stack.
+
+
+@dataclass
+class StageLimits:
+    """Concurrency limits of the network-bound stages."""
+
+    llm: asyncio.Semaphore
+    tts: asyncio.Semaphore
+
+
+def load_jobs(jobs_path: str) -> list["JobSchema"]:
+    """Load jobs from a JSON Lines file, one job per line.
+    Args:
+        jobs_path (str): Path to the jobs file.
+    Returns:
+        list[JobSchema]: The jobs, with missing ids filled in from the line number.
+    """
+    from models.schemas import JobSchema
+
+    jobs = []
+    with open(jobs_path, "r", encoding="utf-8") as file:
+        for line_no, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            job = JobSchema.model_validate_json(line)
+            if job.id is None:
+                job.id = f"job-{line_no:04d}"
+            jobs.append(job)
+    return jobs
+
+
+async def run_job(
+    job: "JobSchema",
+    story_teller: "StoryTeller",
+    speech_synthesizer: "SpeechSynthesizer",
+    limits: StageLimits,
+    render_pool: Executor,
+    output_dir: str,
+    font_path: str,
+    render_shards: int = 1,
+    render_cores: int | None = None,
+    store: "ArtifactStore | None" = None,
+    force: bool = False,
+    library: "BackgroundLibrary | None" = None,
+    draft: "DraftSchema | None" = None,
+    stream_speech: bool = False,
+) -> str:
+    """Produce a single video: story, speech, audio file and karaoke render.
+
+    The stages form a graph whose outputs are kept in the artifact store under
+    a hash of their inputs, so only the stages whose inputs changed run again
+    and an interrupted job resumes after its last completed stage. LLM and TTS
+    calls run in threads under their concurrency limits, rendering runs in the
+    process pool, so network waits of one job overlap with the rendering of
+    another.
+    Args:
+        job (JobSchema): The job to run.
+        story_teller (StoryTeller): Shared story generator.
+        speech_synthesizer (SpeechSynthesizer): Shared speech synthesizer.
+        limits (StageLimits): Concurrency limits of the network-bound stages.
+        render_pool (Executor): Executor running the CPU-bound render.
+        output_dir (str): Directory the job directory is created in.
+        font_path (str): Path to the subtitles font.
+        render_shards (int): Number of parallel time shards of the render.
+        render_cores (int | None): CPU cores of one render worker, all if None.
+        store (ArtifactStore | None): Store of the stage outputs, the one in
+            `CACHE_DIR` if None.
+        force (bool): Whether to run every stage even if its output exists.
+        library (BackgroundLibrary | None): Library of transcoded backgrounds.
+        draft (DraftSchema | None): Render a draft instead of the final video.
+        stream_speech (bool): Synthesize the speech while the story is generated.
+    Returns:
+        str: Path to the rendered video, or to the draft.
+    """
+    from graphs.graph import ArtifactStore
+    from graphs.production import (
+        DRAFT_FILE,
+        SHEET_FILE,
+        SPEECH_FILE,
+        STORY_FILE,
+        VIDEO_FILE,
+        format_file,
+        job_graph,
+        publish,
+    )
+
+    if store is None:
+        from models.configs import CacheConfig, get_config
+
+        store = ArtifactStore(os.path.join(get_config(CacheConfig).DIR, "artifacts"))
+
+    job_dir = os.path.join(output_dir, job.id)
+    os.makedirs(job_dir, exist_ok=True)
+
+    with metrics.span("job", job=job.id):
+        graph = job_graph(
+            job,
+            store,
+            story_teller,
+            speech_synthesizer,
+            limits,
+            render_pool,
+            font_path,
+            render_shards,
+            render_cores,
+            library,
+            draft,
+            stream_speech,
+        )
+        artifacts = await graph.run(force=force)
+
+    publish(artifacts["story"].file(STORY_FILE), os.path.join(job_dir, "story.json"))
+    publish(artifacts["speech"].file(SPEECH_FILE), os.path.join(job_dir, "speech.mp3"))
+    if draft is not None:
+        name = SHEET_FILE if draft.sheet else DRAFT_FILE
+        draft_path = os.path.join(job_dir, name)
+        publish(artifacts["draft"].file(name), draft_path)
+        return draft_path
+    video_path = os.path.join(job_dir, "video.mp4")
+    publish(artifacts["karaoke"].file(VIDEO_FILE), video_path)
+    for f in job.formats:
+        publish(
+            artifacts["karaoke"].file(format_file(f.name)),
+            os.path.join(job_dir, format_file(f.name)),
+        )
+    return video_path
+
+
+async def run_batch(
+    jobs: list["JobSchema"],
+    output_dir: str,
+    font_path: str,
+    llm_concurrency: int,
+    tts_concurrency: int,
+    render_workers: int,
+    render_shards: int = 1,
+    use_tts_cache: bool | None = None,
+    use_story_cache: bool | None = None,
+    force: bool = False,
+    draft: "DraftSchema | None" = None,
+    stream_speech: bool = False,
+) -> list[str | BaseException]:
+    """Run all jobs concurrently.
+    Args:
+        jobs (list[JobSchema]): The jobs to run.
+        output_dir (str): Directory the job directories are created in.
+        font_path (str): Path to the subtitles font.
+        llm_concurrency (int): Maximum number of parallel LLM calls.
+        tts_concurrency (int): Maximum number of parallel TTS calls.
+        render_workers (int): Number of render processes.
+        render_shards (int): Number of parallel time shards of each render.
+        use_tts_cache (bool | None): Whether to reuse cached speech, config
+            default if None.
+        use_story_cache (bool | None): Whether to reuse cached stories, config
+            default if None.
+        force (bool): Whether to run every stage even if its output exists.
+        draft (DraftSchema | None): Render drafts instead of the final videos.
+        stream_speech (bool): Synthesize the speech of each story while it is generated.
+    Returns:
+        list[str | BaseException]: Video path or the error of each job, in job order.
+    """
+    from core.backgrounds import default_library
+    from graphs.graph import ArtifactStore
+    from models.configs import CacheConfig, get_config
+    from models.schemas import StorySchema
+    from prompts.loader import load_story_prompt
+    from providers.elevenlabs import SpeechSynthesizer
+    from providers.openai import StoryTeller
+
+    # the render workers share the cores, so do the shards of each render
+    cpu_count = os.cpu_count() or 1
+    render_cores = max(1, cpu_count // render_workers)
+    if render_shards > render_cores and draft is None:
+        print(
+            f"warning: {render_workers} render workers on {cpu_count} cores leave "
+            f"{render_cores} per render, so renders use at most {render_cores} "
+            "shards; lower the render workers for more shards",
+            file=sys.stderr,
+        )
+    if render_shards > 1 and draft is None:
+        for job in jobs:
+            if job.formats:
+                print(
+                    f"warning: job {job.id} renders its formats from one decode, "
+                    "without render shards",
+                    file=sys.stderr,
+                )
+
+    story_teller = StoryTeller(
+        pydantic_object=StorySchema,
+        system_prompt=load_story_prompt(),
+        use_cache=use_story_cache,
+    )
+    speech_synthesizer = SpeechSynthesizer(use_cache=use_tts_cache)
+    store = ArtifactStore(os.path.join(get_config(CacheConfig).DIR, "artifacts"))
+    store.remove_stale()
+    library = default_library()
+    limits = StageLimits(
+        llm=asyncio.Semaphore(llm_concurrency), tts=asyncio.Semaphore(tts_concurrency)
+    )
+
+    # spawn, because forking a process that already runs API threads is unsafe
+    with (
+        metrics.span("batch", jobs=len(jobs)),
+        ProcessPoolExecutor(
+            max_workers=render_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as render_pool,
+    ):
+        results = await asyncio.gather(
+            *(
+                run_job(
+                    job,
+                    story_teller,
+                    speech_synthesizer,
+                    limits,
+                    render_pool,
+                    output_dir,
+                    font_path,
+                    render_shards,
+                    render_cores,
+                    store=store,
+                    force=force,
+                    library=library,
+                    draft=draft,
+                    stream_speech=stream_speech,
+                )
+                for job in jobs
+            ),
+            return_exceptions=True,
+        )
+    metrics.flush()
+    return results
+
+
+def batch_command(args: argparse.Namespace) -> int:
+    """Run the `batch` command.
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+    Returns:
+        int: Exit code, non-zero if any job failed.
+    """
+    from models.configs import BatchConfig, get_config
+
+    config = get_config(BatchConfig)
+    jobs = load_jobs(args.jobs)
+    results = asyncio.run(
+        run_batch(
+            jobs,
+            output_dir=args.output_dir or config.OUTPUT_DIR,
+            font_path=args.font_path or config.FONT_PATH,
+            llm_concurrency=args.llm_concurrency or config.LLM_CONCURRENCY,
+            tts_concurrency=args.tts_concurrency or config.TTS_CONCURRENCY,
+            render_workers=args.render_workers
+            or config.RENDER_WORKERS
+            or os.cpu_count()
+            or 1,
+            render_shards=args.render_shards or config.RENDER_SHARDS,
+            use_tts_cache=False if args.no_tts_cache else None,
+            use_story_cache=True if args.story_cache else None,
+            force=args.force,
+            draft=_draft_options(args),
+            stream_speech=args.stream_speech or config.STREAM_SPEECH,
+        )
+    )
+
+    failed = 0
+    for job, result in zip(jobs, results):
+        if isinstance(result, BaseException):
+            failed += 1
+            print(json.dumps({"id": job.id, "error": repr(result)}))
+        else:
+            print(json.dumps({"id": job.id, "video": result}))
+    return 1 if failed else 0
+
+
+def _draft_options(args: argparse.Namespace) -> "DraftSchema | None":
+    from models.schemas import DraftSchema
+
+    if not (args.draft or args.contact_sheet):
+        return None
+    options = dict(
+        scale=args.draft_scale,
+        fps=args.draft_fps,
+        start=args.draft_start,
+        end=args.draft_end,
+    )
+    return DraftSchema(
+        sheet=args.contact_sheet,
+        **{name: value for name, value in options.items() if value is not None},
+    )
+
+
+def backgrounds_command(args: argparse.Namespace) -> int:
+    """Run the `backgrounds` command: transcode backgrounds or list the library.
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+    Returns:
+        int: Exit code, non-zero if any background failed.
+    """
+    from core.backgrounds import default_library
+
+    library = default_library(create=True)
+    if args.action == "list":
+        for asset in library.assets():
+            print(json.dumps(_asset_summary(asset)))
+        return 0
+
+    failed = 0
+    for path in args.paths:
+        try:
+            asset = library.add(path, force=args.force)
+        except (OSError, RuntimeError) as e:
+            failed += 1
+            print(json.dumps({"source": path, "error": repr(e)}))
+            continue
+        print(json.dumps(_asset_summary(asset)))
+    return 1 if failed else 0
+
+
+def _asset_summary(asset) -> dict:
+    return {
+        "source": asset.source,
+        "path": asset.path,
+        "size": [asset.width, asset.height],
+        "fps": asset.fps,
+        "duration": asset.duration,
+        "keyframes": len(asset.keyframes),
+        "bytes": asset.size_bytes,
+    }
+
+
+def jobs_command(args: argparse.Namespace) -> int:
+    """Run the `jobs` command: validate a jobs file and list its jobs.
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+    Returns:
+        int: Exit code, non-zero if the file is invalid.
+    """
+    from pydantic import ValidationError
+
+    try:
+        jobs = load_jobs(args.jobs)
+    except ValidationError as e:
+        print(e, file=sys.stderr)
+        return 1
+    for job in jobs:
+        print(job.model_dump_json())
+    return 0
+
+
+def config_command(args: argparse.Namespace) -> int:
+    """Run the `config` command: validate the configuration and print it.
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+    Returns:
+        int: Exit code, non-zero if any configuration is invalid.
+    """
+    from pydantic import ValidationError
+
+    from models import configs
+
+    failed = 0
+    for config_cls in (
+        configs.LLMConfig,
+        configs.TTSConfig,
+        configs.PromptConfig,
+        configs.BatchConfig,
+        configs.BackgroundConfig,
+        configs.CacheConfig,
+        configs.MetricsConfig,
+    ):
+        try:
+            config = configs.get_config(config_cls)
+        except ValidationError as e:
+            failed += 1
+            print(json.dumps({"config": config_cls.__name__, "error": str(e)}))
+            continue
+        values = {
+            name: "***" if "KEY" in name else value
+            for name, value in config.model_dump().items()
+        }
+        print(json.dumps({"config": config_cls.__name__, "values": values}))
+    return 1 if failed else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the command line parser.
+    Returns:
+        argparse.ArgumentParser: The parser with all subcommands.
+    """
+    parser = argparse.ArgumentParser(prog="podcaster")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch = subparsers.add_parser(
+        "batch", help="Produce videos for a JSON Lines file of jobs"
+    )
+    batch.add_argument("jobs", help="Path to the jobs file")
+    batch.add_argument("--output-dir", help="Directory for the job outputs")
+    batch.add_argument("--font-path", help="Path to the subtitles font")
+    batch.add_argument("--llm-concurrency", type=int, help="Parallel LLM calls")
+    batch.add_argument("--tts-concurrency", type=int, help="Parallel TTS calls")
+    batch.add_argument("--render-workers", type=int, help="Render processes")
+    batch.add_argument(
+        "--render-shards", type=int, help="Parallel time shards of each render"
+    )
+    batch.add_argument(
+        "--no-tts-cache", action="store_true", help="Always call the TTS provider"
+    )
+    batch.add_argument(
+        "--story-cache",
+        action="store_true",
+        help="Reuse stories generated earlier for the same prompts",
+    )
+    batch.add_argument(
+        "--force",
+        action="store_true",
+        help="Rerun every stage even if its output is already stored",
+    )
+    batch.add_argument(
+        "--stream-speech",
+        action="store_true",
+        help="Synthesize the speech of each story while the story is generated",
+    )
+    batch.add_argument(
+        "--draft",
+        action="store_true",
+        help="Render small, fast previews instead of the final videos",
+    )
+    batch.add_argument(
+        "--contact-sheet",
+        action="store_true",
+        help="Render a contact sheet of the caption segments instead of the videos",
+    )
+    batch.add_argument(
+        "--draft-scale", type=float, help="Draft size relative to the final video"
+    )
+    batch.add_argument("--draft-fps", type=float, help="Frame rate of the drafts")
+    batch.add_argument(
+        "--draft-start", type=float, help="Start of the drafted window in seconds"
+    )
+    batch.add_argument(
+        "--draft-end", type=float, help="End of the drafted window in seconds"
+    )
+    batch.set_defaults(func=batch_command)
+
+    backgrounds = subparsers.add_parser(
+        "backgrounds", help="Transcode backgrounds into the library or list it"
+    )
+    backgrounds.add_argument("action", choices=["add", "list"])
+    backgrounds.add_argument("paths", nargs="*", help="Source videos to add")
+    backgrounds.add_argument(
+        "--force", action="store_true", help="Transcode even if already in the library"
+    )
+    backgrounds.set_defaults(func=backgrounds_command)
+
+    jobs = subparsers.add_parser("jobs", help="Validate and list a jobs file")
+    jobs.add_argument("jobs", help="Path to the jobs file")
+    jobs.set_defaults(func=jobs_command)
+
+    config = subparsers.add_parser("config", help="Validate and show the configuration")
+    config.set_defaults(func=config_command)
+
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
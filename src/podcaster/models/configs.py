@@ -1,5 +1,11 @@
+import os
+from functools import lru_cache
+from typing import TypeVar
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+TSettings = TypeVar("TSettings", bound=BaseSettings)
+
 
 class LLMConfig(BaseSettings):
     """Configuration for the language model."""
@@ -9,6 +15,11 @@ class LLMConfig(BaseSettings):
     )
     API_KEY: str
     MODEL: str
+    BASE_URL: str | None = None  # e.g. a local stub, the public API if unset
+    MAX_CONNECTIONS: int = 10
+    REQUESTS_PER_MINUTE: float = 0  # 0 means no client-side limit
+    RATE_LIMIT_RETRIES: int = 5
+    TIMEOUT: float = 120.0
 
 
 class TTSConfig(BaseSettings):
@@ -25,6 +36,17 @@ class TTSConfig(BaseSettings):
     MALE_VOICE_ID: str
     FEMALE_VOICE_ID: str
     SPEED: float
+    CHUNK_CHARS: int = 1500
+    CHUNK_PARALLELISM: int = 4
+    # chunks of speech streamed from the story, the first one short to start early
+    STREAM_FIRST_CHUNK_CHARS: int = 120
+    STREAM_CHUNK_CHARS: int = 400
+    BASE_URL: str | None = None  # e.g. a local stub, the public API if unset
+    MAX_CONNECTIONS: int = 10
+    REQUESTS_PER_MINUTE: float = 0  # 0 means no client-side limit
+    CHARACTERS_PER_MINUTE: float = 0
+    RATE_LIMIT_RETRIES: int = 5
+    TIMEOUT: float = 240.0
 
 
 class PromptConfig(BaseSettings):
@@ -36,3 +58,85 @@ class PromptConfig(BaseSettings):
     PROMPT_TEMPLATE_PATH: str
     LENGTH_MINUTES: str
     LANGUAGE: str
+
+
+class BatchConfig(BaseSettings):
+    """Configuration for batch production."""
+
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", env_prefix="BATCH_", extra="ignore"
+    )
+    OUTPUT_DIR: str = "output"
+    FONT_PATH: str = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+    LLM_CONCURRENCY: int = 4
+    TTS_CONCURRENCY: int = 2
+    RENDER_WORKERS: int = 0  # 0 means one worker per CPU core
+    RENDER_SHARDS: int = 1  # parallel time shards of each render
+    STREAM_SPEECH: bool = False  # synthesize the speech while the story is generated
+
+
+class BackgroundConfig(BaseSettings):
+    """Configuration for the transcoded background library."""
+
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        env_file_encoding="utf-8",
+        env_prefix="BACKGROUND_",
+        extra="ignore",
+    )
+    LIBRARY_DIR: str = "backgrounds/library"
+    WIDTH: int = 1080
+    HEIGHT: int = 1920
+    FPS: int = 30
+    KEYFRAME_INTERVAL: float = 1.0  # seconds between keyframes
+    CRF: int = 20
+    PRESET: str = "medium"
+
+
+class CacheConfig(BaseSettings):
+    """Configuration for the local caches."""
+
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", env_prefix="CACHE_", extra="ignore"
+    )
+    DIR: str = ".cache"
+    TTS_ENABLED: bool = True
+    TTS_MAX_BYTES: int = 2 * 1024**3
+    STORY_ENABLED: bool = False
+
+
+class MetricsConfig(BaseSettings):
+    """Configuration for pipeline tracing and metrics."""
+
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        env_file_encoding="utf-8",
+        env_prefix="METRICS_",
+        extra="ignore",
+    )
+    ENABLED: bool = False
+    JSONL_PATH: str = "metrics/metrics.jsonl"
+    PROMETHEUS_PATH: str = "metrics/podcaster.prom"
+    SAMPLE_INTERVAL: float = 0.05  # seconds between memory samples
+
+
+@lru_cache(maxsize=None)
+def _load_config(config_cls: type[TSettings], env_mtime_ns: int) -> TSettings:
+    return config_cls()
+
+
+def get_config(config_cls: type[TSettings]) -> TSettings:
+    """Return a configuration instance shared by the whole process.
+
+    The instance is created once and re-created only when the `.env` file
+    changes, so repeated calls do not re-read and re-validate the settings.
+    Args:
+        config_cls (type[TSettings]): The configuration class.
+    Returns:
+        TSettings: The configuration instance, which must not be modified.
+    """
+    try:
+        env_mtime_ns = os.stat(".env").st_mtime_ns
+    except FileNotFoundError:
+        env_mtime_ns = 0
+    return _load_config(config_cls, env_mtime_ns)
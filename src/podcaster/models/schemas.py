@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from enum import Enum
 
 
@@ -10,9 +10,88 @@ class Sex(str, Enum):
 class StorySchema(BaseModel):
     title: str = Field(..., description="The title of the story")
     description: str = Field(..., description="A brief description of the story")
-    content: str = Field(..., description="The content of the story")
+    # the fields are written in this order, so the narrator is known before
+    # the content when the answer is streamed to the speech synthesizer
     sex: Sex = Field(..., description="The sex of the main character.")
     keywords: list[str] = Field(
         default_factory=list,
         description="List of keywords associated with the story e.g., ['reddit', 'funny'] for Youtube shorts",
     )
+    content: str = Field(..., description="The content of the story")
+
+
+class RenderSchema(BaseModel):
+    max_segment_chars: int = Field(default=60, description="Characters per segment")
+    max_segment_duration: float = Field(default=2.8, description="Seconds per segment")
+    max_chars_per_line: int = Field(default=20, description="Characters per line")
+    y_pos_ratio: float = Field(default=0.5, description="Vertical caption position")
+    font_size_ratio: float = Field(default=0.06, description="Font size / video height")
+    backend: str = Field(
+        default="moviepy", description='"moviepy", "ass", "pipe" or "overlay"'
+    )
+
+
+class FormatSchema(BaseModel):
+    name: str = Field(..., description="Suffix of the output file, video_<name>.mp4")
+    width: int = Field(..., description="Width of the output")
+    height: int = Field(..., description="Height of the output")
+    fit: str = Field(default="crop", description='"crop" or "pad"')
+    fps: float | None = Field(
+        default=None, description="Frame rate, the background's if unset"
+    )
+    bitrate: str | None = Field(default=None, description='Video bitrate, e.g. "6M"')
+    y_pos_ratio: float | None = Field(
+        default=None, description="Vertical caption position, the render's if unset"
+    )
+    font_size_ratio: float | None = Field(
+        default=None, description="Font size / video height, the render's if unset"
+    )
+
+
+class DraftSchema(BaseModel):
+    scale: float = Field(default=1 / 3, description="Size relative to the final video")
+    fps: float = Field(default=12.0, description="Frame rate of the draft")
+    start: float = Field(default=0.0, description="Start of the rendered window")
+    end: float | None = Field(default=None, description="End of the rendered window")
+    sheet: bool = Field(
+        default=False, description="Render a contact sheet instead of a video"
+    )
+
+
+class JobSchema(BaseModel):
+    topic: str = Field(..., description="User prompt the story is generated from")
+    background_path: str = Field(..., description="Path to the background video")
+    id: str | None = Field(default=None, description="Name of the job output directory")
+    render: RenderSchema = Field(
+        default_factory=RenderSchema, description="Caption options of the render"
+    )
+    formats: list[FormatSchema] = Field(
+        default_factory=list,
+        description="Extra output formats, rendered with video.mp4 from one decode",
+    )
+
+    @model_validator(mode="after")
+    def _formats_use_their_own_renderer(self) -> "JobSchema":
+        # the formats are rendered from one decode, by none of the backends
+        if self.formats and self.render.backend != "moviepy":
+            raise ValueError(
+                f'render.backend "{self.render.backend}" does not apply to a job '
+                "with formats, which are all rendered from one decode; remove "
+                "the backend or the formats"
+            )
+        return self
+
+
+class AlignmentSchema(BaseModel):
+    characters: list[str] = Field(default_factory=list)
+    character_start_times_seconds: list[float] = Field(default_factory=list)
+    character_end_times_seconds: list[float] = Field(default_factory=list)
+
+    def extend(self, other) -> None:
+        """Append the characters and timings of another alignment.
+        Args:
+            other: Alignment object with the same fields, e.g. from ElevenLabs.
+        """
+        self.characters.extend(other.characters)
+        self.character_start_times_seconds.extend(other.character_start_times_seconds)
+        self.character_end_times_seconds.extend(other.character_end_times_seconds)
@@ -1,17 +1,31 @@
-from models.configs import PromptConfig
+import os
+from functools import lru_cache
+
+from models.configs import PromptConfig, get_config
+
+
+@lru_cache(maxsize=8)
+def _render_prompt(
+    template_path: str, mtime_ns: int, length: str, language: str
+) -> str:
+    with open(template_path, "r", encoding="utf-8") as file:
+        prompt_template = file.read()
+    return prompt_template.format(length=length, language=language)
 
 
 def load_story_prompt() -> str:
     """Load the prompt template from a file and format it with length and language.
+
+    The result is memoized per process and refreshed when the template file
+    or the configuration changes.
     Returns:
         str: The formatted prompt to generate a story as a string.
     """
-    prompt_config = PromptConfig()
+    prompt_config = get_config(PromptConfig)
     template_path = prompt_config.PROMPT_TEMPLATE_PATH
-    prompt_template = ""
-    with open(template_path, "r", encoding="utf-8") as file:
-        prompt_template = file.read()
-    prompt = prompt_template.format(
-        length=prompt_config.LENGTH_MINUTES, language=prompt_config.LANGUAGE
+    return _render_prompt(
+        template_path,
+        os.stat(template_path).st_mtime_ns,
+        prompt_config.LENGTH_MINUTES,
+        prompt_config.LANGUAGE,
     )
-    return prompt
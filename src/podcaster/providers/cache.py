@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+from array import array
+from dataclasses import dataclass
+
+from models.schemas import AlignmentSchema
+
+_SPEECH_MAGIC = b"PTTS"
+_SPEECH_VERSION = 1
+_HEADER = struct.Struct("<4sBQ")  # magic, version, audio length
+_COUNT = struct.Struct("<I")
+_NO_ALIGNMENT = 0xFFFFFFFF
+
+
+def content_key(*parts) -> str:
+    """Hash the given JSON-serializable parts into a cache key.
+    Args:
+        *parts: Values the cached content depends on.
+    Returns:
+        str: Hex SHA-256 digest of the parts.
+    """
+    payload = json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def pack_alignment(alignment) -> bytes:
+    """Serialize a character alignment into a compact binary block.
+
+    The block holds the character count, the UTF-8 length of each character,
+    the characters themselves and the start and end times as float32.
+    Args:
+        alignment: Alignment object with characters and timings, or None.
+    Returns:
+        bytes: The serialized alignment.
+    """
+    if alignment is None:
+        return _COUNT.pack(_NO_ALIGNMENT)
+    encoded = [ch.encode("utf-8") for ch in alignment.characters]
+    return b"".join(
+        (
+            _COUNT.pack(len(encoded)),
+            array("B", (len(ch) for ch in encoded)).tobytes(),
+            b"".join(encoded),
+            array("f", alignment.character_start_times_seconds).tobytes(),
+            array("f", alignment.character_end_times_seconds).tobytes(),
+        )
+    )
+
+
+def unpack_alignment(
+    data: bytes, offset: int = 0
+) -> tuple[AlignmentSchema | None, int]:
+    """Deserialize a block written by `pack_alignment`.
+    Args:
+        data (bytes): Buffer containing the block.
+        offset (int): Position of the block in the buffer.
+    Returns:
+        tuple[AlignmentSchema | None, int]: The alignment and the offset after
+        the block.
+    """
+    (count,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+    if count == _NO_ALIGNMENT:
+        return None, offset
+
+    lengths = array("B", data[offset : offset + count])
+    offset += count
+    characters = []
+    for length in lengths:
+        characters.append(data[offset : offset + length].decode("utf-8"))
+        offset += length
+
+    times = array("f", data[offset : offset + 8 * count])
+    offset += 8 * count
+    return (
+        AlignmentSchema(
+            characters=characters,
+            character_start_times_seconds=times[:count].tolist(),
+            character_end_times_seconds=times[count:].tolist(),
+        ),
+        offset,
+    )
+
+
+@dataclass
+class CachedSpeech:
+    """Speech audio and alignments stored in the cache."""
+
+    audio: bytes
+    alignment: AlignmentSchema | None
+    normalized_alignment: AlignmentSchema | None
+
+
+class SpeechCache:
+    """Content-addressed on-disk cache of synthesized speech.
+
+    Each entry is one file named by the hash of everything the audio depends on
+    (text, voice, model, speed). The least recently used entries are deleted
+    when the cache grows over `max_bytes`.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """Initialize the cache.
+        Args:
+            cache_dir (str): Directory of the cache entries.
+            max_bytes (int): Maximum total size of the entries in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._evict_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(text: str, voice_id: str, model_id: str, speed: float) -> str:
+        """Compute the cache key of a synthesis request.
+        Args:
+            text (str): Text to speak.
+            voice_id (str): Voice id.
+            model_id (str): Model id.
+            speed (float): Speech speed.
+        Returns:
+            str: The cache key.
+        """
+        return content_key("speech", text, voice_id, model_id, speed)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".tts")
+
+    def get(self, key: str) -> CachedSpeech | None:
+        """Load a cache entry.
+        Args:
+            key (str): The cache key.
+        Returns:
+            CachedSpeech | None: The entry or None if it is missing or unreadable.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            magic, version, audio_len = _HEADER.unpack_from(data)
+            if magic != _SPEECH_MAGIC or version != _SPEECH_VERSION:
+                return None
+            offset = _HEADER.size
+            audio = data[offset : offset + audio_len]
+            alignment, offset = unpack_alignment(data, offset + audio_len)
+            normalized_alignment, _ = unpack_alignment(data, offset)
+        except (OSError, struct.error, UnicodeDecodeError):
+            return None
+
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted since it was read
+        return CachedSpeech(audio, alignment, normalized_alignment)
+
+    def set(self, key: str, entry: CachedSpeech) -> None:
+        """Store a cache entry and evict old entries if over the size limit.
+        Args:
+            key (str): The cache key.
+            entry (CachedSpeech): The entry to store.
+        """
+        path = self._path(key)
+        # unique per writer, threads of one process may write the same key
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(_HEADER.pack(_SPEECH_MAGIC, _SPEECH_VERSION, len(entry.audio)))
+            file.write(entry.audio)
+            file.write(pack_alignment(entry.alignment))
+            file.write(pack_alignment(entry.normalized_alignment))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the cache fits in `max_bytes`."""
+        with self._evict_lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(".tts"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue  # evicted by another process
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+class StoryCache:
+    """Content-addressed on-disk cache of generated stories.
+
+    Each entry is the JSON of a generated answer, in a file named by the hash
+    of the model, the prompts and the output schema.
+    """
+
+    def __init__(self, cache_dir: str):
+        """Initialize the cache.
+        Args:
+            cache_dir (str): Directory of the cache entries.
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(model: str, system_prompt: str, user_prompt: str, schema: str) -> str:
+        """Compute the cache key of a generation request.
+        Args:
+            model (str): Model name.
+            system_prompt (str): System prompt.
+            user_prompt (str): User prompt.
+            schema (str): Name of the output schema.
+        Returns:
+            str: The cache key.
+        """
+        return content_key("story", model, system_prompt, user_prompt, schema)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key: str) -> str | None:
+        """Load a cache entry.
+        Args:
+            key (str): The cache key.
+        Returns:
+            str | None: The JSON of the answer or None if it is missing.
+        """
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def set(self, key: str, answer_json: str) -> None:
+        """Store a cache entry.
+        Args:
+            key (str): The cache key.
+            answer_json (str): The JSON of the answer.
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(answer_json)
+        os.replace(tmp_path, path)
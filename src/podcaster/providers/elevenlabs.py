@@ -1,40 +1,506 @@
-from elevenlabs import ElevenLabs, AudioWithTimestampsResponse
-from models.configs import TTSConfig
-from models.schemas import StorySchema, Sex
+import base64
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterable
+
+from core import metrics
+from core.audio import base64_chunks_to_mp3, concat_mp3, mp3_duration
+from models.configs import CacheConfig, TTSConfig, get_config
+from models.schemas import AlignmentSchema, StorySchema, Sex
+from providers.cache import CachedSpeech, SpeechCache, content_key
+from providers.session import get_session
+
+if TYPE_CHECKING:
+    from elevenlabs import (
+        AudioWithTimestampsResponse,
+        StreamingAudioChunkWithTimestampsResponse,
+    )
+
+
+def save_speech_stream(
+    stream: Iterable["StreamingAudioChunkWithTimestampsResponse"], output_file: str
+) -> tuple[AlignmentSchema, AlignmentSchema]:
+    """Write a stream of audio chunks to an MP3 file while collecting the alignment.
+    Args:
+        stream (Iterable[StreamingAudioChunkWithTimestampsResponse]): Chunks with
+            base64 audio and character alignment, e.g. from `stream_with_timestamps`.
+        output_file (str): The path to the output MP3 file.
+    Returns:
+        tuple[AlignmentSchema, AlignmentSchema]: The character alignment and the
+            normalized character alignment of the whole stream."""
+    alignment = AlignmentSchema()
+    normalized_alignment = AlignmentSchema()
+
+    def audio_chunks():
+        for chunk in stream:
+            if chunk.alignment is not None:
+                alignment.extend(chunk.alignment)
+            if chunk.normalized_alignment is not None:
+                normalized_alignment.extend(chunk.normalized_alignment)
+            yield chunk.audio_base_64
+
+    base64_chunks_to_mp3(audio_chunks(), output_file)
+    return alignment, normalized_alignment
+
+
+# the session retries failed requests for all clients at once
+_REQUEST_OPTIONS = {"max_retries": 0}
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+class SentenceChunker:
+    """Groups text arriving in pieces into chunks of whole sentences.
+
+    A chunk is complete once the sentence after it is known not to fit, so
+    chunks come out while the text is still being written, and the chunks of
+    a text are the same however it was cut into pieces."""
+
+    def __init__(self, max_chars: int, first_chars: int | None = None):
+        """Initialize the chunker.
+        Args:
+            max_chars (int): Maximum length of a chunk.
+            first_chars (int | None): Maximum length of the first chunk,
+                `max_chars` if None."""
+        self.max_chars = max_chars
+        self.first_chars = first_chars or max_chars
+        self._buffer = ""  # text after the last complete sentence
+        self._chunk = ""  # chunk being filled
+        self._count = 0  # chunks returned so far
+
+    def feed(self, text: str) -> list[str]:
+        """Add the next piece of text.
+        Args:
+            text (str): The piece.
+        Returns:
+            list[str]: The chunks it completed."""
+        self._buffer += text
+        chunks: list[str] = []
+        while True:
+            match = _SENTENCE_END.search(self._buffer)
+            if match is None:
+                break
+            self._add(self._buffer[: match.start()], chunks)
+            self._buffer = self._buffer[match.end() :]
+        return chunks
+
+    def close(self) -> list[str]:
+        """Complete the text.
+        Returns:
+            list[str]: The remaining chunks."""
+        chunks: list[str] = []
+        self._add(self._buffer, chunks)
+        self._buffer = ""
+        if self._chunk:
+            chunks.append(self._chunk)
+            self._chunk = ""
+        return chunks
+
+    def _add(self, sentence: str, chunks: list[str]) -> None:
+        """Add a complete sentence, splitting it between words if it is too long.
+        Args:
+            sentence (str): The sentence.
+            chunks (list[str]): Completed chunks are appended to it."""
+        sentence = sentence.strip()
+        while sentence:
+            piece = sentence
+            if len(piece) > self.max_chars:
+                cut = sentence.rfind(" ", 0, self.max_chars + 1)
+                if cut <= 0:
+                    cut = self.max_chars
+                piece = sentence[:cut].strip()
+            sentence = sentence[len(piece) :].strip()
+
+            limit = self.first_chars if self._count == 0 else self.max_chars
+            if self._chunk and len(self._chunk) + 1 + len(piece) <= limit:
+                self._chunk += " " + piece
+                continue
+            if self._chunk:
+                chunks.append(self._chunk)
+                self._count += 1
+            self._chunk = piece
+
+
+def split_text_into_chunks(text: str, max_chars: int) -> list[str]:
+    """Split text at sentence boundaries into chunks of at most max_chars.
+
+    Sentences longer than max_chars are split between words.
+    Args:
+        text (str): The text to split.
+        max_chars (int): Maximum length of a chunk.
+    Returns:
+        list[str]: The chunks, without the whitespace between them."""
+    chunker = SentenceChunker(max_chars)
+    return chunker.feed(text) + chunker.close()
+
+
+def merge_alignments(alignments: list, offsets: list[float]) -> AlignmentSchema | None:
+    """Merge per-chunk alignments into one alignment of the concatenated audio.
+
+    Times of each chunk are shifted by the start of its audio, and a space is
+    inserted between chunks so that words do not run together.
+    Args:
+        alignments (list): Alignment of each chunk.
+        offsets (list[float]): Start time of each chunk in the merged audio.
+    Returns:
+        AlignmentSchema | None: The merged alignment, None if any chunk has none."""
+    if any(alignment is None for alignment in alignments):
+        return None
+    merged = AlignmentSchema()
+    for i, (alignment, offset) in enumerate(zip(alignments, offsets)):
+        if i > 0:
+            merged.characters.append(" ")
+            merged.character_start_times_seconds.append(offset)
+            merged.character_end_times_seconds.append(offset)
+        merged.characters.extend(alignment.characters)
+        merged.character_start_times_seconds.extend(
+            t + offset for t in alignment.character_start_times_seconds
+        )
+        merged.character_end_times_seconds.extend(
+            t + offset for t in alignment.character_end_times_seconds
+        )
+    return merged
+
+
+def _dump(alignment: AlignmentSchema | None) -> dict | None:
+    return None if alignment is None else alignment.model_dump()
+
+
+def stitch_speech(parts: list) -> "AudioWithTimestampsResponse":
+    """Join the speech of consecutive chunks into one clip with one alignment.
+    Args:
+        parts (list): Speech of each chunk, in order.
+    Returns:
+        AudioWithTimestampsResponse: The joined speech."""
+    from elevenlabs import AudioWithTimestampsResponse
+
+    if len(parts) == 1:
+        return parts[0]
+    audios = [base64.b64decode(part.audio_base_64) for part in parts]
+    offsets = [0.0]
+    for audio in audios[:-1]:
+        offsets.append(offsets[-1] + mp3_duration(audio))
+
+    return AudioWithTimestampsResponse(
+        audio_base64=base64.b64encode(concat_mp3(audios)).decode("ascii"),
+        alignment=_dump(merge_alignments([part.alignment for part in parts], offsets)),
+        normalized_alignment=_dump(
+            merge_alignments([part.normalized_alignment for part in parts], offsets)
+        ),
+    )
 
 
 class SpeechSynthesizer:
-    def __init__(self):
-        tts_config = TTSConfig()
-        self.client = ElevenLabs(api_key=tts_config.API_KEY)
+    def __init__(self, use_cache: bool | None = None, client=None):
+        """Initialize the synthesizer.
+        Args:
+            use_cache (bool | None): Whether to reuse audio of identical requests
+                from the local cache, `CACHE_TTS_ENABLED` if None.
+            client: ElevenLabs client to use instead of one for the configured
+                API, e.g. a fake for tests.
+        """
+        # the SDK takes a while to import, so only synthesizers pay for it
+        from elevenlabs import ElevenLabs
+
+        tts_config = get_config(TTSConfig)
+        self.session = get_session(
+            "elevenlabs",
+            max_connections=tts_config.MAX_CONNECTIONS,
+            requests_per_minute=tts_config.REQUESTS_PER_MINUTE,
+            characters_per_minute=tts_config.CHARACTERS_PER_MINUTE,
+            retries=tts_config.RATE_LIMIT_RETRIES,
+            timeout=tts_config.TIMEOUT,
+        )
+        self.client = client or ElevenLabs(
+            api_key=tts_config.API_KEY,
+            httpx_client=self.session.client,
+            base_url=tts_config.BASE_URL,
+        )
         self.model_id = tts_config.MODEL_ID
         self.female_voice_id = tts_config.FEMALE_VOICE_ID
         self.male_voice_id = tts_config.MALE_VOICE_ID
         self.speed = tts_config.SPEED
+        self.chunk_chars = tts_config.CHUNK_CHARS
+        self.chunk_parallelism = tts_config.CHUNK_PARALLELISM
+        self.stream_first_chunk_chars = tts_config.STREAM_FIRST_CHUNK_CHARS
+        self.stream_chunk_chars = tts_config.STREAM_CHUNK_CHARS
+        # speech of whole texts streamed earlier, for when the disk cache is off
+        self._streamed: dict[str, "AudioWithTimestampsResponse"] = {}
+
+        cache_config = get_config(CacheConfig)
+        if use_cache is None:
+            use_cache = cache_config.TTS_ENABLED
+        self.cache = (
+            SpeechCache(
+                os.path.join(cache_config.DIR, "tts"), cache_config.TTS_MAX_BYTES
+            )
+            if use_cache
+            else None
+        )
+
+    def settings_key(self) -> str:
+        """Key identifying the voices and settings the speech depends on.
+        Returns:
+            str: The key."""
+        return content_key(
+            self.model_id, self.male_voice_id, self.female_voice_id, self.speed
+        )
+
+    def _voice_and_text(
+        self, story_schema: StorySchema | None, text: str
+    ) -> tuple[str, str]:
+        """Pick the voice and the text to speak.
+        Args:
+            story_schema (StorySchema | None): The story data, if any.
+            text (str): Text used when no story is given.
+        Returns:
+            tuple[str, str]: The voice id and the text to speak."""
+        if story_schema is None:
+            return self.female_voice_id, text
+        return self.voice_id(story_schema.sex), story_schema.content
+
+    def _convert(self, text: str, voice_id: str) -> "AudioWithTimestampsResponse":
+        """Synthesize a single request, answering from the cache when possible.
+        Args:
+            text (str): Text to speak.
+            voice_id (str): Voice id.
+        Returns:
+            AudioWithTimestampsResponse: The speech audio with timestamps."""
+        key = SpeechCache.key(text, voice_id, self.model_id, self.speed)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        self.session.characters.acquire(len(text))
+        with metrics.span("elevenlabs_call", chars=len(text)):
+            audio = self.client.text_to_speech.convert_with_timestamps(
+                text=text,
+                voice_id=voice_id,
+                model_id=self.model_id,
+                voice_settings={"speed": self.speed},
+                request_options=_REQUEST_OPTIONS,
+            )
+        metrics.count("tts_chars", len(text))
+
+        if self.cache is not None:
+            self.cache.set(
+                key,
+                CachedSpeech(
+                    base64.b64decode(audio.audio_base_64),
+                    audio.alignment,
+                    audio.normalized_alignment,
+                ),
+            )
+        return audio
+
+    def _cached(self, key: str) -> "AudioWithTimestampsResponse | None":
+        """Look up speech in the streamed speech and the cache.
+        Args:
+            key (str): Key of the text, voice and settings.
+        Returns:
+            AudioWithTimestampsResponse | None: The speech, None if unknown."""
+        from elevenlabs import AudioWithTimestampsResponse
+
+        streamed = self._streamed.pop(key, None)
+        if streamed is not None:
+            return streamed
+        if self.cache is None:
+            return None
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        metrics.count("tts_cache_hits")
+        return AudioWithTimestampsResponse(
+            audio_base64=base64.b64encode(cached.audio).decode("ascii"),
+            alignment=_dump(cached.alignment),
+            normalized_alignment=_dump(cached.normalized_alignment),
+        )
+
+    def _remember(
+        self, text: str, voice_id: str, audio: "AudioWithTimestampsResponse"
+    ) -> None:
+        """Keep the speech of a whole text for the next request of that text.
+        Args:
+            text (str): The text.
+            voice_id (str): Voice id.
+            audio (AudioWithTimestampsResponse): Its speech."""
+        key = SpeechCache.key(text, voice_id, self.model_id, self.speed)
+        if self.cache is None:
+            self._streamed[key] = audio
+            return
+        self.cache.set(
+            key,
+            CachedSpeech(
+                base64.b64decode(audio.audio_base_64),
+                audio.alignment,
+                audio.normalized_alignment,
+            ),
+        )
+
+    def streaming(self) -> "StreamingSpeech":
+        """Start the speech of a text that is still being written.
+        Returns:
+            StreamingSpeech: The speech to feed the text to."""
+        return StreamingSpeech(self)
+
+    def voice_id(self, sex: Sex) -> str:
+        """Voice of a narrator.
+        Args:
+            sex (Sex): Sex of the main character.
+        Returns:
+            str: The voice id."""
+        return self.male_voice_id if sex == Sex.MALE else self.female_voice_id
 
     def generate_speech(
         self, story_schema: StorySchema | None = None, text: str = ""
-    ) -> AudioWithTimestampsResponse:
+    ) -> "AudioWithTimestampsResponse":
         """Generate speech audio from the story content using ElevenLabs Text to Speech.
+
+        Long texts are split at sentence boundaries into chunks that are
+        synthesized in parallel and retried independently, then stitched into
+        one audio clip with one alignment. Speech streamed for the same text
+        by `StreamingSpeech` is returned as is.
         Args:
-            story_schema (StorySchema): The story data containing content and main character sex.
+            story_schema (StorySchema): The story data containing content and
+                main character sex.
         Returns:
             AudioWithTimestampsResponse: The generated speech audio with timestamps."""
-        if story_schema is None:
-            voice_id = self.female_voice_id
-            text_to_speak = text
-        else:
-            voice_id = (
-                self.male_voice_id
-                if story_schema.sex == Sex.MALE
-                else self.female_voice_id
+        voice_id, text_to_speak = self._voice_and_text(story_schema, text)
+
+        chunks = split_text_into_chunks(text_to_speak, self.chunk_chars)
+        if len(chunks) <= 1:
+            return self._convert(text_to_speak, voice_id)
+        cached = self._cached(
+            SpeechCache.key(text_to_speak, voice_id, self.model_id, self.speed)
+        )
+        if cached is not None:
+            return cached
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.chunk_parallelism, len(chunks))
+        ) as pool:
+            parts = list(pool.map(lambda chunk: self._convert(chunk, voice_id), chunks))
+        return stitch_speech(parts)
+
+    def stream_speech(
+        self,
+        output_file: str,
+        story_schema: StorySchema | None = None,
+        text: str = "",
+    ) -> AlignmentSchema:
+        """Stream speech audio straight to an MP3 file using ElevenLabs Text to Speech.
+
+        Audio is decoded and written chunk by chunk as it arrives, so the whole
+        clip is never held in memory.
+        Args:
+            output_file (str): The path to the output MP3 file.
+            story_schema (StorySchema): The story data containing content and
+                main character sex.
+            text (str): Text used when no story is given.
+        Returns:
+            AlignmentSchema: The normalized character alignment of the speech."""
+        voice_id, text_to_speak = self._voice_and_text(story_schema, text)
+        key = SpeechCache.key(text_to_speak, voice_id, self.model_id, self.speed)
+
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None and cached.normalized_alignment is not None:
+                metrics.count("tts_cache_hits")
+                with open(output_file, "wb") as file:
+                    file.write(cached.audio)
+                return cached.normalized_alignment
+
+        self.session.characters.acquire(len(text_to_speak))
+        with metrics.span("elevenlabs_stream", chars=len(text_to_speak)):
+            stream = self.client.text_to_speech.stream_with_timestamps(
+                text=text_to_speak,
+                voice_id=voice_id,
+                model_id=self.model_id,
+                voice_settings={"speed": self.speed},
+                request_options=_REQUEST_OPTIONS,
             )
-            text_to_speak = story_schema.content
+            alignment, normalized_alignment = save_speech_stream(stream, output_file)
+        metrics.count("tts_chars", len(text_to_speak))
+
+        if self.cache is not None:
+            with open(output_file, "rb") as file:
+                audio = file.read()
+            self.cache.set(key, CachedSpeech(audio, alignment, normalized_alignment))
+        return normalized_alignment
+
+
+class StreamingSpeech:
+    """Speech of a text that arrives in pieces, synthesized chunk by chunk.
 
-        audio = self.client.text_to_speech.convert_with_timestamps(
-            text=text_to_speak,
-            voice_id=voice_id,
-            model_id=self.model_id,
-            voice_settings={"speed": self.speed},
+    Complete sentences are grouped into chunks, a short first one so that
+    audio starts early, and every chunk is synthesized in the background as
+    soon as it is complete and the voice is known."""
+
+    def __init__(self, synthesizer: SpeechSynthesizer):
+        """Initialize the speech.
+        Args:
+            synthesizer (SpeechSynthesizer): The synthesizer of the chunks."""
+        self.synthesizer = synthesizer
+        self.voice: str | None = None
+        self.first_audio_at: float | None = None  # perf_counter of the first audio
+        self._chunker = SentenceChunker(
+            synthesizer.stream_chunk_chars, synthesizer.stream_first_chunk_chars
         )
+        self._pending: list[str] = []  # chunks waiting for the voice
+        self._futures: list = []
+        self._pool = ThreadPoolExecutor(max_workers=synthesizer.chunk_parallelism)
+
+    def set_voice(self, sex: Sex) -> None:
+        """Pick the voice from the narrator and start the waiting chunks.
+        Args:
+            sex (Sex): Sex of the main character."""
+        if self.voice is not None:
+            return
+        self.voice = self.synthesizer.voice_id(sex)
+        pending, self._pending = self._pending, []
+        for chunk in pending:
+            self._submit(chunk)
+
+    def feed(self, text: str) -> None:
+        """Add the next piece of the text.
+        Args:
+            text (str): The piece."""
+        for chunk in self._chunker.feed(text):
+            self._submit(chunk)
+
+    def close(self, text: str) -> "AudioWithTimestampsResponse":
+        """Complete the text and wait for its speech.
+        Args:
+            text (str): The whole text, the speech is kept under it for
+                `SpeechSynthesizer.generate_speech`.
+        Returns:
+            AudioWithTimestampsResponse: The speech of the whole text."""
+        if self.voice is None:
+            raise ValueError("The voice of the speech is not set")
+        for chunk in self._chunker.close():
+            self._submit(chunk)
+        try:
+            parts = [future.result() for future in self._futures]
+        finally:
+            self._pool.shutdown()
+        audio = stitch_speech(parts)
+        self.synthesizer._remember(text, self.voice, audio)
         return audio
+
+    def cancel(self) -> None:
+        """Stop the chunks that did not start yet."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, chunk: str) -> None:
+        if self.voice is None:
+            self._pending.append(chunk)
+            return
+        future = self._pool.submit(self.synthesizer._convert, chunk, self.voice)
+        if not self._futures:
+            future.add_done_callback(self._first_audio)
+        self._futures.append(future)
+
+    def _first_audio(self, future) -> None:
+        self.first_audio_at = time.perf_counter()
@@ -1,10 +1,49 @@
-from langchain_openai import ChatOpenAI
-from models.configs import LLMConfig
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import PydanticOutputParser
-from langchain_core.utils.pydantic import TBaseModel
-from pydantic import SkipValidation
-from typing import Annotated
+import os
+from functools import lru_cache
+from typing import TYPE_CHECKING, Annotated, Callable
+
+from pydantic import SkipValidation, ValidationError
+
+from core import metrics
+from models.configs import CacheConfig, LLMConfig, get_config
+from providers.cache import StoryCache
+from providers.session import ProviderSession, get_session
+
+if TYPE_CHECKING:
+    from langchain_core.utils.pydantic import TBaseModel
+    from langchain_core.language_models import BaseChatModel
+    from langchain_openai import ChatOpenAI
+
+    from providers.streaming import FieldEvent
+
+# langchain takes over a second to import, so it is only imported when a
+# StoryTeller is created
+
+
+@lru_cache(maxsize=None)
+def _chat_model(
+    model: str, api_key: str, base_url: str | None, session: ProviderSession
+) -> "ChatOpenAI":
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model=model,
+        api_key=api_key,
+        base_url=base_url,
+        use_responses_api=True,
+        http_client=session.client,
+        # the session retries failed requests for all clients at once
+        max_retries=0,
+    )
+
+
+@lru_cache(maxsize=None)
+def _format_instructions(pydantic_object: type) -> str:
+    from langchain_core.output_parsers import PydanticOutputParser
+
+    return PydanticOutputParser(
+        pydantic_object=pydantic_object
+    ).get_format_instructions()
 
 
 class StoryTeller:
@@ -12,39 +51,138 @@ class StoryTeller:
 
     def __init__(
         self,
-        pydantic_object: Annotated[type[TBaseModel], SkipValidation()],
+        pydantic_object: Annotated[type["TBaseModel"], SkipValidation()],
         system_prompt: str = "",
         tools: list | None = None,
+        use_cache: bool | None = None,
+        model: "BaseChatModel | None" = None,
     ):
         """Initialize the StoryTeller with a Pydantic model and system prompt.
         Args:
             pydantic_object (Annotated[type[TBaseModel], SkipValidation()]): The Pydantic model for output parsing.
             system_prompt (str): The system prompt to guide the language model.
             tools (list | None): A list of tools to bind to the model.
+            use_cache (bool | None): Whether to reuse answers to identical prompts
+                from the local cache, `CACHE_STORY_ENABLED` if None.
+            model (BaseChatModel | None): Chat model to use instead of the
+                configured one, e.g. a fake for tests.
         """
-        llm_config = LLMConfig()
-        self.model = ChatOpenAI(
-            model=llm_config.MODEL, api_key=llm_config.API_KEY, use_responses_api=True
-        )
+        from langchain_core.output_parsers import PydanticOutputParser
+        from langchain_core.prompts import PromptTemplate
+
+        self.system_prompt = system_prompt
+        self.pydantic_object = pydantic_object
+        if model is not None:
+            self.model_name = type(model).__name__
+            self.model = model
+        else:
+            llm_config = get_config(LLMConfig)
+            self.model_name = llm_config.MODEL
+            session = get_session(
+                "openai",
+                max_connections=llm_config.MAX_CONNECTIONS,
+                requests_per_minute=llm_config.REQUESTS_PER_MINUTE,
+                retries=llm_config.RATE_LIMIT_RETRIES,
+                timeout=llm_config.TIMEOUT,
+            )
+            self.model = _chat_model(
+                llm_config.MODEL, llm_config.API_KEY, llm_config.BASE_URL, session
+            )
         self.output_parser = PydanticOutputParser(pydantic_object=pydantic_object)
         self.prompt_template = PromptTemplate(
             template=system_prompt + "\n{user_prompt}\n{format_instructions}",
             input_variables=["user_prompt"],
             partial_variables={
-                "format_instructions": self.output_parser.get_format_instructions()
+                "format_instructions": _format_instructions(pydantic_object)
             },
         )
         if tools is not None:
             self.model = self.model.bind_tools(tools)
         self.chain = self.prompt_template | self.model | self.output_parser
 
+        cache_config = get_config(CacheConfig)
+        if use_cache is None:
+            use_cache = cache_config.STORY_ENABLED
+        self.cache = (
+            StoryCache(os.path.join(cache_config.DIR, "stories")) if use_cache else None
+        )
+
+    def answer_key(self, prompt: str) -> str:
+        """Key identifying the answer to a prompt with this model and system prompt.
+        Args:
+            prompt (str): The user prompt.
+        Returns:
+            str: The key."""
+        return StoryCache.key(
+            self.model_name, self.system_prompt, prompt, self.pydantic_object.__name__
+        )
+
+    def cached_answer(
+        self, prompt: str
+    ) -> Annotated[type["TBaseModel"], SkipValidation()] | None:
+        """Look up the answer to a prompt in the cache.
+        Args:
+            prompt (str): The user prompt.
+        Returns:
+            Annotated[type[TBaseModel], SkipValidation()] | None: The cached
+            answer, None if unknown."""
+        if self.cache is None:
+            return None
+        cached = self.cache.get(self.answer_key(prompt))
+        if cached is None:
+            return None
+        try:
+            answer = self.pydantic_object.model_validate_json(cached)
+        except ValidationError:
+            return None  # schema changed since the answer was cached
+        metrics.count("story_cache_hits")
+        return answer
+
     def generate_answer(
         self, prompt: str
-    ) -> Annotated[type[TBaseModel], SkipValidation()]:
+    ) -> Annotated[type["TBaseModel"], SkipValidation()]:
         """Generate a answer based on the provided user prompt.
         Args:
             prompt (str): The user prompt to generate the answer for.
         Returns:
                 Annotated[type[TBaseModel], SkipValidation()]: The generated answer as a Pydantic model instance."""
-        result = self.chain.invoke({"user_prompt": prompt})
+        cached = self.cached_answer(prompt)
+        if cached is not None:
+            return cached
+
+        with metrics.span("openai_call", model=self.model_name):
+            result = self.chain.invoke({"user_prompt": prompt})
+
+        if self.cache is not None:
+            self.cache.set(self.answer_key(prompt), result.model_dump_json())
+        return result
+
+    def stream_answer(
+        self, prompt: str, on_event: Callable[["FieldEvent"], None]
+    ) -> Annotated[type["TBaseModel"], SkipValidation()]:
+        """Generate an answer, reporting its fields while the model writes them.
+        Args:
+            prompt (str): The user prompt to generate the answer for.
+            on_event (Callable[[FieldEvent], None]): Called with every piece of
+                a field as soon as it is parsed, in the order of the answer.
+        Returns:
+            Annotated[type[TBaseModel], SkipValidation()]: The whole answer,
+            also stored in the cache."""
+        from providers.streaming import StoryStreamParser
+
+        parser = StoryStreamParser()
+        text = []
+        with metrics.span("openai_stream", model=self.model_name):
+            for chunk in (self.prompt_template | self.model).stream(
+                {"user_prompt": prompt}
+            ):
+                piece = str(chunk.text)
+                text.append(piece)
+                if not parser.done:
+                    for event in parser.feed(piece):
+                        on_event(event)
+        result = self.output_parser.parse("".join(text))
+
+        if self.cache is not None:
+            self.cache.set(self.answer_key(prompt), result.model_dump_json())
         return result
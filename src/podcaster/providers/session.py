@@ -0,0 +1,213 @@
+import email.utils
+import random
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+
+import httpx
+
+from core import metrics
+
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+# failures of a request that may not happen again
+RETRY_ERRORS = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+MAX_RETRY_DELAY = 60.0
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at a rate per minute.
+
+    A caller waits until the bucket holds its tokens, or `burst` tokens for
+    larger requests, then takes them all, letting the balance go negative so
+    the next callers wait for the debt. With the default burst of one token,
+    requests are evenly spaced and never exceed the rate over any window, as
+    providers enforce per-minute limits over shorter periods. `pause` makes
+    every caller wait, e.g. after the provider answered 429.
+    """
+
+    def __init__(self, per_minute: float, burst: float = 1.0):
+        """Initialize the bucket, full.
+        Args:
+            per_minute (float): Tokens added per minute, 0 or less for no limit.
+            burst (float): Tokens that can accumulate while the bucket is idle.
+        """
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Take tokens from the bucket, waiting until they are available.
+        Args:
+            amount (float): Number of tokens.
+        Returns:
+            float: Seconds spent waiting."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self.rate > 0:
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                needed = min(amount, self.burst)
+                if self._tokens < needed:
+                    wait = max(wait, (needed - self._tokens) / self.rate)
+                self._tokens -= amount
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for the given time.
+        Args:
+            seconds (float): Time from now during which `acquire` waits."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def retry_delay(response: httpx.Response | None, attempt: int) -> float:
+    """Time to wait before retrying a failed request.
+
+    Uses the `retry-after-ms` or `retry-after` header when the provider sent
+    one, else exponential backoff with jitter.
+    Args:
+        response (httpx.Response | None): The failed response, None if the
+            request got none.
+        attempt (int): Number of the failed attempt, from 0.
+    Returns:
+        float: Delay in seconds, at most `MAX_RETRY_DELAY`."""
+    headers = response.headers if response is not None else {}
+    try:
+        if "retry-after-ms" in headers:
+            return min(float(headers["retry-after-ms"]) / 1000, MAX_RETRY_DELAY)
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                seconds = float(value)
+            except ValueError:
+                seconds = email.utils.parsedate_to_datetime(value).timestamp()
+                seconds -= time.time()
+            return min(max(seconds, 0.0), MAX_RETRY_DELAY)
+    except (TypeError, ValueError):
+        pass  # malformed header
+    return min(2**attempt * (0.5 + random.random() / 2), MAX_RETRY_DELAY)
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """Transport rate-limiting every attempt of a request and retrying failures.
+
+    Each attempt first takes a request token. Throttled and failed responses
+    (`RETRY_STATUSES`), and connection errors or timeouts before the response
+    arrives, are retried here only, so the clients on top must not retry them
+    again. A 429 pauses the shared request bucket, so every thread using the
+    provider backs off instead of only the one that was throttled.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.BaseTransport,
+        provider: str,
+        requests: TokenBucket,
+        retries: int,
+    ):
+        """Initialize the transport.
+        Args:
+            transport (httpx.BaseTransport): The transport sending the requests.
+            provider (str): Provider name, used as metrics label.
+            requests (TokenBucket): Bucket of requests per minute.
+            retries (int): Maximum number of retries of a request.
+        """
+        self.transport = transport
+        self.provider = provider
+        self.requests = requests
+        self.retries = retries
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            waited = self.requests.acquire()
+            if waited:
+                metrics.count("rate_limit_wait_seconds", waited, provider=self.provider)
+            try:
+                response = self.transport.handle_request(request)
+            except RETRY_ERRORS as e:
+                if attempt >= self.retries:
+                    raise
+                metrics.count(
+                    "provider_retries", provider=self.provider, error=type(e).__name__
+                )
+                time.sleep(retry_delay(None, attempt))
+                attempt += 1
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                return response
+            delay = retry_delay(response, attempt)
+            # read the error body so that the connection goes back to the pool
+            response.read()
+            response.close()
+            metrics.count(
+                "provider_retries", provider=self.provider, status=response.status_code
+            )
+            if response.status_code == 429:
+                self.requests.pause(delay)
+            else:
+                time.sleep(delay)
+            attempt += 1
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+@dataclass(frozen=True)
+class ProviderSession:
+    """Connection pool and rate limits shared by all clients of one provider."""
+
+    provider: str
+    client: httpx.Client
+    requests: TokenBucket
+    characters: TokenBucket
+
+
+@lru_cache(maxsize=None)
+def get_session(
+    provider: str,
+    max_connections: int = 10,
+    requests_per_minute: float = 0,
+    characters_per_minute: float = 0,
+    retries: int = 5,
+    timeout: float = 120.0,
+) -> ProviderSession:
+    """Return the session of a provider shared by the whole process.
+
+    Clients built on the same session reuse its keep-alive connections and
+    share its limits, so many jobs do not each pay for TLS handshakes or
+    exceed the provider's rate limits together.
+    Args:
+        provider (str): Provider name, used as metrics label.
+        max_connections (int): Size of the connection pool.
+        requests_per_minute (float): Request rate limit, 0 for none.
+        characters_per_minute (float): Character rate limit, 0 for none.
+        retries (int): Retries of throttled or failed requests.
+        timeout (float): Request timeout in seconds.
+    Returns:
+        ProviderSession: The session."""
+    requests = TokenBucket(requests_per_minute)
+    limits = httpx.Limits(
+        max_connections=max_connections, max_keepalive_connections=max_connections
+    )
+    transport = RateLimitedTransport(
+        httpx.HTTPTransport(limits=limits),
+        provider,
+        requests,
+        retries,
+    )
+    return ProviderSession(
+        provider=provider,
+        client=httpx.Client(transport=transport, timeout=timeout),
+        requests=requests,
+        characters=TokenBucket(characters_per_minute),
+    )
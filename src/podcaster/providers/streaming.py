@@ -0,0 +1,256 @@
+import json
+import time
+from typing import TYPE_CHECKING, List, NamedTuple
+
+from core import metrics
+from models.schemas import Sex, StorySchema
+
+if TYPE_CHECKING:
+    from elevenlabs import AudioWithTimestampsResponse
+
+    from providers.elevenlabs import SpeechSynthesizer
+    from providers.openai import StoryTeller
+
+_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class FieldEvent(NamedTuple):
+    """Progress of a top-level field of a streamed JSON answer.
+
+    String fields produce events with `done` False for every decoded piece of
+    text, then one with `done` True and the whole string. Other fields only
+    produce the final event, with the decoded value."""
+
+    field: str
+    value: object
+    done: bool
+
+
+class StoryStreamParser:
+    """Incremental parser of the JSON object of a structured answer.
+
+    Text before the opening brace, such as a markdown code fence, is skipped.
+    Strings at the top level are decoded as they arrive, so a long field can
+    be consumed before the answer is complete; nested values are decoded when
+    they end."""
+
+    def __init__(self):
+        self._state = "start"
+        self._key = ""
+        self._raw: List[str] = []  # key, scalar or nested value being read
+        self._text: List[str] = []  # decoded top-level string
+        self._escape = False
+        self._unicode = ""  # hex digits of a \u escape being read
+        self._surrogate: int | None = None  # high half of a surrogate pair
+        self._depth = 0  # nesting of a nested value
+        self._in_string = False  # inside a string of a nested value
+
+    @property
+    def done(self) -> bool:
+        """bool: Whether the closing brace of the object was read."""
+        return self._state == "done"
+
+    def feed(self, text: str) -> List[FieldEvent]:
+        """Parse the next piece of the answer.
+        Args:
+            text (str): The piece, of any length.
+        Returns:
+            List[FieldEvent]: Events of the fields the piece advanced.
+        Raises:
+            ValueError: If the answer is not a JSON object."""
+        events: List[FieldEvent] = []
+        piece: List[str] = []  # decoded text of the current string in this piece
+        for ch in text:
+            state = self._state
+            if state == "string":
+                decoded = self._string_char(ch)
+                if decoded is None:  # closing quote
+                    if piece:
+                        events.append(FieldEvent(self._key, "".join(piece), False))
+                        piece = []
+                    events.append(FieldEvent(self._key, "".join(self._text), True))
+                    self._state = "after_value"
+                elif decoded:
+                    piece.append(decoded)
+                    self._text.append(decoded)
+            elif state == "start":
+                if ch == "{":
+                    self._state = "key_or_end"
+            elif state == "key_or_end":
+                if ch == '"':
+                    self._raw = []
+                    self._state = "key"
+                elif ch == "}":
+                    self._state = "done"
+                elif not ch.isspace() and ch != ",":
+                    raise ValueError(f"Unexpected {ch!r} before a key")
+            elif state == "key":
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._key = json.loads('"' + "".join(self._raw) + '"')
+                    self._state = "colon"
+                    continue
+                self._raw.append(ch)
+            elif state == "colon":
+                if ch == ":":
+                    self._state = "value"
+                elif not ch.isspace():
+                    raise ValueError(f"Unexpected {ch!r} after a key")
+            elif state == "value":
+                if ch == '"':
+                    self._text = []
+                    self._state = "string"
+                elif not ch.isspace():
+                    self._raw = [ch]
+                    self._depth = 1 if ch in "[{" else 0
+                    self._in_string = False
+                    self._state = "raw"
+            elif state == "raw":
+                end = self._raw_char(ch)
+                if end:
+                    events.append(
+                        FieldEvent(self._key, json.loads("".join(self._raw)), True)
+                    )
+                    self._state = "after_value"
+                    if end == "after":  # the character follows the value
+                        if ch == ",":
+                            self._state = "key_or_end"
+                        elif ch == "}":
+                            self._state = "done"
+            elif state == "after_value":
+                if ch == ",":
+                    self._state = "key_or_end"
+                elif ch == "}":
+                    self._state = "done"
+                elif not ch.isspace():
+                    raise ValueError(f"Unexpected {ch!r} after a value")
+            # text after the closing brace is ignored
+        if piece:
+            events.append(FieldEvent(self._key, "".join(piece), False))
+        return events
+
+    def _string_char(self, ch: str) -> str | None:
+        """Decode a character of a top-level string.
+        Args:
+            ch (str): The character.
+        Returns:
+            str | None: The decoded text, empty inside an escape, None at the
+            closing quote."""
+        if self._unicode:
+            self._unicode += ch
+            if len(self._unicode) < 5:  # "u" and four hex digits
+                return ""
+            code = int(self._unicode[1:], 16)
+            self._unicode = ""
+            if 0xD800 <= code < 0xDC00:  # high surrogate, wait for the low one
+                self._surrogate = code
+                return ""
+            if 0xDC00 <= code < 0xE000 and self._surrogate is not None:
+                code = 0x10000 + ((self._surrogate - 0xD800) << 10) + code - 0xDC00
+                self._surrogate = None
+            return chr(code)
+        if self._escape:
+            self._escape = False
+            if ch == "u":
+                self._unicode = "u"
+                return ""
+            return _ESCAPES.get(ch, ch)
+        if ch == "\\":
+            self._escape = True
+            return ""
+        if ch == '"':
+            return None
+        return ch
+
+    def _raw_char(self, ch: str) -> str | None:
+        """Add a character to a nested or scalar value.
+        Args:
+            ch (str): The character.
+        Returns:
+            str | None: None inside the value, "last" if the character ends
+            it, "after" if it follows a scalar, which ends at the next comma,
+            brace or whitespace."""
+        if self._in_string:
+            self._raw.append(ch)
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+            return None
+        if self._depth == 0:  # number, true, false or null
+            if ch in ",}" or ch.isspace():
+                return "after"
+            self._raw.append(ch)
+            return None
+        self._raw.append(ch)
+        if ch == '"':
+            self._in_string = True
+        elif ch in "[{":
+            self._depth += 1
+        elif ch in "]}":
+            self._depth -= 1
+            if self._depth == 0:
+                return "last"
+        return None
+
+
+def stream_story_speech(
+    story_teller: "StoryTeller",
+    speech_synthesizer: "SpeechSynthesizer",
+    prompt: str,
+) -> tuple[StorySchema, "AudioWithTimestampsResponse | None"]:
+    """Generate a story and its speech, speaking sentences while the story is written.
+
+    The answer is parsed as the model streams it. Complete sentences of the
+    content go to the speech synthesizer as soon as the voice is known from
+    the `sex` field, so the speech of the first sentences is done before the
+    story ends and the whole takes about as long as the slower of the two.
+    The speech is kept by the synthesizer, so that `generate_speech` on the
+    returned story answers without calling the provider again.
+    Args:
+        story_teller (StoryTeller): The story generator.
+        speech_synthesizer (SpeechSynthesizer): The speech synthesizer.
+        prompt (str): The user prompt.
+    Returns:
+        tuple[StorySchema, AudioWithTimestampsResponse | None]: The story and
+        its speech, no speech if the story came from the cache."""
+    cached = story_teller.cached_answer(prompt)
+    if cached is not None:
+        return cached, None
+
+    speech = speech_synthesizer.streaming()
+    start = time.perf_counter()
+
+    def on_event(event: FieldEvent) -> None:
+        if event.field == "content" and not event.done:
+            speech.feed(event.value)
+        elif event.field == "sex" and event.done:
+            speech.set_voice(Sex(event.value))
+
+    with metrics.span("story_speech_stream"):
+        try:
+            answer = story_teller.stream_answer(prompt, on_event)
+        except BaseException:
+            speech.cancel()
+            raise
+        metrics.count("story_stream_seconds", time.perf_counter() - start)
+        if speech.voice is None:
+            speech.set_voice(answer.sex)  # the model wrote the sex after the content
+        audio = speech.close(answer.content)
+    if speech.first_audio_at is not None:
+        metrics.count("time_to_first_audio_seconds", speech.first_audio_at - start)
+    return answer, audio
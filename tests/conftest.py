@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "podcaster"))
+
+
+@pytest.fixture(scope="session")
+def media_dir(tmp_path_factory):
+    """Short background video and silent narration, generated once."""
+    from core.ffmpeg import run_ffmpeg
+
+    path = tmp_path_factory.mktemp("media")
+    run_ffmpeg(
+        [
+            "-f", "lavfi", "-i", "testsrc2=size=360x640:rate=30:duration=2",
+            "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+            str(path / "background.mp4"),
+        ]
+    )  # fmt: skip
+    run_ffmpeg(
+        [
+            "-f", "lavfi", "-i", "anullsrc=r=44100:cl=mono",
+            "-t", "3", "-c:a", "libmp3lame", "-b:a", "64k",
+            str(path / "speech.mp3"),
+        ]
+    )  # fmt: skip
+    return path
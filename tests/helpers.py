@@ -0,0 +1,39 @@
+"""Synthetic inputs shared by the tests."""
+
+import random
+from typing import List
+
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+WORDS = (
+    "the a my story when then after night office coworker sister manager coffee "
+    "phone message secret never suddenly finally told asked laughed, noticed. "
+    "everything! somebody? again. anyway, unbelievable. honestly"
+).split()
+
+
+def make_alignment(n_chars: int, seed: int = 0, words=WORDS):
+    """Character alignment of roughly `n_chars` characters of random words."""
+    from models.schemas import AlignmentSchema
+
+    rng = random.Random(seed)
+    characters: List[str] = []
+    starts: List[float] = []
+    ends: List[float] = []
+    t = 0.0
+    while len(characters) < n_chars:
+        if characters:
+            characters.append(" ")
+            starts.append(t)
+            t += rng.uniform(0.03, 0.15)
+            ends.append(t)
+        for ch in rng.choice(words):
+            characters.append(ch)
+            starts.append(t)
+            t += rng.uniform(0.05, 0.09)
+            ends.append(t)
+    return AlignmentSchema(
+        characters=characters[:n_chars],
+        character_start_times_seconds=starts[:n_chars],
+        character_end_times_seconds=ends[:n_chars],
+    )
@@ -0,0 +1,56 @@
+import threading
+
+from models.schemas import AlignmentSchema
+from providers.cache import CachedSpeech, SpeechCache, StoryCache
+
+
+def _run_threads(target, n: int = 8) -> list:
+    errors = []
+
+    def run(i: int) -> None:
+        try:
+            target(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_speech_cache_shared_by_threads(tmp_path):
+    alignment = AlignmentSchema(
+        characters=list("hi"),
+        character_start_times_seconds=[0.0, 0.1],
+        character_end_times_seconds=[0.1, 0.2],
+    )
+    # room for a few entries, so that writers also evict each other's files
+    cache = SpeechCache(str(tmp_path), max_bytes=20_000)
+
+    def write(i: int) -> None:
+        for j in range(50):
+            key = SpeechCache.key(f"text {j % 5}", "voice", "model", 1.0)
+            audio = bytes([j % 5]) * 4000
+            cache.set(key, CachedSpeech(audio, alignment, alignment))
+            got = cache.get(key)
+            assert got is None or len(got.audio) == 4000
+
+    assert _run_threads(write) == []
+    assert not list(tmp_path.glob("*.tmp"))
+    assert sum(f.stat().st_size for f in tmp_path.glob("*.tts")) <= 20_000
+
+
+def test_story_cache_shared_by_threads(tmp_path):
+    cache = StoryCache(str(tmp_path))
+    answer = '{"title": "' + "x" * 10_000 + '"}'
+
+    def write(i: int) -> None:
+        for _ in range(50):
+            cache.set("key", answer)
+            assert cache.get("key") == answer
+
+    assert _run_threads(write) == []
+    assert not list(tmp_path.glob("*.tmp"))
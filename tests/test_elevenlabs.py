@@ -0,0 +1,96 @@
+import httpx
+import pytest
+from elevenlabs import ElevenLabs
+from elevenlabs.core.api_error import ApiError
+from models import configs
+from providers import elevenlabs, session
+
+
+class FakeClient:
+    def __init__(self, text_to_speech):
+        self.text_to_speech = text_to_speech
+
+
+@pytest.fixture
+def synthesizer_with(monkeypatch):
+    """Build synthesizers whose requests go through a rate-limited transport
+    answering with `handler`, counting requests and sleeps."""
+    for name, value in {
+        "ELEVENLABS_API_KEY": "fake",
+        "ELEVENLABS_MODEL_ID": "fake",
+        "ELEVENLABS_MALE_VOICE_ID": "male",
+        "ELEVENLABS_FEMALE_VOICE_ID": "female",
+        "ELEVENLABS_SPEED": "1.0",
+    }.items():
+        monkeypatch.setenv(name, value)
+    configs._load_config.cache_clear()
+    sleeps = []
+    monkeypatch.setattr(session.time, "sleep", sleeps.append)
+
+    def make(handler, retries: int = 3):
+        requests = []
+
+        def count(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            return handler(request)
+
+        transport = session.RateLimitedTransport(
+            httpx.MockTransport(count), "test", session.TokenBucket(0), retries
+        )
+        client = ElevenLabs(
+            api_key="fake",
+            base_url="http://stub",
+            httpx_client=httpx.Client(transport=transport),
+        )
+        synthesizer = elevenlabs.SpeechSynthesizer(
+            use_cache=False, client=FakeClient(client.text_to_speech)
+        )
+        return synthesizer, requests, sleeps
+
+    yield make
+    configs._load_config.cache_clear()
+
+
+@pytest.mark.parametrize("status", [401, 403, 422])
+def test_rejected_requests_fail_at_once(synthesizer_with, status):
+    synthesizer, requests, sleeps = synthesizer_with(
+        lambda request: httpx.Response(status, json={"detail": "rejected"})
+    )
+    with pytest.raises(ApiError):
+        synthesizer.generate_speech(text="Hello.")
+    assert len(requests) == 1
+    assert sleeps == []
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_failed_responses_are_retried_once_per_attempt(synthesizer_with, status):
+    synthesizer, requests, _ = synthesizer_with(
+        lambda request: httpx.Response(status, headers={"retry-after": "0"}),
+        retries=3,
+    )
+    with pytest.raises(ApiError):
+        synthesizer.generate_speech(text="Hello.")
+    # the transport retries, neither the SDK nor the synthesizer add attempts
+    assert len(requests) == 4
+
+
+def test_timeouts_are_retried(synthesizer_with):
+    def timeout(request: httpx.Request) -> httpx.Response:
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    synthesizer, requests, sleeps = synthesizer_with(timeout, retries=2)
+    with pytest.raises(httpx.ReadTimeout):
+        synthesizer.generate_speech(text="Hello.")
+    assert len(requests) == 3
+    assert len(sleeps) == 2
+
+
+def test_programming_errors_are_not_retried(synthesizer_with):
+    def broken(request: httpx.Request) -> httpx.Response:
+        raise ValueError("bug")
+
+    synthesizer, requests, sleeps = synthesizer_with(broken)
+    with pytest.raises(ValueError):
+        synthesizer.generate_speech(text="Hello.")
+    assert len(requests) == 1
+    assert sleeps == []
@@ -0,0 +1,59 @@
+import threading
+
+import numpy as np
+from core.ffmpeg import probe
+from core.formats import OutputProfile, render_karaoke_formats
+from core.karaoke import ImageCache
+
+from tests.helpers import FONT_PATH, make_alignment
+
+
+def test_image_cache_shared_by_threads(tmp_path):
+    cache = ImageCache(max_bytes=4 * 1024, disk_dir=str(tmp_path))
+    errors = []
+
+    def hammer(seed: int) -> None:
+        rng = np.random.default_rng(seed)
+        try:
+            for _ in range(500):
+                key = (int(rng.integers(32)),)
+                if cache.get(key) is None:
+                    cache.set(key, np.full((16, 16, 4), key[0], dtype=np.uint8))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=hammer, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert cache.stats.evictions > 0
+    assert cache.nbytes == sum(v.nbytes for v in cache._cache.values())
+    assert cache.nbytes <= cache.max_bytes
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_formats_share_a_small_cache(media_dir, tmp_path):
+    # a budget of a few captions forces evictions while the outputs render
+    cache = ImageCache(max_bytes=64 * 1024, disk_dir=str(tmp_path / "images"))
+    outputs = {
+        str(tmp_path / "tall.mp4"): OutputProfile(180, 320),
+        str(tmp_path / "wide.mp4"): OutputProfile(320, 180, fit="pad"),
+        str(tmp_path / "square.mp4"): OutputProfile(240, 240, fps=15),
+    }
+    render_karaoke_formats(
+        str(media_dir / "background.mp4"),
+        str(media_dir / "speech.mp3"),
+        make_alignment(40),
+        outputs,
+        FONT_PATH,
+        cache=cache,
+    )
+
+    assert cache.stats.evictions > 0
+    for output_path, profile in outputs.items():
+        info = probe(output_path)
+        assert tuple(info["video_size"]) == (profile.width, profile.height)
+        assert abs(info["duration"] - 3.0) < 0.2
@@ -0,0 +1,47 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), "..", "src", "podcaster")
+# same default as benchmarks/import_time.py
+BUDGET_MS = 100.0
+# packages only the commands that need them may load
+HEAVY = ("moviepy", "langchain", "langchain_core", "langchain_openai", "elevenlabs")
+
+_LINE = re.compile(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s*main$")
+
+
+def _import_main() -> tuple[float, list[str]]:
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "import json, sys, main; print(json.dumps(sorted(sys.modules)))",
+        ],
+        cwd=SOURCE_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative_us = next(
+        int(match.group(1))
+        for match in map(_LINE.match, result.stderr.splitlines())
+        if match
+    )
+    return cumulative_us / 1000, json.loads(result.stdout)
+
+
+def test_main_does_not_load_heavy_packages():
+    _, modules = _import_main()
+    loaded = sorted({m.split(".")[0] for m in modules} & set(HEAVY))
+    assert loaded == []
+
+
+def test_main_imports_within_budget():
+    # best of a few runs, the first one may pay for a cold disk cache
+    best = min(_import_main()[0] for _ in range(5))
+    assert best <= BUDGET_MS, f"import main took {best:.1f} ms"
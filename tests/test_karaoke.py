@@ -0,0 +1,59 @@
+import os
+import shutil
+
+import numpy as np
+from core import karaoke
+from core.karaoke import ImageCache, render_two_line_image
+
+from tests.helpers import FONT_PATH
+
+
+def _image(value: int) -> np.ndarray:
+    return np.full((32, 32, 4), value, dtype=np.uint8)  # 4 KiB
+
+
+def _save(path, value) -> str:
+    np.save(path, value)
+    return str(path)
+
+
+def test_disk_tier_stays_within_its_budget(tmp_path):
+    entry_bytes = os.path.getsize(_save(tmp_path / "probe.npy", _image(0)))
+    os.remove(tmp_path / "probe.npy")
+    cache = ImageCache(disk_dir=str(tmp_path), disk_max_bytes=5 * entry_bytes)
+    for i in range(20):
+        cache.set((i,), _image(i))
+        # keep the first image recently used
+        os.utime(cache._disk_path((0,)), (1e10, 1e10))
+
+    files = list(tmp_path.glob("*.npy"))
+    assert sum(f.stat().st_size for f in files) <= 5 * entry_bytes
+    assert cache.stats.disk_evictions == 15
+    assert os.path.exists(cache._disk_path((0,)))
+    assert os.path.exists(cache._disk_path((19,)))
+
+    # a fresh process finds what is left on disk
+    cold = ImageCache(disk_dir=str(tmp_path), disk_max_bytes=5 * entry_bytes)
+    assert cold.get((19,)) is not None
+    assert cold.get((1,)) is None
+
+
+def test_replaced_font_is_not_served_from_disk(tmp_path):
+    font_path = str(tmp_path / "font.ttf")
+    shutil.copy(FONT_PATH, font_path)
+    words = ("hello", "world")
+
+    def render(disk_dir) -> np.ndarray:
+        karaoke.font_stamp.cache_clear()
+        karaoke.load_font.cache_clear()
+        karaoke.render_word.cache_clear()
+        return render_two_line_image(
+            words, 1, 0, 400, font_path, 40, ImageCache(disk_dir=str(disk_dir))
+        )
+
+    first = render(tmp_path / "images")
+    shutil.copy(FONT_PATH.replace("DejaVuSans", "DejaVuSans-Bold"), font_path)
+    os.utime(font_path, ns=(0, 1))
+    second = render(tmp_path / "images")
+    assert not np.array_equal(first, second)
+    assert np.array_equal(second, render(tmp_path / "fresh"))
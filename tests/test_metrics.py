@@ -0,0 +1,78 @@
+import json
+import os
+
+from core.metrics import Metrics, write_prometheus
+
+
+def _samples(prometheus_path) -> dict:
+    samples = {}
+    for line in open(prometheus_path, encoding="utf-8"):
+        if not line.startswith("#"):
+            metric, value = line.rsplit(" ", 1)
+            samples[metric] = float(value)
+    return samples
+
+
+def _metrics(tmp_path) -> Metrics:
+    return Metrics(
+        enabled=True,
+        jsonl_path=str(tmp_path / "metrics.jsonl"),
+        prometheus_path=str(tmp_path / "podcaster.prom"),
+    )
+
+
+def test_flush_adds_only_new_records(tmp_path):
+    # two collectors stand for two processes sharing the files
+    first, second = _metrics(tmp_path), _metrics(tmp_path)
+    for metrics in (first, second):
+        with metrics.span("render"):
+            metrics.count("frames_rendered", 10, renderer="pipe")
+        metrics.flush()
+    with first.span("render"):
+        pass
+    first.flush()
+
+    samples = _samples(tmp_path / "podcaster.prom")
+    assert samples['podcaster_stage_runs_total{stage="render"}'] == 3
+    assert samples['podcaster_frames_rendered_total{renderer="pipe"}'] == 20
+
+    state = json.load(open(str(tmp_path / "podcaster.prom.state")))
+    assert state["offset"] == os.path.getsize(tmp_path / "metrics.jsonl")
+
+
+def test_history_is_not_read_again(tmp_path):
+    metrics = _metrics(tmp_path)
+    metrics.count("frames_rendered", 5)
+    metrics.flush()
+    # lines before the offset are not parsed again, even if unreadable now
+    jsonl_path = tmp_path / "metrics.jsonl"
+    size = os.path.getsize(jsonl_path)
+    with open(jsonl_path, "r+b") as file:
+        file.write(b"x" * (size - 1))
+    metrics.count("frames_rendered", 1)
+    metrics.flush()
+
+    samples = _samples(tmp_path / "podcaster.prom")
+    assert samples["podcaster_frames_rendered_total"] == 6
+
+
+def test_partial_and_rotated_lines(tmp_path):
+    jsonl_path = tmp_path / "metrics.jsonl"
+    prometheus_path = tmp_path / "podcaster.prom"
+    record = {"type": "counter", "name": "tts_chars", "labels": {}, "value": 100}
+    line = json.dumps(record)
+    jsonl_path.write_text(line + "\n" + line[:10])
+    write_prometheus(str(jsonl_path), str(prometheus_path))
+    assert _samples(prometheus_path)["podcaster_tts_chars_total"] == 100
+
+    # the rest of the line arrives
+    with open(jsonl_path, "a") as file:
+        file.write(line[10:] + "\n")
+    write_prometheus(str(jsonl_path), str(prometheus_path))
+    assert _samples(prometheus_path)["podcaster_tts_chars_total"] == 200
+
+    # rotated: the new file is added to the totals
+    os.remove(jsonl_path)
+    jsonl_path.write_text(line + "\n")
+    write_prometheus(str(jsonl_path), str(prometheus_path))
+    assert _samples(prometheus_path)["podcaster_tts_chars_total"] == 300
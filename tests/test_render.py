@@ -0,0 +1,36 @@
+from core import render
+from core.ffmpeg import probe
+
+from tests.helpers import FONT_PATH, make_alignment
+
+
+def _render(media_dir, output_path, **kwargs) -> None:
+    render.render_karaoke_video(
+        str(media_dir / "background.mp4"),
+        str(media_dir / "speech.mp3"),
+        make_alignment(40),
+        str(output_path),
+        FONT_PATH,
+        **kwargs,
+    )
+
+
+def test_shards_are_capped_by_the_cores(media_dir, tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        render,
+        "render_karaoke_video_sharded",
+        lambda *args, **kwargs: calls.append((kwargs["shards"], kwargs["cores"])),
+    )
+    _render(media_dir, tmp_path / "video.mp4", shards=4, cores=2)
+    assert calls == [(2, 2)]
+
+
+def test_one_core_renders_without_shards(media_dir, tmp_path, monkeypatch):
+    def sharded(*args, **kwargs):
+        raise AssertionError("rendered in shards")
+
+    monkeypatch.setattr(render, "render_karaoke_video_sharded", sharded)
+    output_path = tmp_path / "video.mp4"
+    _render(media_dir, output_path, shards=4, cores=1)
+    assert abs(probe(str(output_path))["duration"] - 3.0) < 0.2
@@ -0,0 +1,21 @@
+import pytest
+from models.schemas import JobSchema
+from pydantic import ValidationError
+
+FORMATS = [{"name": "wide", "width": 320, "height": 180}]
+
+
+def test_formats_with_the_default_backend():
+    job = JobSchema(topic="t", background_path="b.mp4", formats=FORMATS)
+    assert job.render.backend == "moviepy"
+
+
+@pytest.mark.parametrize("backend", ["ass", "pipe", "overlay"])
+def test_formats_reject_another_backend(backend):
+    with pytest.raises(ValidationError, match="does not apply"):
+        JobSchema(
+            topic="t",
+            background_path="b.mp4",
+            render={"backend": backend},
+            formats=FORMATS,
+        )
@@ -0,0 +1,142 @@
+"""The columnar engine against the word-by-word implementation it replaced."""
+
+import random
+from typing import List
+
+import pytest
+from core.karaoke import (
+    SegmentSpan,
+    TwoLineSegment,
+    WordSpan,
+    alignment_to_two_lines,
+    alignment_to_words,
+    words_to_segments,
+)
+from models.schemas import AlignmentSchema
+
+from tests.helpers import make_alignment
+
+
+def reference_words(chars, starts, ends) -> List[WordSpan]:
+    out, buf, start, end = [], [], None, None
+    for ch, st, en in zip(chars, starts, ends):
+        if ch.isspace():
+            if buf:
+                out.append(WordSpan("".join(buf), start, end))
+            buf, start = [], None
+        else:
+            if start is None:
+                start = float(st)
+            buf.append(ch)
+            end = float(en)
+    if buf:
+        out.append(WordSpan("".join(buf), start, end))
+    return out
+
+
+def reference_segments(words, max_chars, max_duration) -> List[SegmentSpan]:
+    segments, cur, cur_len, seg_start = [], [], 0, None
+    for w in words:
+        add_len = (1 if cur else 0) + len(w.text)
+        if seg_start is None:
+            seg_start = w.start
+        if cur and (cur_len + add_len > max_chars or w.end - seg_start > max_duration):
+            segments.append(SegmentSpan(seg_start, cur[-1].end, tuple(cur)))
+            cur, cur_len, seg_start = [w], len(w.text), w.start
+            continue
+        cur.append(w)
+        cur_len += add_len
+    if cur:
+        segments.append(SegmentSpan(seg_start, cur[-1].end, tuple(cur)))
+    return segments
+
+
+def reference_two_lines(seg, max_chars_per_line) -> TwoLineSegment:
+    words, n = seg.words, len(seg.words)
+    if n <= 1:
+        return TwoLineSegment(seg.start, seg.end, words, cut_index=n)
+
+    def joined_len(ws) -> int:
+        return sum(len(w.text) for w in ws) + len(ws) - 1 if ws else 0
+
+    best_cut, best_score = 1, float("inf")
+    for cut in range(1, n):
+        l1, l2 = joined_len(words[:cut]), joined_len(words[cut:])
+        penalty = max(l1 - max_chars_per_line, 0) * 10
+        penalty += max(l2 - max_chars_per_line, 0) * 10
+        score = abs(l1 - l2) + penalty
+        if score < best_score:
+            best_cut, best_score = cut, score
+    return TwoLineSegment(seg.start, seg.end, words, cut_index=best_cut)
+
+
+def reference(alignment, max_chars, max_duration, max_chars_per_line):
+    words = reference_words(
+        alignment.characters,
+        alignment.character_start_times_seconds,
+        alignment.character_end_times_seconds,
+    )
+    return [
+        reference_two_lines(seg, max_chars_per_line)
+        for seg in reference_segments(words, max_chars, max_duration)
+    ]
+
+
+def _from_text(text: str, seconds_per_char, seed: int = 0) -> AlignmentSchema:
+    rng = random.Random(seed)
+    starts, ends, t = [], [], 0.0
+    for _ in text:
+        starts.append(t)
+        t += seconds_per_char * rng.uniform(0.5, 1.5)
+        ends.append(t)
+    return AlignmentSchema(
+        characters=list(text),
+        character_start_times_seconds=starts,
+        character_end_times_seconds=ends,
+    )
+
+
+ALIGNMENTS = {
+    "punctuation": make_alignment(3000, seed=1),
+    "whitespace": _from_text(
+        "  Well,\tshe said —\n\n“no.”  Then…  silence!  　Końcówka?  ", 0.07
+    ),
+    "long_words": _from_text(
+        "a " + "x" * 75 + " tiny " + "Supercalifragilisticexpialidocious" * 2 + " b",
+        0.01,
+    ),
+    # slow speech: segments are cut by max_segment_duration, not by length
+    "slow": make_alignment(600, seed=2, words=("so", "slowly", "it", "went.")),
+    "single_word": _from_text("Hello", 0.1),
+    "empty": _from_text("", 0.1),
+}
+OPTIONS = [(60, 2.8, 20), (25, 0.6, 12), (200, 1000.0, 80), (10, 0.2, 4)]
+
+
+@pytest.mark.parametrize("name", sorted(ALIGNMENTS))
+@pytest.mark.parametrize("options", OPTIONS)
+def test_two_lines_match_the_reference(name, options):
+    alignment = ALIGNMENTS[name]
+    assert alignment_to_two_lines(alignment, *options) == reference(alignment, *options)
+
+
+@pytest.mark.parametrize("name", sorted(ALIGNMENTS))
+def test_words_and_segments_match_the_reference(name):
+    alignment = ALIGNMENTS[name]
+    args = (
+        alignment.characters,
+        alignment.character_start_times_seconds,
+        alignment.character_end_times_seconds,
+    )
+    words = alignment_to_words(*args)
+    assert words == reference_words(*args)
+    for max_chars, max_duration, _ in OPTIONS:
+        assert words_to_segments(words, max_chars, max_duration) == (
+            reference_segments(words, max_chars, max_duration)
+        )
+
+
+def test_duration_cuts_are_exercised():
+    two_lines = alignment_to_two_lines(ALIGNMENTS["slow"], 200, 0.6, 20)
+    assert max(len(" ".join(w.text for w in s.words)) for s in two_lines) < 200
+    assert len(two_lines) > 10